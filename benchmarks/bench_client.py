@@ -0,0 +1,238 @@
+# coding: utf-8
+#
+"""
+Client throughput against the bundled fake WDA: commands/s, p50/p99 latency and memory
+for sequential, threaded and asyncio clients
+
+Usage (with wdapy installed, e.g. pip install -e .):
+    python benchmarks/bench_client.py [--ops 2000] [--threads 8] [--latency 0.002] [--workload mixed]
+    python benchmarks/bench_client.py --json result.json
+    python benchmarks/bench_client.py --baseline result.json --tolerance 0.15  # exit 1 on regression
+    python benchmarks/bench_client.py --workload tap --latency 0.02 --min-speedup 3  # exit 1 if threads don't scale
+    python benchmarks/bench_client.py --replay wda.jsonl  # client-side cost only, see wdapy.transport
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from wdapy import AppiumClient, AsyncAppiumClient
+from wdapy.testing.wda import FakeWDA
+from wdapy.transport import ReplayTransport
+
+WORKLOADS = {
+    "tap": ["tap"],
+    "status": ["status"],
+    "mixed": ["tap", "tap", "tap", "is_locked", "window_size", "screenshot_raw", "source"],
+}
+
+
+def run_command(client, name: str):
+    if name == "tap":
+        return client.tap(100, 200)
+    if name == "source":
+        return client.sourcetree()
+    return getattr(client, name)()
+
+
+async def arun_command(client, name: str):
+    if name == "tap":
+        return await client.tap(100, 200)
+    if name == "source":
+        return await client.sourcetree()
+    return await getattr(client, name)()
+
+
+def _serve(queue: multiprocessing.Queue, stop: multiprocessing.Event, kwargs: dict):
+    with FakeWDA(**kwargs) as wda:
+        queue.put(wda.url)
+        stop.wait()
+
+
+class Server:
+    """ FakeWDA in a child process, so the server does not share the GIL with the client """
+
+    def __init__(self, inprocess: bool, **kwargs):
+        self.inprocess = inprocess
+        self.kwargs = kwargs
+
+    def __enter__(self) -> str:
+        if self.inprocess:
+            self._wda = FakeWDA(**self.kwargs).start()
+            return self._wda.url
+        self._queue = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        self._proc = multiprocessing.Process(target=_serve, args=(self._queue, self._stop, self.kwargs), daemon=True)
+        self._proc.start()
+        return self._queue.get(timeout=10)
+
+    def __exit__(self, *args):
+        if self.inprocess:
+            self._wda.close()
+        else:
+            self._stop.set()
+            self._proc.join(5)
+
+
+def make_client(cls, url: str, replay: typing.Optional[str]):
+    client = cls(url)
+    if replay:
+        client.transport = ReplayTransport(replay)
+    return client
+
+
+def sequential(url: str, commands: typing.List[str], replay: typing.Optional[str]) -> typing.List[float]:
+    client = make_client(AppiumClient, url, replay)
+    latencies = []
+    for name in commands:
+        start = time.perf_counter()
+        run_command(client, name)
+        latencies.append(time.perf_counter() - start)
+    client.close()
+    return latencies
+
+
+def threaded(url: str, commands: typing.List[str], replay: typing.Optional[str], threads: int) -> typing.List[float]:
+    client = make_client(AppiumClient, url, replay)
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(names: typing.List[str]):
+        local = []
+        for name in names:
+            start = time.perf_counter()
+            run_command(client, name)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    with ThreadPoolExecutor(threads) as ex:
+        for f in [ex.submit(worker, commands[i::threads]) for i in range(threads)]:
+            f.result()
+    client.close()
+    return latencies
+
+
+def async_run(url: str, commands: typing.List[str], replay: typing.Optional[str], concurrency: int) \
+        -> typing.List[float]:
+    async def main():
+        client = make_client(AsyncAppiumClient, url, replay)
+        latencies = []
+
+        async def worker(names: typing.List[str]):
+            for name in names:
+                start = time.perf_counter()
+                await arun_command(client, name)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[worker(commands[i::concurrency]) for i in range(concurrency)])
+        client.close()
+        return latencies
+
+    return asyncio.run(main())
+
+
+def measure(name: str, fn: typing.Callable[[typing.List[str]], typing.List[float]],
+            commands: typing.List[str], mem_commands: typing.List[str]) -> dict:
+    fn(commands[:50])  # warm up: session, connections
+    start = time.perf_counter()
+    latencies = fn(commands)
+    elapsed = time.perf_counter() - start
+
+    # separate pass, tracemalloc slows everything down
+    tracemalloc.start()
+    fn(mem_commands)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    q = statistics.quantiles(latencies, n=100)
+    return {
+        "name": name,
+        "ops": len(latencies),
+        "cmds_per_sec": len(latencies) / elapsed,
+        "p50_ms": q[49] * 1000,
+        "p99_ms": q[98] * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def compare(results: typing.List[dict], baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    ok = True
+    for r in results:
+        base = baseline.get(r["name"])
+        if base is None:
+            continue
+        ratio = r["cmds_per_sec"] / base["cmds_per_sec"]
+        status = "ok"
+        if ratio < 1 - tolerance:
+            status = "REGRESSION"
+            ok = False
+        print(f"{r['name']:<16s} {ratio * 100:6.1f}% of baseline  {status}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000, help="commands per scenario")
+    parser.add_argument("--threads", type=int, default=8, help="threads and asyncio concurrency")
+    parser.add_argument("--latency", type=float, default=0.002, help="fake WDA latency per request, seconds")
+    parser.add_argument("--screenshot-size", type=int, default=300_000)
+    parser.add_argument("--source-size", type=int, default=100_000)
+    parser.add_argument("--workload", choices=list(WORKLOADS), default="mixed")
+    parser.add_argument("--inprocess", action="store_true", help="run fake WDA in this process")
+    parser.add_argument("--replay", help="serve from a RecordingTransport file instead of fake WDA")
+    parser.add_argument("--json", help="write results to file")
+    parser.add_argument("--baseline", help="compare cmds/s with a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--min-speedup", type=float, help="exit 1 if threaded cmds/s < sequential * this")
+    args = parser.parse_args()
+
+    workload = WORKLOADS[args.workload]
+    commands = [workload[i % len(workload)] for i in range(args.ops)]
+    mem_commands = commands[:max(50, args.ops // 10)]
+
+    server = Server(args.inprocess, latency=args.latency, screenshot_size=args.screenshot_size,
+                    source_size=args.source_size)
+    url = "http://replay.invalid" if args.replay else server.__enter__()
+    try:
+        print(f"workload={args.workload} ops={args.ops} threads={args.threads} latency={args.latency}s")
+        results = [
+            measure("sequential", lambda cmds: sequential(url, cmds, args.replay), commands, mem_commands),
+            measure(f"threaded-{args.threads}", lambda cmds: threaded(url, cmds, args.replay, args.threads),
+                    commands, mem_commands),
+            measure(f"async-{args.threads}", lambda cmds: async_run(url, cmds, args.replay, args.threads),
+                    commands, mem_commands),
+        ]
+    finally:
+        if not args.replay:
+            server.__exit__()
+    for r in results:
+        r["speedup"] = r["cmds_per_sec"] / results[0]["cmds_per_sec"]
+
+    print(f"{'scenario':<16s} {'cmds/s':>10s} {'speedup':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'peak KiB':>10s}")
+    for r in results:
+        print(f"{r['name']:<16s} {r['cmds_per_sec']:10.1f} {r['speedup']:7.1f}x {r['p50_ms']:8.2f} {r['p99_ms']:8.2f} "
+              f"{r['peak_kib']:10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+    if args.min_speedup and results[1]["speedup"] < args.min_speedup:
+        print(f"threaded speedup {results[1]['speedup']:.1f}x < {args.min_speedup}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# coding: utf-8
+#
+"""
+Throughput of the usbmux port forwarder: concurrent tunnels to an echo server behind the fake usbmuxd
+
+Usage (with wdapy installed, e.g. pip install -e .):
+    python benchmarks/bench_forward.py [--tunnels 1,8,32] [--size 16] [--buffer 262144]
+"""
+
+import argparse
+import socket
+import socketserver
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wdapy.testing.usbmuxd import FakeUsbmuxd
+from wdapy.usbmux.forward import BUFFER_SIZE, Forwarder
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        buf = bytearray(1 << 20)
+        while True:
+            n = self.request.recv_into(buf)
+            if not n:
+                break
+            self.request.sendall(memoryview(buf)[:n])
+
+
+def transfer(port: int, payload: bytes):
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        t = threading.Thread(target=s.sendall, args=(payload,))
+        t.start()
+        buf = bytearray(1 << 20)
+        left = len(payload)
+        while left:
+            n = s.recv_into(buf)
+            assert n, "tunnel closed early"
+            left -= n
+        t.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tunnels", default="1,8,32", help="comma separated concurrent tunnel counts")
+    parser.add_argument("--size", type=int, default=16, help="MB echoed through each tunnel")
+    parser.add_argument("--buffer", type=int, default=BUFFER_SIZE, help="forwarder read size, bytes")
+    args = parser.parse_args()
+
+    echo = socketserver.ThreadingTCPServer(("127.0.0.1", 0), EchoHandler)
+    echo.daemon_threads = True
+    threading.Thread(target=echo.serve_forever, daemon=True).start()
+    payload = b"x" * (args.size << 20)
+
+    print(f"{'tunnels':>8s} {'total MB/s':>11s} {'p50 tunnel MB/s':>16s}")
+    with FakeUsbmuxd(devices=1, ports={7000: echo.server_address}) as usbmuxd, \
+            Forwarder(usbmux_address=usbmuxd.address, buffer_size=args.buffer) as forwarder:
+        port = forwarder.add(0, 7000)
+        transfer(port, payload[:1024])  # warm up
+        while forwarder.tunnels:
+            time.sleep(0.01)
+        for n in [int(v) for v in args.tunnels.split(",")]:
+            skip = len(forwarder.closed_tunnels)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(n) as pool:
+                list(pool.map(lambda _: transfer(port, payload), range(n)))
+            elapsed = time.perf_counter() - start
+            while len(forwarder.closed_tunnels) < skip + n:
+                time.sleep(0.01)
+            rates = [t.throughput / 2 / (1 << 20) for t in forwarder.closed_tunnels[skip:]]
+            print(f"{n:8d} {n * args.size / elapsed:11.1f} {statistics.median(rates):16.1f}")
+    echo.shutdown()
+
+
+if __name__ == "__main__":
+    main()
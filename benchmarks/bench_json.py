@@ -0,0 +1,73 @@
+# coding: utf-8
+#
+"""
+Compare response decode cost on a large /screenshot payload
+
+Usage (with wdapy installed, e.g. pip install -e .):
+    python benchmarks/bench_json.py [--size-mb 4] [--rounds 20]
+"""
+
+import argparse
+import base64
+import json
+import os
+import time
+from unittest.mock import MagicMock
+
+from wdapy import AppiumClient
+from wdapy._proto import GET
+from wdapy._base import HTTPResponseWrapper
+from wdapy._codec import JSONCodec, default_codec
+
+
+def legacy_parse(resp: HTTPResponseWrapper, payload=None) -> dict:
+    """ pipeline before the change: dumps for debug line, then json.loads three times """
+    json.dumps(payload or "", ensure_ascii=False)
+    short_json = resp.json().copy()
+    for k, v in short_json.items():
+        if isinstance(v, str) and len(v) > 40:
+            v = v[:20] + "... skip ..." + v[-10:]
+        short_json[k] = v
+    value = resp.json().get("value")
+    if value and isinstance(value, dict) and value.get("error"):
+        raise RuntimeError(value)
+    return resp.json()
+
+
+def bench(name: str, fn, rounds: int):
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{name:<24s} {elapsed * 1000:8.2f} ms/op")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    png = os.urandom(int(args.size_mb * 1024 * 1024 * 3 / 4))
+    content = json.dumps({"value": base64.b64encode(png).decode(), "sessionId": "bench"}).encode()
+    resp = HTTPResponseWrapper(content, 200)
+    print(f"payload: {len(content) / 1024 / 1024:.1f} MB")
+
+    client = AppiumClient()
+    client._request_http = MagicMock(return_value=resp)
+
+    base = bench("legacy (3x json.loads)", lambda: legacy_parse(resp), args.rounds)
+    client.json_codec = JSONCodec()
+    t = bench("single parse, json", lambda: client.request(GET, "/screenshot"), args.rounds)
+    print(f"{'':<24s} {base / t:8.2f}x")
+    codec = default_codec()
+    if codec.name != "json":
+        client.json_codec = codec
+        t = bench(f"single parse, {codec.name}", lambda: client.request(GET, "/screenshot"), args.rounds)
+        print(f"{'':<24s} {base / t:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
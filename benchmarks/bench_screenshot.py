@@ -0,0 +1,73 @@
+# coding: utf-8
+#
+"""
+Compare the cost of each screenshot output mode, request/response parsing excluded
+
+Usage (with wdapy installed, e.g. pip install -e .):
+    python benchmarks/bench_screenshot.py [--width 1170 --height 2532] [--rounds 10]
+"""
+
+import argparse
+import base64
+import io
+import os
+import tempfile
+import time
+from unittest.mock import MagicMock
+
+from PIL import Image
+
+from wdapy import AppiumClient
+from wdapy._proto import GET
+
+
+def bench(name: str, fn, rounds: int):
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{name:<28s} {elapsed * 1000:8.2f} ms/op")
+
+
+def legacy_screenshot(client: AppiumClient) -> Image.Image:
+    """ screenshot() before output modes were added """
+    value = client.request(GET, "/screenshot")["value"]
+    raw_value = base64.b64decode(value)
+    return Image.open(io.BytesIO(raw_value)).convert("RGB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1170)
+    parser.add_argument("--height", type=int, default=2532)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    # noisy image, so PNG size is close to a real screen
+    im = Image.frombytes("RGB", (args.width, args.height // 8), os.urandom(args.width * (args.height // 8) * 3))
+    im = im.resize((args.width, args.height))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG")
+    value = base64.b64encode(buf.getvalue()).decode()
+    print(f"png: {len(buf.getvalue()) / 1024 / 1024:.1f} MB, {args.width}x{args.height}")
+
+    client = AppiumClient()
+    client.request = MagicMock(return_value={"value": value})
+
+    bench("legacy screenshot()", lambda: legacy_screenshot(client), args.rounds)
+    bench("screenshot()", client.screenshot, args.rounds)
+    bench("screenshot(lazy=True)", lambda: client.screenshot(lazy=True), args.rounds)
+    bench("screenshot_raw()", client.screenshot_raw, args.rounds)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "screenshot.png")
+        bench("save_screenshot(path)", lambda: client.save_screenshot(path), args.rounds)
+    try:
+        import numpy  # noqa: F401
+        bench("screenshot_ndarray()", client.screenshot_ndarray, args.rounds)
+    except ImportError:
+        print("screenshot_ndarray()          skipped, numpy not installed")
+
+
+if __name__ == "__main__":
+    main()
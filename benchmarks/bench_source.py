@@ -0,0 +1,85 @@
+# coding: utf-8
+#
+"""
+Element lookups on a /source page: ElementTree scans vs the parsed, indexed ParsedSource,
+and comparing two snapshots: element by element vs subtree hashes
+
+Usage (with wdapy installed, e.g. pip install -e .):
+    python benchmarks/bench_source.py [--size 500000] [--lookups 50]
+"""
+
+import argparse
+import time
+import xml.etree.ElementTree as ET
+
+from wdapy._diff import diff_snapshots, structure_hash
+from wdapy._source import ParsedSource
+from wdapy.testing.wda import make_source
+
+
+def timed(fn, number: int = 5) -> float:
+    """ best of number runs, seconds """
+    best = float("inf")
+    for _ in range(number):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=500_000, help="characters of the source XML")
+    parser.add_argument("--lookups", type=int, default=50, help="lookups per screen")
+    args = parser.parse_args()
+
+    source = make_source(args.size)
+    tree = ParsedSource.from_xml(source)
+    root = ET.fromstring(source)
+    cells = len(tree.by_type("Cell"))
+    names = [f"more-{i * cells // args.lookups}" for i in range(args.lookups)]
+    print(f"source {len(source)} chars, {len(tree)} elements, {args.lookups} lookups per screen")
+
+    def et_scan():
+        for name in names:
+            next(e for e in root.iter() if e.get("name") == name)
+
+    def et_xpath():
+        for name in names:
+            root.find(f".//XCUIElementTypeButton[@name='{name}']")
+
+    def indexed():
+        for name in names:
+            tree.find("Button", name=name)
+
+    def xpath():
+        for name in names:
+            tree.xpath(f"//Button[@name='{name}']")
+
+    changed = ParsedSource.from_xml(source.replace(f'name="{names[-1]}"', 'name="renamed"'))
+
+    def compare_all():
+        # what a wait-for-stable loop does without hashes: every element of both snapshots
+        return [(a.type, a.attrib) for a in tree.elements] == [(b.type, b.attrib) for b in changed.elements]
+
+    def hashed():
+        structure_hash(ParsedSource.from_xml(source))  # a new snapshot has no cached hashes
+
+    rows = [
+        ("parse ElementTree", timed(lambda: ET.fromstring(source))),
+        ("parse ParsedSource", timed(lambda: ParsedSource.from_xml(source))),
+        ("lookups ElementTree iter", timed(et_scan)),
+        ("lookups ElementTree find", timed(et_xpath)),
+        ("lookups ParsedSource find", timed(indexed)),
+        ("lookups ParsedSource xpath", timed(xpath)),
+        ("compare element by element", timed(compare_all)),
+        ("parse + structure_hash", timed(hashed)),
+        ("diff one change (hashed)", timed(lambda: diff_snapshots(tree, changed))),
+    ]
+    print(f"{'case':<28s} {'ms':>10s}")
+    for name, seconds in rows:
+        print(f"{name:<28s} {seconds * 1000:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
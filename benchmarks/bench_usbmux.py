@@ -0,0 +1,174 @@
+# coding: utf-8
+#
+"""
+usbmux layer against the bundled fake usbmuxd: device enumeration, select_device and
+Connect latency as the number of attached devices grows
+
+Usage (with wdapy installed, e.g. pip install -e .):
+    python benchmarks/bench_usbmux.py [--devices 1,10,100,500] [--rounds 20] [--protocol plist]
+    python benchmarks/bench_usbmux.py --latency 0.001  # slow daemon, seconds per reply
+    python benchmarks/bench_usbmux.py --mode complete --timeout 0.1  # the old fixed Listen window
+    python benchmarks/bench_usbmux.py --no-list-devices  # old daemon, fast mode falls back to Listen
+    python benchmarks/bench_usbmux.py --tunnel-pool 0  # first_request opens its tunnel on demand
+    python benchmarks/bench_usbmux.py --json result.json
+    python benchmarks/bench_usbmux.py --baseline result.json --tolerance 0.15  # exit 1 on regression
+"""
+
+import argparse
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+import typing
+
+from wdapy.testing.usbmuxd import FakeUsbmuxd
+from wdapy.testing.wda import FakeWDA
+from wdapy.usbmux import tunnels
+from wdapy.usbmux.pyusbmux import COMPLETE, FAST, USBMuxHTTPConnection, list_devices, select_device
+
+
+def _serve(queue: multiprocessing.Queue, stop: multiprocessing.Event, kwargs: dict):
+    with FakeWDA() as wda, FakeUsbmuxd(ports={8100: wda.address}, **kwargs) as usbmuxd:
+        queue.put((usbmuxd.address, [d.serial for d in usbmuxd.devices]))
+        stop.wait()
+
+
+class Server:
+    """ fake usbmuxd and the WDA behind it, in a child process unless inprocess """
+
+    def __init__(self, inprocess: bool, **kwargs):
+        self.inprocess = inprocess
+        self.kwargs = kwargs
+
+    def __enter__(self) -> typing.Tuple[str, typing.List[str]]:
+        if self.inprocess:
+            self._wda = FakeWDA().start()
+            self._usbmuxd = FakeUsbmuxd(ports={8100: self._wda.address}, **self.kwargs).start()
+            return self._usbmuxd.address, [d.serial for d in self._usbmuxd.devices]
+        self._queue = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        self._proc = multiprocessing.Process(target=_serve, args=(self._queue, self._stop, self.kwargs), daemon=True)
+        self._proc.start()
+        return self._queue.get(timeout=30)
+
+    def __exit__(self, *args):
+        if self.inprocess:
+            self._usbmuxd.close()
+            self._wda.close()
+        else:
+            self._stop.set()
+            self._proc.join(5)
+
+
+def timed(fn: typing.Callable[[], typing.Any], rounds: int,
+          between: typing.Callable[[], typing.Any] = lambda: None) -> typing.List[float]:
+    fn()  # warm up
+    latencies = []
+    for _ in range(rounds):
+        between()  # not measured
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summary(name: str, devices: int, latencies: typing.List[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "name": f"{name}-{devices}",
+        "devices": devices,
+        "rounds": len(latencies),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def run(address: str, serials: typing.List[str], rounds: int, mode: str, timeout: float) -> typing.List[dict]:
+    n = len(serials)
+    last = serials[-1]
+
+    def enumerate_devices():
+        devices = list_devices(address, mode=mode, timeout=timeout)
+        assert len(devices) == n, f"expect {n} devices, got {len(devices)}"
+
+    device = select_device(last, usbmux_address=address)
+
+    def connect():
+        device.connect(8100, usbmux_address=address).close()
+
+    def first_request():
+        with USBMuxHTTPConnection(device, 8100, usbmux_address=address) as conn:
+            conn.request("GET", "/status")
+            conn.getresponse().read()
+
+    def refilled():
+        # steady state: new connections now and then, not back to back
+        pool = tunnels.get_tunnel_pool(device, 8100, address)
+        while pool is not None and pool.idle < pool.size and not pool.closed:
+            time.sleep(0.0005)
+
+    return [
+        summary("list_devices", n, timed(enumerate_devices, rounds)),
+        summary("select_device", n, timed(lambda: select_device(last, usbmux_address=address, mode=mode), rounds)),
+        summary("connect", n, timed(connect, rounds * 5)),
+        summary("first_request", n, timed(first_request, rounds * 5, refilled)),
+    ]
+
+
+def compare(results: typing.List[dict], baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    ok = True
+    for r in results:
+        base = baseline.get(r["name"])
+        if base is None:
+            continue
+        ratio = r["p50_ms"] / base["p50_ms"]
+        status = "ok"
+        if ratio > 1 + tolerance:
+            status = "REGRESSION"
+            ok = False
+        print(f"{r['name']:<22s} {ratio * 100:6.1f}% of baseline p50  {status}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", default="1,10,100,500", help="comma separated device counts")
+    parser.add_argument("--rounds", type=int, default=20, help="enumerations per device count")
+    parser.add_argument("--protocol", choices=["plist", "binary"], default="plist")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake usbmuxd latency per reply, seconds")
+    parser.add_argument("--mode", choices=[FAST, COMPLETE], default=FAST, help="list_devices mode")
+    parser.add_argument("--timeout", type=float, default=1.0, help="list_devices Listen timeout, seconds")
+    parser.add_argument("--no-list-devices", action="store_true", help="fake usbmuxd rejects ListDevices")
+    parser.add_argument("--tunnel-pool", type=int, default=tunnels.DEFAULT_POOL_SIZE,
+                        help="tunnels kept ready per (device, port), 0 disables")
+    parser.add_argument("--inprocess", action="store_true", help="run fake usbmuxd in this process")
+    parser.add_argument("--json", help="write results to file")
+    parser.add_argument("--baseline", help="compare p50 with a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    tunnels.set_pool_size(args.tunnel_pool)
+    print(f"protocol={args.protocol} mode={args.mode} rounds={args.rounds} latency={args.latency}s "
+          f"tunnel_pool={args.tunnel_pool}")
+    results = []
+    for n in [int(v) for v in args.devices.split(",")]:
+        with Server(args.inprocess, devices=n, protocol=args.protocol, latency=args.latency,
+                    list_devices=not args.no_list_devices) as (address, serials):
+            results.extend(run(address, serials, args.rounds, args.mode, args.timeout))
+
+    print(f"{'scenario':<22s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for r in results:
+        print(f"{r['name']:<22s} {r['p50_ms']:8.2f} {r['p99_ms']:8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
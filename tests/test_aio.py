@@ -0,0 +1,124 @@
+# coding: utf-8
+#
+
+import asyncio
+import inspect
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from wdapy import AppiumClient, AppiumUSBClient, AsyncAppiumClient, AsyncAppiumUSBClient
+from wdapy._base import BaseClient
+from wdapy._wdapy import CommonClient
+from wdapy.aio import AsyncCommonClient
+from wdapy.actions import PointerAction, TouchActions
+from wdapy._proto import GET
+from wdapy.exceptions import RequestError
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def _reply(self, data: dict, status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path, None))
+        if self.path == "/status":
+            self._reply({"sessionId": None, "value": {"message": "ready", "ios": {"ip": "1.2.3.4"}}})
+        elif self.path == "/wda/locked":
+            self._reply({"value": True})
+        else:
+            self._reply({"value": {"error": "unknown command", "message": self.path}}, 404)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"null")
+        self.requests.append(("POST", self.path, payload))
+        if self.path == "/session":
+            self._reply({"sessionId": "s1", "value": {}})
+        else:
+            self._reply({"value": None})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+@pytest.fixture
+def wda_url():
+    _Handler.requests = []
+    srv = _Server(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_async_request(wda_url):
+    async def main():
+        async with AsyncAppiumClient(wda_url) as c:
+            st = await c.status()
+            assert st.ip == "1.2.3.4"
+            assert await c.is_locked() is True
+            await c.tap(10, 20)
+            await c.perform_actions([TouchActions.pointer("f", actions=[PointerAction.down(), PointerAction.up()])])
+            assert c.pool_stats["created"] == 1
+    asyncio.run(main())
+    paths = [(method, path) for method, path, _ in _Handler.requests]
+    assert ("POST", "/session") in paths
+    assert ("POST", "/session/s1/wda/tap") in paths
+    assert ("POST", "/session/s1/actions") in paths
+
+
+def test_async_request_error(wda_url):
+    async def main():
+        c = AsyncAppiumClient(wda_url)
+        with pytest.raises(RequestError):
+            await c.request(GET, "/unknown")
+    asyncio.run(main())
+
+
+def test_async_many_clients(wda_url):
+    async def main():
+        clients = [AsyncAppiumClient(wda_url) for _ in range(20)]
+        results = await asyncio.gather(*[c.is_locked() for c in clients for _ in range(5)])
+        assert all(results)
+        for c in clients:
+            c.close()
+    asyncio.run(main())
+
+
+# sync only on purpose: the MJPEG reader is a thread
+SYNC_ONLY = {"screen_stream"}
+
+
+@pytest.mark.parametrize("sync_cls,async_cls", [
+    (CommonClient, AsyncCommonClient),
+    (AppiumClient, AsyncAppiumClient),
+    (AppiumUSBClient, AsyncAppiumUSBClient),
+])
+def test_async_client_matches_sync(sync_cls, async_cls):
+    # the async clients copy the endpoints by hand, a new endpoint must go into both
+    def public(cls) -> set:
+        return {name for name in dir(cls) if not name.startswith("_")}
+
+    assert public(sync_cls) - SYNC_ONLY == public(async_cls) - {"create"}
+    for name in public(sync_cls) - SYNC_ONLY:
+        method = inspect.getattr_static(sync_cls, name)
+        if not inspect.isfunction(method) or hasattr(BaseClient, name):
+            continue
+        amethod = inspect.getattr_static(async_cls, name)
+        assert inspect.iscoroutinefunction(amethod), name
+        assert inspect.signature(method).parameters.keys() == inspect.signature(amethod).parameters.keys(), name
@@ -0,0 +1,60 @@
+# coding: utf-8
+#
+
+import threading
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from wdapy._base import read_response_body
+from wdapy.exceptions import ResponseTooLarge
+
+BODY = b'{"value": "' + b"x" * 300000 + b'"}'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        if self.path == "/chunked":
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(BODY), 70000):
+                chunk = BODY[i:i + 70000]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def conn():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    c = HTTPConnection("127.0.0.1", srv.server_address[1])
+    yield c
+    c.close()
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.mark.parametrize("path", ["/length", "/chunked"])
+def test_read_response_body(conn, path):
+    for _ in range(2):  # connection stays usable after full read
+        conn.request("GET", path)
+        assert read_response_body(conn.getresponse()) == BODY
+
+
+@pytest.mark.parametrize("path", ["/length", "/chunked"])
+def test_read_response_body_too_large(conn, path):
+    conn.request("GET", path)
+    with pytest.raises(ResponseTooLarge):
+        read_response_body(conn.getresponse(), max_size=1000)
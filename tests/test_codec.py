@@ -0,0 +1,48 @@
+# coding: utf-8
+#
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from wdapy import AppiumClient
+from wdapy._base import HTTPResponseWrapper
+from wdapy._codec import JSONCodec, OrjsonCodec
+from wdapy._proto import GET, Keycode
+from wdapy.exceptions import ApiError, RequestError
+
+
+def _codecs():
+    codecs = [JSONCodec()]
+    try:
+        codecs.append(OrjsonCodec())
+    except ImportError:
+        pass
+    return codecs
+
+
+@pytest.mark.parametrize("codec", _codecs(), ids=lambda c: c.name)
+def test_codec_roundtrip(codec):
+    data = {"name": Keycode.HOME, "value": [1, "中文"]}
+    assert codec.loads(codec.dumps(data)) == {"name": "home", "value": [1, "中文"]}
+    assert codec.loads(memoryview(b'{"a": 1}')) == {"a": 1}
+
+
+def test_response_decoded_once():
+    client = AppiumClient()
+    client._request_http = MagicMock(return_value=HTTPResponseWrapper(b'{"value": "x", "sessionId": null}', 200))
+    codec = client.json_codec = MagicMock(wraps=JSONCodec())
+    assert client.request(GET, "/status") == {"value": "x", "sessionId": None}
+    assert codec.loads.call_count == 1
+
+
+def test_response_errors():
+    client = AppiumClient()
+    client._request_http = MagicMock(return_value=HTTPResponseWrapper(b'not json', 200))
+    with pytest.raises(RequestError):
+        client.request(GET, "/status")
+
+    client._request_http = MagicMock(return_value=HTTPResponseWrapper(
+        b'{"value": {"error": "no such alert", "message": "no alert"}}', 200))
+    with pytest.raises(ApiError):
+        client.request(GET, "/alert/text")
@@ -1,8 +1,14 @@
 # coding: utf-8
 #
 
+import base64
+import io
+import os
+import tempfile
 import unittest
 from unittest.mock import MagicMock
+
+from PIL import Image
 import wdapy
 from wdapy import AppiumClient
 from wdapy._types import BatteryState
@@ -134,6 +140,39 @@ class SimpleTest(unittest.TestCase):
         payload = self._client.session_request.call_args.args[-1]
         self.assertEqual(["Done"], payload['keyNames'])
 
+    def _mock_screenshot(self) -> bytes:
+        buf = io.BytesIO()
+        Image.new("RGBA", (4, 3), (255, 0, 0, 255)).save(buf, format="PNG")
+        png = buf.getvalue()
+        self._client.request = MagicMock(return_value={"value": base64.b64encode(png).decode()})
+        return png
+
+    def test_screenshot(self):
+        png = self._mock_screenshot()
+        self.assertEqual(png, self._client.screenshot_raw())
+        im = self._client.screenshot()
+        self.assertEqual("RGB", im.mode)
+        self.assertEqual((4, 3), im.size)
+        self.assertEqual("RGBA", self._client.screenshot(lazy=True).mode)
+
+    def test_screenshot_ndarray(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest("numpy not installed")
+        self._mock_screenshot()
+        arr = self._client.screenshot_ndarray()
+        self.assertEqual((3, 4, 3), arr.shape)
+        self.assertEqual([255, 0, 0], arr[0, 0].tolist())
+
+    def test_save_screenshot(self):
+        png = self._mock_screenshot()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "screenshot.png")
+            self._client.save_screenshot(path)
+            with open(path, "rb") as f:
+                self.assertEqual(png, f.read())
+
 
 if __name__ == "__main__":
     unittest.main()
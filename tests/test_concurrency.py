@@ -0,0 +1,81 @@
+# coding: utf-8
+#
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from wdapy import AppiumClient
+from wdapy._utils import locked_cached_property
+from wdapy.testing.wda import FakeWDA
+
+
+@pytest.fixture
+def wda():
+    with FakeWDA(latency=0.02) as wda:
+        yield wda
+
+
+def test_shared_client_many_threads(wda):
+    # throughput against thread count is measured in benchmarks/bench_client.py
+    client = AppiumClient(wda.url)
+    client.tap(1, 2)  # create session
+
+    def worker(_):
+        sizes = []
+        for _ in range(10):
+            client.tap(1, 2)
+            sizes.append(client.window_size())
+        return sizes
+
+    with ThreadPoolExecutor(8) as ex:
+        results = list(ex.map(worker, range(8)))
+
+    assert all(size == (390, 844) for sizes in results for size in sizes)
+    assert sum(n for k, n in wda.requests.items() if k.endswith("/wda/tap")) == 1 + 80
+    assert wda.requests["POST /session"] == 1
+    stats = client.pool_stats
+    assert 1 < stats["created"] <= 8 + 1, stats
+    assert stats["reconnects"] == 0, stats
+
+
+def test_shared_client_mixed_workload(wda):
+    client = AppiumClient(wda.url)
+    errors = []
+
+    def worker(fn):
+        try:
+            for _ in range(20):
+                fn()
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    jobs = [lambda: client.tap(1, 2), client.screenshot_raw, client.is_locked, lambda: client.scale]
+    threads = [threading.Thread(target=worker, args=(fn,)) for fn in jobs * 3]
+    for t in threads:
+        t.start()
+    wda.kill_session()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert wda.requests["POST /session"] <= 2
+    # scale is cached once, a second request only when the session was killed in between
+    assert sum(n for k, n in wda.requests.items() if k.endswith("/wda/screen")) <= 2
+
+
+def test_locked_cached_property():
+    calls = []
+
+    class Foo:
+        @locked_cached_property
+        def value(self):
+            calls.append(1)
+            time.sleep(0.05)
+            return 42
+
+    foo = Foo()
+    with ThreadPoolExecutor(8) as ex:
+        assert list(ex.map(lambda _: foo.value, range(8))) == [42] * 8
+    assert len(calls) == 1
@@ -0,0 +1,95 @@
+# coding: utf-8
+#
+
+import asyncio
+import socket
+import time
+
+import pytest
+
+from wdapy import AppiumClient, AppiumUSBClient, AsyncAppiumClient
+from wdapy._deadline import deadline, remaining
+from wdapy._retry import CircuitState
+from wdapy._wrap import timeout
+from wdapy.exceptions import DeadlineExceeded
+from wdapy.testing.wda import FakeWDA
+from wdapy.usbmux.pyusbmux import MuxConnection
+
+
+@pytest.fixture
+def wda():
+    with FakeWDA(latency=0.1) as wda:
+        yield wda
+
+
+def test_deadline_scope():
+    assert remaining() is None
+    with deadline(1.0):
+        outer = remaining()
+        with deadline(10.0):
+            # nested scope never extends the outer one
+            assert remaining() <= outer
+        with deadline(0.1):
+            assert remaining() <= 0.1
+    assert remaining() is None
+
+
+def test_with_timeout(wda):
+    c = AppiumClient(wda.url)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        c.with_timeout(0.05).status()
+    assert time.monotonic() - start < 0.09
+    # GET is idempotent but there is no budget left for a retry
+    assert wda.requests["GET /status"] == 1
+    assert c.circuit_breaker.state == CircuitState.CLOSED
+
+    assert c.with_timeout(1).status().message
+    assert c.with_timeout(1).request_timeout == c.request_timeout
+
+
+def test_deadline_covers_session_creation(wda):
+    c = AppiumClient(wda.url)
+    # GET /status + POST /session + POST tap need 0.3s
+    with pytest.raises(DeadlineExceeded):
+        c.with_timeout(0.25).tap(1, 2)
+
+    with pytest.raises(DeadlineExceeded):
+        with c.deadline(0.3):
+            c.is_locked()  # session exists now, 0.1s
+            c.is_locked()
+            c.is_locked()
+
+
+def test_with_timeout_hung_usbmuxd(tmp_path, monkeypatch):
+    # usbmuxd accepts the connection but never answers, device resolution shares the budget
+    path = str(tmp_path / "usbmuxd")
+    with socket.socket(socket.AF_UNIX) as server:
+        server.bind(path)
+        server.listen(8)
+        monkeypatch.setattr(MuxConnection, "USBMUXD_PIPE", path)
+        c = AppiumUSBClient("00008101-00000000DEAD0001")
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            c.with_timeout(0.2).status()
+        assert time.monotonic() - start < 1
+
+
+def test_timeout_decorator(wda):
+    class Client(AppiumClient):
+        @timeout(0.05)
+        def slow_status(self):
+            return self.status()
+
+    with pytest.raises(DeadlineExceeded):
+        Client(wda.url).slow_status()
+
+
+def test_async_with_timeout(wda):
+    async def main():
+        async with AsyncAppiumClient(wda.url) as c:
+            with pytest.raises(DeadlineExceeded):
+                await c.with_timeout(0.05).status()
+            assert (await c.with_timeout(1).status()).message
+
+    asyncio.run(main())
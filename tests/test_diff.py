@@ -0,0 +1,101 @@
+# coding: utf-8
+#
+
+import asyncio
+import itertools
+
+import pytest
+
+from wdapy import AppiumClient, AsyncAppiumClient, ParsedSource, diff_snapshots, structure_hash
+from wdapy.exceptions import UINotStable
+from wdapy.testing.wda import FakeWDA, make_source
+
+
+def page(*cells: str, title: str = "Inbox", clock: str = "9:41") -> ParsedSource:
+    """ a window with a title, a clock and a list of cells """
+    items = "".join(
+        f'<XCUIElementTypeCell type="XCUIElementTypeCell" name="{c}">'
+        f'<XCUIElementTypeStaticText type="XCUIElementTypeStaticText" name="{c}-text" value="{c}"/>'
+        f'</XCUIElementTypeCell>' for c in cells)
+    return ParsedSource.from_xml(
+        '<XCUIElementTypeApplication type="XCUIElementTypeApplication" name="Mail">'
+        f'<XCUIElementTypeStaticText type="XCUIElementTypeStaticText" name="clock" value="{clock}"/>'
+        f'<XCUIElementTypeNavigationBar type="XCUIElementTypeNavigationBar" name="{title}"/>'
+        f'<XCUIElementTypeTable type="XCUIElementTypeTable">{items}</XCUIElementTypeTable>'
+        '</XCUIElementTypeApplication>')
+
+
+def names(elements) -> list:
+    return [e.name for e in elements]
+
+
+def test_same_page():
+    a, b = page("a", "b"), page("a", "b")
+    assert structure_hash(a) == structure_hash(b)
+    assert not diff_snapshots(a, b)
+    assert structure_hash(a) != structure_hash(page("a", "c"))
+
+
+def test_added_removed_changed():
+    changes = diff_snapshots(page("a", "b", "c"), page("a", "c", "d", title="Sent"))
+    assert names(changes.removed) == ["b"]
+    assert names(changes.added) == ["d"]
+    assert [(o.name, n.name) for o, n in changes.changed] == [("Inbox", "Sent")]
+    assert changes.moved == []
+
+
+def test_moved():
+    changes = diff_snapshots(page("a", "b", "c", "d"), page("a", "d", "b", "c"))
+    assert [(o.name, n.name) for o, n in changes.moved] == [("d", "d")]
+    assert not changes.added and not changes.removed and not changes.changed
+
+    # moved to another parent
+    old = ParsedSource.from_xml('<A type="XCUIElementTypeA"><B type="XCUIElementTypeB" name="x">'
+                                '<C type="XCUIElementTypeC" name="c"/></B><B type="XCUIElementTypeB" name="y"/></A>')
+    new = ParsedSource.from_xml('<A type="XCUIElementTypeA"><B type="XCUIElementTypeB" name="x"/>'
+                                '<B type="XCUIElementTypeB" name="y"><C type="XCUIElementTypeC" name="c"/></B></A>')
+    changes = diff_snapshots(old, new)
+    [(o, n)] = changes.moved
+    assert (o.parent.name, n.parent.name) == ("x", "y")
+    assert not changes.added and not changes.removed
+
+
+def test_ignore_attributes():
+    a, b = page("a", clock="9:41"), page("a", clock="9:42")
+    assert [o.name for o, _ in diff_snapshots(a, b).changed] == ["clock"]
+    assert not diff_snapshots(a, b, ignore={"value"})
+    assert structure_hash(a, {"value"}) == structure_hash(b, {"value"})
+
+
+def test_diff_visits_only_changes():
+    # a changed cell in a big list: the differ walks one path, not the page
+    source = make_source(300_000)
+    old = ParsedSource.from_xml(source)
+    new = ParsedSource.from_xml(source.replace('name="more-500"', 'name="less-500"'))
+    changes = diff_snapshots(old, new)
+    assert [(o.name, n.name) for o, n in changes.changed] == [("more-500", "less-500")]
+    assert not changes.added and not changes.removed and not changes.moved
+
+
+def test_wait_ui_stable():
+    with FakeWDA(source_size=5_000) as wda:
+        c = AppiumClient(wda.url)
+        source = c.wait_ui_stable(interval=0.01)
+        assert source.tree.root.name == "Fake"
+        assert wda.requests["GET /source"] == 2
+
+        # a page that never settles
+        sizes = itertools.count(5_000, 5_000)
+        wda.source = lambda: make_source(next(sizes))
+        with pytest.raises(UINotStable) as e:
+            c.wait_ui_stable(timeout=0.2, interval=0.02)
+        assert e.value.source.tree is not None
+
+        async def main():
+            async with AsyncAppiumClient(wda.url) as ac:
+                with pytest.raises(UINotStable):
+                    await ac.wait_ui_stable(timeout=0.1, interval=0.02)
+                wda.source = lambda: make_source(5_000)
+                return await ac.wait_ui_stable(interval=0.01, stable_count=3)
+
+        assert asyncio.run(main()).tree.root.name == "Fake"
@@ -0,0 +1,67 @@
+# coding: utf-8
+#
+""" run the client over real HTTP against FakeWDA """
+
+import pytest
+
+from wdapy import AppiumClient
+from wdapy._proto import AppState, Orientation
+from wdapy._types import BatteryState
+from wdapy.testing.wda import FakeWDA
+
+
+@pytest.fixture(scope="module")
+def wda():
+    with FakeWDA(screenshot_size=200_000, source_size=50_000, latencies={"/screenshot": 0.01}) as wda:
+        yield wda
+
+
+def test_client_methods(wda):
+    c = AppiumClient(wda.url)
+    assert c.status().ip == "127.0.0.1"
+    c.app_start("com.example")
+    assert c.app_state("com.example") == AppState.RUNNING
+    assert c.app_current().bundle_id == "com.apple.springboard"
+    assert c.app_list().pid == 100
+    c.lock()
+    assert c.is_locked()
+    c.unlock()
+    assert not c.is_locked()
+    c.homescreen()
+    c.open_url("https://example.com")
+    c.set_clipboard("hello")
+    assert c.get_clipboard() == "hello"
+    assert c.appium_settings({"snapshotMaxDepth": 10}) == {"snapshotMaxDepth": 10}
+    assert c.get_orientation() == Orientation.PORTRAIT
+    assert c.window_size() == (390, 844)
+    assert c.scale == 3
+    assert c.status_barsize().height == 47
+    assert c.battery_info().state == BatteryState.Charging
+    assert c.device_info().name == "Fake iPhone"
+    c.send_keys("abc")
+    c.tap(1, 2)
+    c.touch_and_hold(1, 2, 0.5)
+    c.swipe(1, 2, 3, 4)
+    c.keyboard_dismiss()
+    assert c.app_terminate("com.example") is None
+
+
+def test_payload_sizes(wda):
+    c = AppiumClient(wda.url)
+    im = c.screenshot()
+    assert im.size[0] == 256
+    assert len(c.screenshot_raw()) > 150_000
+    source = c.sourcetree().value
+    assert len(source) >= 50_000
+    assert source.rstrip().endswith("</XCUIElementTypeApplication>")
+    assert wda.latency_of("GET", "/screenshot") == 0.01
+
+
+def test_alert(wda):
+    c = AppiumClient(wda.url)
+    assert not c.alert.exists
+    wda.alert_text = "Allow?"
+    assert c.alert.exists
+    assert c.alert.buttons() == ["Cancel", "OK"]
+    c.alert.accept()
+    assert wda.alert_text is None
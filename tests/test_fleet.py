@@ -0,0 +1,96 @@
+# coding: utf-8
+#
+
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+import wdapy.fleet
+from wdapy.fleet import DeviceFleet, FleetError
+from wdapy.usbmux.registry import get_registry
+
+# a registry of its own, fake devices never reach the process wide default one
+USBMUX_ADDRESS = "fleet-test"
+
+
+class _Client:
+    def __init__(self, udid: str):
+        self.udid = udid
+        self.closed = False
+
+    def status(self):
+        if self.udid == "broken":
+            raise RuntimeError("device broken")
+        if self.udid == "slow":
+            time.sleep(0.5)
+        return {"udid": self.udid}
+
+    def close(self):
+        self.closed = True
+
+
+def _device(serial: str, usb: bool = True):
+    d = MagicMock(serial=serial, is_usb=usb)
+    return d
+
+
+@pytest.fixture
+def devices(monkeypatch):
+    devices = [_device("a"), _device("b"), _device("broken"), _device("slow"), _device("a", usb=False)]
+    monkeypatch.setattr(wdapy.fleet, "list_devices", lambda usbmux_address=None: devices)
+    yield devices
+    get_registry(USBMUX_ADDRESS).invalidate()
+
+
+def test_fleet_run(devices):
+    with DeviceFleet(client_factory=_Client, max_workers=4, usbmux_address=USBMUX_ADDRESS) as fleet:
+        assert sorted(fleet.refresh()) == ["a", "b", "broken", "slow"]
+        results = fleet.run("status", udids=["a", "b", "broken"])
+        assert results["a"].value == {"udid": "a"}
+        assert results["b"].ok
+        assert isinstance(results["broken"].error, RuntimeError)
+
+        results = fleet.run(lambda c, suffix: c.udid + suffix, "!", where=lambda d: d.serial != "broken")
+        assert {udid: r.value for udid, r in results.items()} == {"a": "a!", "b": "b!", "slow": "slow!"}
+
+        with pytest.raises(FleetError) as e:
+            fleet.run("status", raise_on_error=True)
+        assert list(e.value.errors) == ["broken"]
+        assert fleet.client("a") is fleet.client("a")
+
+
+def test_fleet_timeout_does_not_block_others(devices):
+    with DeviceFleet(client_factory=_Client, max_workers=4, usbmux_address=USBMUX_ADDRESS) as fleet:
+        start = time.monotonic()
+        results = list(fleet.iter_run("status", timeout=0.2))
+        assert time.monotonic() - start < 0.45
+        assert results[-1].udid == "slow"
+        assert isinstance(results[-1].error, TimeoutError)
+        assert {r.udid for r in results if r.ok} == {"a", "b"}
+
+
+def test_fleet_drop_detached(devices):
+    with DeviceFleet(client_factory=_Client, usbmux_address=USBMUX_ADDRESS) as fleet:
+        fleet.refresh()
+        client = fleet.client("b")
+        assert "b" in get_registry(USBMUX_ADDRESS)
+        devices.remove(devices[1])
+        assert "b" not in fleet.refresh()
+        assert client.closed
+        assert "b" not in get_registry(USBMUX_ADDRESS)
+
+
+def test_fleet_close_cancels_waiting(devices):
+    fleet = DeviceFleet(client_factory=_Client, max_workers=1, usbmux_address=USBMUX_ADDRESS)
+    running = fleet._submit(time.sleep, 0.2)
+    waiting = fleet._submit(time.sleep, 0)
+    fleet.close()
+    assert waiting.cancelled()
+    running.result()
+    assert not fleet._futures
+
+
+def test_fleet_usbmux_address_needs_factory():
+    with pytest.raises(ValueError):
+        DeviceFleet(usbmux_address=USBMUX_ADDRESS)
@@ -0,0 +1,166 @@
+# coding: utf-8
+#
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+
+import pytest
+
+from wdapy.testing.usbmuxd import FakeUsbmuxd
+from wdapy.testing.wda import FakeWDA
+from wdapy.usbmux import tunnels
+from wdapy.usbmux.__main__ import parse_port_pair
+from wdapy.usbmux.forward import Forwarder
+
+
+def wait_until(fn, timeout: float = 2.0):
+    deadline = time.time() + timeout
+    while not fn():
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            self.request.sendall(data)
+
+
+@pytest.fixture(scope="module")
+def echo():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), EchoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.1,), daemon=True).start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+class BannerHandler(socketserver.BaseRequestHandler):
+    """ speaks first, like sshd """
+
+    def handle(self):
+        self.request.sendall(b"SSH-2.0-fake\r\n")
+        self.request.recv(1)
+
+
+@pytest.fixture(scope="module")
+def banner():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), BannerHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.1,), daemon=True).start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def wda():
+    with FakeWDA() as server:
+        yield server
+
+
+@pytest.fixture
+def usbmuxd(wda, echo, banner):
+    with FakeUsbmuxd(devices=1, ports={8100: wda.address, 7000: echo, 2222: banner}) as server:
+        yield server
+    tunnels.close_tunnel_pools()
+
+
+def test_forward_http(usbmuxd):
+    with Forwarder(usbmux_address=usbmuxd.address) as forwarder:
+        port = forwarder.add(0, 8100)
+        assert forwarder.ports == {port: 8100}
+        conn = HTTPConnection("127.0.0.1", port, timeout=3)
+        for _ in range(2):
+            conn.request("GET", "/status")
+            resp = conn.getresponse()
+            assert resp.status == 200
+            assert json.loads(resp.read())["value"]["ready"] is True
+        [tunnel] = forwarder.tunnels
+        assert tunnel.serial == usbmuxd.devices[0].serial
+        assert tunnel.bytes_sent > 0 and tunnel.bytes_received > 0
+        conn.close()
+        wait_until(lambda: not forwarder.tunnels)
+        [closed] = forwarder.closed_tunnels
+        assert closed.ended is not None
+        assert closed.throughput > 0
+
+
+def echo_through(port: int, size: int) -> bytes:
+    payload = os.urandom(size)
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as s:
+        t = threading.Thread(target=s.sendall, args=(payload,))
+        t.start()
+        received = bytearray()
+        while len(received) < size:
+            chunk = s.recv(1 << 20)
+            assert chunk, "tunnel closed early"
+            received += chunk
+        t.join()
+        s.shutdown(socket.SHUT_WR)
+        assert s.recv(1) == b""
+    assert bytes(received) == payload
+    return payload
+
+
+def test_forward_concurrent_tunnels(usbmuxd):
+    size = 2 * 1024 * 1024
+    with Forwarder(udid=usbmuxd.devices[0].serial, usbmux_address=usbmuxd.address) as forwarder:
+        port = forwarder.add(0, 7000)
+        with ThreadPoolExecutor(16) as pool:
+            list(pool.map(lambda _: echo_through(port, size), range(32)))
+        wait_until(lambda: len(forwarder.closed_tunnels) == 32)
+        assert all(t.bytes_sent == size and t.bytes_received == size for t in forwarder.closed_tunnels)
+        assert not forwarder.tunnels
+
+
+def test_forward_server_first(usbmuxd):
+    # prefetched tunnels of a service that speaks first would all look stale, none are opened
+    tunnels.set_pool_size(tunnels.DEFAULT_POOL_SIZE)
+    try:
+        with Forwarder(usbmux_address=usbmuxd.address) as forwarder:
+            port = forwarder.add(0, 2222)
+            for _ in range(3):
+                with socket.create_connection(("127.0.0.1", port), timeout=3) as s:
+                    assert s.recv(64).startswith(b"SSH-2.0")
+            wait_until(lambda: len(forwarder.closed_tunnels) == 3)
+        assert usbmuxd.requests["Connect"] == 3
+    finally:
+        tunnels.set_pool_size(0)
+
+
+def test_forward_unknown_device(usbmuxd):
+    with Forwarder(udid="unknown", usbmux_address=usbmuxd.address) as forwarder:
+        port = forwarder.add(0, 8100)
+        with socket.create_connection(("127.0.0.1", port), timeout=3) as s:
+            assert s.recv(1) == b""
+        assert not forwarder.tunnels
+
+
+def test_forward_remove(usbmuxd):
+    forwarder = Forwarder(usbmux_address=usbmuxd.address)
+    port = forwarder.add(0)
+    forwarder.start()
+    forwarder.remove(port)
+    assert forwarder.ports == {}
+    forwarder.close()
+    with pytest.raises(OSError):
+        socket.create_connection(("127.0.0.1", port), timeout=1)
+
+
+def test_parse_port_pair():
+    assert parse_port_pair("8100") == (8100, 8100)
+    assert parse_port_pair("18100:8100") == (18100, 8100)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_port_pair("a:b")
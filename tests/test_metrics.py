@@ -0,0 +1,79 @@
+# coding: utf-8
+#
+
+import asyncio
+
+import pytest
+
+from wdapy import AppiumClient, AsyncAppiumClient
+from wdapy._metrics import Histogram, normalize_endpoint
+from wdapy._proto import GET
+from wdapy.exceptions import RequestError
+from wdapy.testing.wda import FakeWDA
+
+
+@pytest.fixture
+def wda():
+    with FakeWDA(latency=0.005) as wda:
+        yield wda
+
+
+def test_normalize_endpoint():
+    assert normalize_endpoint("/status") == "/status"
+    assert normalize_endpoint("session/ABC-1/wda/tap/") == "/session/{sessionId}/wda/tap"
+    assert normalize_endpoint("/session/ABC/element/E1/click?x=1") == "/session/{sessionId}/element/{elementId}/click"
+
+
+def test_histogram():
+    h = Histogram(buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 0.5, 5):
+        h.observe(v)
+    assert h.cumulative() == [("0.1", 1), ("1.0", 3), ("+Inf", 4)]
+    assert h.quantile(0.5) == 1.0
+    assert h.to_dict()["count"] == 4
+
+
+def test_client_metrics_and_hooks(wda):
+    c = AppiumClient(wda.url)
+    before, after = [], []
+    c.add_before_request_hook(lambda r: before.append(r.endpoint))
+    c.add_after_request_hook(after.append)
+
+    c.tap(1, 2)
+    c.tap(1, 2)
+    wda.kill_session()
+    c.tap(1, 2)
+    with pytest.raises(RequestError):
+        c.request(GET, "/unknown")
+
+    assert "/session/{sessionId}/wda/tap" in before
+    record = after[-2]
+    assert record.status_code == 200 and record.error is None
+    assert record.bytes_sent > 0 and record.bytes_received > 0
+    assert record.timing.total >= record.timing.ttfb >= 0.005
+    assert isinstance(after[-1].error, RequestError)
+
+    data = c.metrics.to_dict()
+    tap = data["endpoints"]["POST /session/{sessionId}/wda/tap"]
+    assert tap["requests"] == {"200": 3, "WDASessionDoesNotExist": 1}
+    assert set(tap["latency"]) == {"connect", "send", "ttfb", "body", "decode", "total"}
+    assert tap["latency"]["total"]["count"] == 4
+    assert data["endpoints"]["GET /unknown"]["retries"] == 1
+    assert data["counters"] == {"sessions_created": 2, "sessions_recreated": 1}
+
+    text = c.metrics.to_prometheus()
+    assert '# TYPE wdapy_request_duration_seconds histogram' in text
+    assert 'wdapy_requests_total{method="GET",endpoint="/unknown",status="RequestError"} 1' in text
+    assert "wdapy_sessions_recreated_total 1" in text
+
+
+def test_async_client_metrics(wda):
+    async def main():
+        async with AsyncAppiumClient(wda.url) as c:
+            await c.tap(1, 2)
+            return c.metrics.to_dict()
+
+    data = asyncio.run(main())
+    tap = data["endpoints"]["POST /session/{sessionId}/wda/tap"]
+    assert tap["requests"] == {"200": 1}
+    assert tap["latency"]["ttfb"]["sum"] > 0
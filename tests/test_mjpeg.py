@@ -0,0 +1,56 @@
+# coding: utf-8
+#
+
+import time
+
+import pytest
+
+from wdapy import AppiumClient
+from wdapy._mjpeg import MJPEGParser
+from wdapy.testing.mjpeg import FakeMJPEGServer, make_jpeg_frames
+
+FRAMES = make_jpeg_frames(3)
+
+
+def _stream_bytes(content_length: bool) -> bytes:
+    data = b"HTTP/1.0 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=--BoundaryString\r\n\r\n"
+    for frame in FRAMES:
+        data += b"--BoundaryString\r\nContent-type: image/jpg\r\n"
+        if content_length:
+            data += b"Content-Length: %d\r\n" % len(frame)
+        data += b"\r\n" + frame + b"\r\n\r\n"
+    return data + b"--BoundaryString\r\n"
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000, 100000])
+def test_parser(content_length, chunk_size):
+    data = _stream_bytes(content_length)
+    parser = MJPEGParser()
+    frames = []
+    for i in range(0, len(data), chunk_size):
+        frames.extend(parser.feed(data[i:i + chunk_size]))
+    assert frames == FRAMES
+
+
+def test_screen_stream():
+    with FakeMJPEGServer(fps=100) as server:
+        client = AppiumClient("http://127.0.0.1:8100")
+        with client.screen_stream(port=server.port) as stream:
+            frames = [stream.read(timeout=5) for _ in range(10)]
+            assert all(frame.image.size == (64, 128) for frame in frames)
+            assert [f.index for f in frames] == sorted(f.index for f in frames)
+            assert stream.fps > 0
+            assert stream.decode_latency > 0
+
+
+def test_screen_stream_drop_stale_frames():
+    with FakeMJPEGServer(fps=200) as server:
+        client = AppiumClient("http://127.0.0.1:8100")
+        with client.screen_stream(port=server.port, buffer_size=2, decode=False) as stream:
+            stream.read(timeout=5)
+            time.sleep(0.2)
+            frame = stream.latest(timeout=5)
+            assert frame.image is None
+            assert stream.stats()["dropped"] > 0
+            assert frame.index > 2
@@ -0,0 +1,148 @@
+# coding: utf-8
+#
+
+import json
+import os
+import socket
+import threading
+from http.client import HTTPConnection, HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from wdapy import AppiumClient
+from wdapy._pool import is_connection_alive
+from wdapy._proto import GET, POST
+from wdapy.usbmux.tunnels import is_tunnel_alive
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._reply()
+
+    def _reply(self):
+        body = json.dumps({"value": self.path, "sessionId": None}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _DroppingHandler(_Handler):
+    """ runs every request, but drops the connection instead of answering the second one on it """
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._handle()
+
+    def _handle(self):
+        self.server.handled.append(f"{self.command} {self.path}")
+        self.count = getattr(self, "count", 0) + 1
+        if self.count == 2:
+            self.close_connection = True
+        else:
+            self._reply()
+
+
+def _serve(handler):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    srv.daemon_threads = True
+    srv.handled = []
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+@pytest.fixture
+def server():
+    srv = _serve(_Handler)
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def dropping_server():
+    srv = _serve(_DroppingHandler)
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_connection_reused(server):
+    client = AppiumClient(f"http://127.0.0.1:{server.server_address[1]}")
+    for _ in range(5):
+        assert client.request(GET, "/hello")["value"] == "/hello"
+    stats = client.pool_stats
+    assert stats["created"] == 1
+    assert stats["reused"] == 4
+    assert stats["idle"] == 1
+    client.close()
+    assert client.pool_stats["idle"] == 0
+
+
+def test_reconnect_after_server_close(server):
+    client = AppiumClient(f"http://127.0.0.1:{server.server_address[1]}")
+    client.request(GET, "/a")
+    # simulate keep-alive timeout on server side
+    conn, _ = client.connection_pool.acquire(client._wda_url)
+    conn.sock.close()
+    client.connection_pool.release(client._wda_url, conn)
+
+    assert client.request(GET, "/b")["value"] == "/b"
+    assert client.pool_stats["created"] == 2
+
+
+def test_idle_timeout(server):
+    client = AppiumClient(f"http://127.0.0.1:{server.server_address[1]}")
+    client.connection_pool.idle_timeout = 0
+    client.request(GET, "/a")
+    client.request(GET, "/b")
+    assert client.pool_stats["created"] == 2
+    assert client.pool_stats["discarded"] == 1
+
+
+def test_resend_only_unsent_or_idempotent(dropping_server):
+    client = AppiumClient(f"http://127.0.0.1:{dropping_server.server_address[1]}")
+    # GET is safe to resend on a new connection
+    client.request(GET, "/a")
+    assert client.request(GET, "/b")["value"] == "/b"
+    assert dropping_server.handled == ["GET /a", "GET /b", "GET /b"]
+    assert client.pool_stats["reconnects"] == 1
+
+    # WDA may have tapped already, the error goes to the caller
+    dropping_server.handled.clear()
+    client.close()
+    client.request(POST, "/wda/tap/0", {"x": 1, "y": 1})
+    with pytest.raises(HTTPException):
+        client.request(POST, "/wda/tap/0", {"x": 1, "y": 1})
+    assert dropping_server.handled == ["POST /wda/tap/0"] * 2
+    assert client.pool_stats["reconnects"] == 1
+
+
+def test_alive_check_high_fd():
+    # processes with many sockets, select() can not watch fds >= 1024
+    resource = pytest.importorskip("resource")
+    if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 1500:
+        pytest.skip("fd limit too low")
+    a, b = socket.socketpair()
+    high = socket.socket(fileno=os.dup2(a.fileno(), 1500))
+    a.close()
+    conn = HTTPConnection("localhost")
+    conn.sock = high
+    try:
+        assert is_connection_alive(conn)
+        assert is_tunnel_alive(high)
+        b.close()
+        assert not is_connection_alive(conn)
+        assert not is_tunnel_alive(high)
+    finally:
+        high.close()
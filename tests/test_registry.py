@@ -0,0 +1,44 @@
+# coding: utf-8
+#
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from wdapy.usbmux import registry as registry_module
+from wdapy.usbmux.exceptions import BadDevError
+from wdapy.usbmux.pyusbmux import MuxDevice
+from wdapy.usbmux.registry import DeviceRegistry
+
+
+@pytest.fixture
+def select_device(monkeypatch):
+    m = MagicMock(return_value=MuxDevice(3, "00008101-001234567890ABCD", "USB"))
+    monkeypatch.setattr(registry_module, "select_device", m)
+    return m
+
+
+def test_resolve_cached(select_device):
+    reg = DeviceRegistry()
+    d1 = reg.resolve("00008101-001234567890ABCD")
+    d2 = reg.resolve("00008101001234567890ABCD")
+    assert d1 is d2
+    assert select_device.call_count == 1
+    assert "00008101-001234567890ABCD" in reg
+
+
+def test_invalidate(select_device):
+    reg = DeviceRegistry()
+    reg.resolve("00008101-001234567890ABCD")
+    reg.invalidate("00008101-001234567890ABCD")
+    reg.resolve("00008101-001234567890ABCD")
+    assert select_device.call_count == 2
+
+    reg.on_detached(3)
+    assert "00008101-001234567890ABCD" not in reg
+
+
+def test_resolve_not_found(select_device):
+    select_device.return_value = None
+    with pytest.raises(BadDevError):
+        DeviceRegistry().resolve("unknown")
@@ -0,0 +1,109 @@
+# coding: utf-8
+#
+
+import asyncio
+import socket
+import time
+from http.client import HTTPException
+
+import pytest
+
+from wdapy import AppiumClient, AsyncAppiumClient
+from wdapy._proto import GET, POST
+from wdapy._retry import CircuitBreaker, CircuitState, RetryPolicy
+from wdapy.exceptions import CircuitOpenError, RequestError
+from wdapy.testing.wda import FakeWDA
+from wdapy.usbmux.exceptions import MuxConnectError
+
+
+def test_retry_policy():
+    policy = RetryPolicy(tries=4, delay=0.1, backoff=2, max_delay=0.3, jitter=0)
+    assert policy.is_idempotent("GET", "/status")
+    assert policy.is_idempotent("POST", "/session/{sessionId}/wda/apps/launch")
+    assert policy.is_idempotent("POST", "/wda/homescreen")
+    assert not policy.is_idempotent("POST", "/session/{sessionId}/wda/tap")
+    assert not policy.is_idempotent("POST", "/session")
+
+    err = RequestError("response code: 500")
+    assert [policy.next_delay(n, err, "GET", "/status", 0) for n in (1, 2, 3, 4)] == [0.1, 0.2, 0.3, None]
+    assert policy.next_delay(1, err, "POST", "/session/{sessionId}/wda/tap", 0) is None
+    assert policy.next_delay(1, ValueError(), "GET", "/status", 0) is None
+    assert policy.next_delay(1, CircuitOpenError(), "GET", "/status", 0) is None
+    assert policy.next_delay(1, err, "GET", "/status", 0.95) == 0.1
+    policy.deadline = 1.0
+    assert policy.next_delay(1, err, "GET", "/status", 0.95) is None
+
+    try:
+        raise RequestError("ConnectionBroken") from MuxConnectError()
+    except RequestError as e:
+        assert policy.next_delay(1, e, "POST", "/session/{sessionId}/wda/tap", 0) == 0.1
+
+
+def test_non_idempotent_not_retried():
+    with FakeWDA() as wda:
+        c = AppiumClient(wda.url)
+        with pytest.raises(RequestError):
+            c.request(POST, "/wda/unknown-tap")
+        assert wda.requests["POST /wda/unknown-tap"] == 1
+        with pytest.raises(RequestError):
+            c.request(GET, "/unknown")
+        assert wda.requests["GET /unknown"] == 2
+
+
+def test_dropped_response_not_resent():
+    # WDA ran the tap, then the kept-alive connection broke before the response
+    with FakeWDA() as wda:
+        c = AppiumClient(wda.url)
+        c.status()
+        wda.drop_responses = 1
+        with pytest.raises(HTTPException):
+            c.request(POST, "/wda/tap/0", {"x": 1, "y": 1})
+        assert wda.requests["POST /wda/tap/0"] == 1
+
+        # resent on a new connection when retry_policy says it is idempotent
+        c.retry_policy = RetryPolicy(idempotent_endpoints=["/wda/tap/0"])
+        c.status()
+        wda.drop_responses = 1
+        c.request(POST, "/wda/tap/0", {"x": 1, "y": 1})
+        assert wda.requests["POST /wda/tap/0"] == 3
+
+        async def main():
+            async with AsyncAppiumClient(wda.url) as ac:
+                await ac.status()
+                wda.drop_responses = 1
+                with pytest.raises(ConnectionResetError):
+                    await ac.request(POST, "/wda/tap/0", {"x": 1, "y": 1})
+
+        asyncio.run(main())
+        assert wda.requests["POST /wda/tap/0"] == 4
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_circuit_breaker():
+    port = _free_port()
+    c = AppiumClient(f"http://127.0.0.1:{port}")
+    c.circuit_breaker = breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    for _ in range(2):
+        with pytest.raises(ConnectionRefusedError):
+            c.status()
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError):
+        c.status()
+
+    time.sleep(0.25)
+    assert breaker.state == CircuitState.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        c.status()  # probe failed, open again
+    assert breaker.state == CircuitState.OPEN
+
+    with FakeWDA(port=port) as wda:
+        time.sleep(0.25)
+        assert c.status().message
+        assert wda.requests["GET /status"] == 2  # probe + request
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.stats()["probes"] == 2
@@ -0,0 +1,86 @@
+# coding: utf-8
+#
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+from wdapy import AppiumClient
+from wdapy._proto import GET, POST
+from wdapy._session import SessionManager
+from wdapy.exceptions import WDASessionDoesNotExist
+
+
+def test_single_flight_get():
+    sm = SessionManager()
+    calls = []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.1)
+        sm.set(f"s{len(calls)}", created=True)
+
+    with ThreadPoolExecutor(10) as ex:
+        ids = list(ex.map(lambda _: sm.get(create), range(10)))
+    assert ids == ["s1"] * 10
+    assert len(calls) == 1
+    stats = sm.stats()
+    assert stats["created"] == 1
+    assert stats["reused"] == 9
+    assert stats["valid"] and stats["age"] >= 0
+
+
+def test_single_flight_renew():
+    sm = SessionManager()
+    sm.set("old")
+    calls = []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.1)
+        sm.set("new", created=True)
+
+    with ThreadPoolExecutor(10) as ex:
+        ids = list(ex.map(lambda _: sm.renew("old", create), range(10)))
+    assert ids == ["new"] * 10
+    assert len(calls) == 1
+    assert sm.stats()["renewed"] == 1
+
+
+def test_client_session_recreated_once():
+    client = AppiumClient()
+    client._session_id = "dead"
+    lock = threading.Lock()
+    posts = []
+
+    def request(method, urlpath, payload=None):
+        if urlpath == "/session":
+            with lock:
+                posts.append(1)
+            time.sleep(0.1)
+            return {"sessionId": "alive", "value": {}}
+        if urlpath.startswith("/session/dead/"):
+            raise WDASessionDoesNotExist("Session does not exist")
+        return {"value": None}
+
+    client.request = MagicMock(side_effect=request)
+    with ThreadPoolExecutor(8) as ex:
+        list(ex.map(lambda _: client.session_request(POST, "/wda/tap", {"x": 1, "y": 1}), range(8)))
+    assert len(posts) == 1
+    assert client.session_stats["session_id"] == "alive"
+    assert client.session_stats["created"] == 1
+
+
+def test_client_adopt_session_from_status():
+    client = AppiumClient()
+    client.request = MagicMock(side_effect=lambda method, urlpath, payload=None: {
+        "sessionId": "from-status",
+        "value": {"message": "", "ios": {"ip": ""}},
+    })
+    client.session_request(GET, "/window/size")
+    client.session_request(GET, "/window/size")
+    stats = client.session_stats
+    assert stats["adopted"] == 1
+    assert stats["created"] == 0
+    assert stats["reused"] == 1
@@ -0,0 +1,138 @@
+# coding: utf-8
+#
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from wdapy import AppiumClient, ParsedSource
+from wdapy._source import parse_source
+from wdapy._types import SourceTree
+from wdapy.testing.wda import FakeWDA, make_source, make_source_json
+
+PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<XCUIElementTypeApplication type="XCUIElementTypeApplication" name="Demo" label="Demo" enabled="true" visible="true"
+    x="0" y="0" width="390" height="844">
+  <XCUIElementTypeWindow type="XCUIElementTypeWindow" enabled="true" visible="true" x="0" y="0" width="390"
+      height="844">
+    <XCUIElementTypeButton type="XCUIElementTypeButton" name="login" label="Login" enabled="true" visible="true"
+        x="20" y="100" width="100" height="40"/>
+    <XCUIElementTypeButton type="XCUIElementTypeButton" name="help" label="Help" enabled="false" visible="true"
+        x="20" y="150" width="100" height="40"/>
+    <XCUIElementTypeOther type="XCUIElementTypeOther" enabled="true" visible="false" x="0" y="900" width="390"
+        height="100">
+      <XCUIElementTypeButton type="XCUIElementTypeButton" name="login" label="Login" enabled="true"
+          visible="false" x="20" y="920" width="100" height="40"/>
+      <XCUIElementTypeStaticText type="XCUIElementTypeStaticText" value="v1.0" name="version" label="v1.0"
+          enabled="true" visible="false" x="20" y="960" width="100" height="20"/>
+    </XCUIElementTypeOther>
+  </XCUIElementTypeWindow>
+</XCUIElementTypeApplication>
+"""
+
+
+@pytest.fixture
+def tree() -> ParsedSource:
+    return ParsedSource.from_xml(PAGE)
+
+
+def names(elements) -> list:
+    return [(e.type[len("XCUIElementType"):], e.name) for e in elements]
+
+
+def test_parse(tree):
+    assert len(tree) == 7
+    assert tree.root.name == "Demo"
+    other = tree.find("Other")
+    assert other.parent.type == "XCUIElementTypeWindow"
+    assert names(other.children) == [("Button", "login"), ("StaticText", "version")]
+    assert [e.pos for e in other.iter()] == [4, 5, 6]
+    assert tree.root.contains(other) and not other.contains(tree.root)
+    login = tree.find(name="login")
+    assert login.rect == (20, 100, 100, 40)
+    assert login.center == (70, 120)
+    assert login.enabled and login.visible
+
+
+def test_find(tree):
+    assert names(tree.find_all("Button")) == [("Button", "login"), ("Button", "help"), ("Button", "login")]
+    assert tree.by_type("XCUIElementTypeButton") == tree.find_all("Button")
+    assert names(tree.find_all("Button", name="login", visible=True)) == [("Button", "login")]
+    assert names(tree.find_all(label="Login", visible=False)) == [("Button", "login")]
+    assert names(tree.find_all("Button", enabled=False)) == [("Button", "help")]
+    assert tree.find(accessibility_id="help") is tree.by_accessibility_id("help")[0]
+    assert tree.find_all(value="v1.0") == tree.by_name("version")
+    assert names(tree.find_all(name=lambda v: v.startswith("ver"))) == [("StaticText", "version")]
+    assert tree.find("Button", name="nothing") is None
+    assert tree.by_label("nothing") == []
+
+    other = tree.find("Other")
+    assert names(other.find_all("Button")) == [("Button", "login")]
+    assert other.find(name="login").visible is False
+    assert tree.find("Button").find_all() == []
+
+
+def test_xpath(tree):
+    assert names(tree.xpath("//Button")) == names(tree.find_all("Button"))
+    assert names(tree.xpath('//XCUIElementTypeButton[@name="login"][@visible="true"]')) == [("Button", "login")]
+    assert names(tree.xpath("/Application/Window/Button[2]")) == [("Button", "help")]
+    assert names(tree.xpath("//Button[1]")) == [("Button", "login"), ("Button", "login")]
+    assert names(tree.xpath("//Window/*[last()]")) == [("Other", None)]
+    assert names(tree.xpath("//Other/*")) == [("Button", "login"), ("StaticText", "version")]
+    assert names(tree.xpath("//Other//StaticText/..")) == [("Other", None)]
+    assert names(tree.xpath("//*[contains(@label, 'el') or @name='version']")) == [("Button", "help"),
+                                                                                   ("StaticText", "version")]
+    assert names(tree.xpath("//*[starts-with(@name, 'log') and @enabled='true']")) == [("Button", "login")] * 2
+    assert names(tree.xpath("//Button[@name!='login']")) == [("Button", "help")]
+    # each [] filters what the previous one left, positions count after it
+    assert names(tree.xpath("//Window/Button[@name='help'][1]")) == [("Button", "help")]
+    assert names(tree.xpath("//Window/Button[1][@name='help']")) == []
+    assert len(tree.xpath("//*[@value]")) == 1
+    assert tree.xpath("/Window") == []
+
+    other = tree.find("Other")
+    assert names(other.xpath("./Button")) == [("Button", "login")]
+    assert names(other.xpath(".//*")) == [("Button", "login"), ("StaticText", "version")]
+    assert names(other.xpath("..")) == [("Window", None)]
+
+    for expr in ["//Button[", "//Button[name()]", "//Button[@name=1]", "Button | Other"]:
+        with pytest.raises(ValueError):
+            tree.xpath(expr)
+
+
+def test_xpath_matches_elementtree():
+    source = make_source(30_000)
+    tree = ParsedSource.from_xml(source)
+    root = ET.fromstring(source)
+    for ours, theirs in [
+        ("//Cell[3]/Button", ".//XCUIElementTypeCell[3]/XCUIElementTypeButton"),
+        ("//Button[@label='More']", ".//XCUIElementTypeButton[@label='More']"),
+        ("//Window/Cell[last()]/Button", ".//XCUIElementTypeWindow/XCUIElementTypeCell[last()]/XCUIElementTypeButton"),
+    ]:
+        assert [e.attrib for e in tree.xpath(ours)] == [e.attrib for e in root.iterfind(theirs)]
+
+
+def test_json_source():
+    xml_tree = ParsedSource.from_xml(make_source(20_000))
+    json_tree = parse_source(make_source_json(20_000))
+    assert len(json_tree) == len(xml_tree)
+    for a, b in zip(xml_tree, json_tree):
+        assert (a.type, a.parent and a.parent.pos, a.end) == (b.type, b.parent and b.parent.pos, b.end)
+        assert {k: v for k, v in a.attrib.items() if k != "index"} == b.attrib
+
+
+def test_sourcetree_cached():
+    with FakeWDA(source_size=20_000) as wda:
+        c = AppiumClient(wda.url)
+        source = c.sourcetree()
+        assert source.tree is source.tree
+        assert source.tree.find("Button", name="more-3").label == "More"
+        # parsed per snapshot, nothing kept across snapshots
+        assert c.sourcetree().tree is not source.tree
+        assert "_parsed" not in repr(source)
+
+        tree = c.sourcetree(format="json").tree
+        assert tree.find("Button", name="more-3").label == "More"
+        assert wda.requests["GET /source"] == 3
+
+    assert SourceTree.value_of({"value": PAGE}).tree.find(name="help").enabled is False
@@ -0,0 +1,72 @@
+# coding: utf-8
+#
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from wdapy import AppiumClient, AsyncAppiumClient
+from wdapy._proto import GET
+from wdapy.exceptions import RequestError
+from wdapy.testing.wda import FakeWDA
+from wdapy.transport import RecordingTransport, ReplayTransport
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / "wda.jsonl")
+    with FakeWDA(latency=0.05) as wda:
+        c = AppiumClient(wda.url)
+        c.transport = RecordingTransport(path)
+        c.tap(1, 2)
+        c.tap(3, 4)
+        assert c.window_size() == (390, 844)
+        with pytest.raises(RequestError):
+            c.request(GET, "/unknown")
+        c.transport.close()
+    return path
+
+
+def test_recording_format(recording):
+    with open(recording) as f:
+        items = [json.loads(line) for line in f]
+    assert [(i["m"], i["p"].split("/")[-1]) for i in items[:3]] == [("GET", "status"), ("POST", "session"), ("POST", "tap")]
+    assert items[2]["q"] == {"x": 1, "y": 2}
+    assert items[2]["s"] == 200 and items[2]["d"] >= 0.05
+    assert sum(1 for i in items if i["p"] == "/unknown") == 2  # retried GET
+
+
+def test_replay(recording):
+    c = AppiumClient("http://replay.invalid")
+    c.transport = replay = ReplayTransport(recording)
+    start = time.perf_counter()
+    c.tap(1, 2)
+    c.tap(3, 4)
+    c.tap(5, 6)  # not recorded, served by endpoint
+    assert c.window_size() == (390, 844)
+    assert time.perf_counter() - start < 0.05
+    with pytest.raises(RequestError):
+        c.request(GET, "/unknown")
+    assert len(replay) == 0
+    with pytest.raises(RequestError, match="no recorded exchange"):
+        c.request(GET, "/source")
+
+
+def test_replay_realtime(recording):
+    c = AppiumClient("http://replay.invalid")
+    c.transport = ReplayTransport(recording, realtime=True, speed=2)
+    start = time.perf_counter()
+    c.status()
+    assert time.perf_counter() - start >= 0.025
+
+
+def test_async_replay(recording):
+    async def main():
+        async with AsyncAppiumClient("http://replay.invalid") as c:
+            c.transport = ReplayTransport(recording)
+            await c.tap(1, 2)
+            return await c.window_size()
+
+    assert asyncio.run(main()) == (390, 844)
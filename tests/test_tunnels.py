@@ -0,0 +1,154 @@
+# coding: utf-8
+#
+
+import json
+import time
+
+import pytest
+
+from wdapy import AppiumUSBClient
+from wdapy.testing.usbmuxd import FakeUsbmuxd
+from wdapy.testing.wda import FakeWDA
+from wdapy.usbmux import tunnels
+from wdapy.usbmux.exceptions import MuxConnectError
+from wdapy.usbmux.pyusbmux import MuxConnection, USBMuxHTTPConnection, forget_protocol_version, select_device
+from wdapy.usbmux.registry import get_registry
+from wdapy.usbmux.tunnels import TunnelPool, get_tunnel_pool
+
+
+def wait_until(fn, timeout: float = 2.0):
+    deadline = time.time() + timeout
+    while not fn():
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+@pytest.fixture(scope="module")
+def wda():
+    with FakeWDA() as server:
+        yield server
+
+
+@pytest.fixture
+def usbmuxd(wda):
+    tunnels.set_pool_size(tunnels.DEFAULT_POOL_SIZE)
+    with FakeUsbmuxd(devices=1, ports={8100: wda.address}) as server:
+        yield server
+    tunnels.set_pool_size(0)
+
+
+def get_status(conn: USBMuxHTTPConnection) -> dict:
+    conn.request("GET", "/status")
+    resp = conn.getresponse()
+    assert resp.status == 200
+    return json.loads(resp.read())
+
+
+def test_prefetch_off_by_default(wda):
+    with FakeUsbmuxd(devices=1, ports={8100: wda.address}) as usbmuxd:
+        device = select_device(usbmux_address=usbmuxd.address)
+        assert get_tunnel_pool(device, 8100, usbmuxd.address) is None
+
+
+def test_tunnel_pool_prefetch(usbmuxd):
+    device = select_device(usbmux_address=usbmuxd.address)
+    pool = TunnelPool(device, 8100, size=2, usbmux_address=usbmuxd.address)
+    try:
+        sock, reused = pool.acquire(timeout=3)
+        assert not reused
+        sock.close()
+        wait_until(lambda: pool.idle == 2)
+        assert usbmuxd.requests["Connect"] == 3
+
+        sock, reused = pool.acquire(timeout=3)
+        assert reused
+        assert sock.gettimeout() == 3
+        sock.close()
+        wait_until(lambda: pool.idle == 2)
+        assert pool.stats() == {"hits": 1, "misses": 1, "opened": 3, "stale": 0}
+    finally:
+        pool.close()
+
+
+def test_tunnel_pool_discards_stale(usbmuxd, wda):
+    device = select_device(usbmux_address=usbmuxd.address)
+    pool = TunnelPool(device, 8100, size=1, usbmux_address=usbmuxd.address, max_idle=0.2)
+    try:
+        pool.acquire()[0].close()
+        wait_until(lambda: pool.idle == 1)
+        time.sleep(0.3)
+        sock, reused = pool.acquire()
+        assert not reused
+        sock.close()
+        assert pool.stats()["stale"] == 1
+    finally:
+        pool.close()
+
+
+def test_tunnel_pool_closed_tunnel(wda):
+    # usbmuxd goes away and closes the tunnels, acquire must not hand them out
+    usbmuxd = FakeUsbmuxd(devices=1, ports={8100: wda.address}).start()
+    device = select_device(usbmux_address=usbmuxd.address)
+    pool = TunnelPool(device, 8100, size=1, usbmux_address=usbmuxd.address)
+    try:
+        pool.acquire()[0].close()
+        wait_until(lambda: pool.idle == 1)
+        usbmuxd.close()
+        with pytest.raises(MuxConnectError):
+            pool.acquire(timeout=1)
+        assert pool.stats()["stale"] == 1
+    finally:
+        pool.close()
+
+
+def test_tunnel_pool_stops_on_error(usbmuxd):
+    device = select_device(usbmux_address=usbmuxd.address)
+    pool = get_tunnel_pool(device, 9999, usbmuxd.address)
+    with pytest.raises(MuxConnectError):
+        pool.acquire()
+    wait_until(lambda: pool.closed)
+    assert isinstance(pool.last_error, MuxConnectError)
+    assert get_tunnel_pool(device, 9999, usbmuxd.address) is not pool
+
+
+def test_http_connection_uses_pool(usbmuxd):
+    device = select_device(usbmux_address=usbmuxd.address)
+    with USBMuxHTTPConnection(device, 8100, usbmux_address=usbmuxd.address) as conn:
+        assert get_status(conn)["value"]["ready"]
+        assert not conn.prefetched
+    pool = get_tunnel_pool(device, 8100, usbmuxd.address)
+    wait_until(lambda: pool.idle == tunnels.DEFAULT_POOL_SIZE)
+    connects = usbmuxd.requests["Connect"]
+    with USBMuxHTTPConnection(device, 8100, usbmux_address=usbmuxd.address) as conn:
+        assert get_status(conn)["value"]["ready"]
+        assert conn.prefetched
+    assert pool.stats()["hits"] == 1
+    wait_until(lambda: usbmuxd.requests["Connect"] == connects + 1)
+
+    # detached devices drop their tunnels
+    get_registry(usbmuxd.address).on_detached(device.devid)
+    assert pool.closed
+    assert pool.idle == 0
+
+
+def test_client_resends_on_dead_prefetched_tunnel(usbmuxd, wda, monkeypatch):
+    monkeypatch.setattr(MuxConnection, "USBMUXD_PIPE", usbmuxd.address)
+    monkeypatch.setattr(tunnels, "_pool_size", 1)
+    udid = usbmuxd.devices[0].serial
+    c = AppiumUSBClient(udid)
+    try:
+        assert c.status().message
+        pool = get_tunnel_pool(get_registry().resolve(udid), 8100)
+        wait_until(lambda: pool.idle == 1)
+        c.close()  # the next request takes the prefetched tunnel
+
+        # WDA runs the GET, then the tunnel breaks before the response
+        wda.drop_responses = 1
+        assert c.status().message
+        assert c.pool_stats["reconnects"] == 1
+        assert pool.stats()["hits"] >= 1
+    finally:
+        c.close()
+        tunnels.close_tunnel_pools()
+        get_registry().invalidate(udid)
+        forget_protocol_version()
@@ -0,0 +1,343 @@
+# coding: utf-8
+#
+
+import asyncio
+import json
+import plistlib
+import socket
+import threading
+import time
+
+import pytest
+
+from wdapy.testing.usbmuxd import FakeDevice, FakeUsbmuxd
+from wdapy.testing.wda import FakeWDA
+from wdapy.usbmux import _codec, aio
+from wdapy.usbmux import pyusbmux
+from wdapy.usbmux.exceptions import BadDevError, MuxConnectError, MuxConnectToUsbmuxdError, MuxVersionError, \
+    NotPairedError
+from wdapy.usbmux.pyusbmux import BinaryMuxConnection, MuxDevice, PlistMuxConnection, SafeStreamSocket, \
+    USBMuxHTTPConnection, \
+    COMPLETE, VERSION_BINARY, VERSION_PLIST, create_mux, get_protocol_version, list_devices, select_device, \
+    set_protocol_version
+
+
+def test_codec_matches_construct():
+    # the packet layout as construct definitions, the struct codec must agree with it
+    pytest.importorskip("construct")
+    from construct import Const, CString, Enum, FixedSized, GreedyBytes, Int16ul, Int32ul, Padding, Prefixed, \
+        Struct, Switch, this
+
+    usbmuxd_version = Enum(Int32ul, BINARY=0, PLIST=1)
+    usbmuxd_result = Enum(Int32ul, OK=0, BADCOMMAND=1, BADDEV=2, CONNREFUSED=3, BADVERSION=6)
+    usbmuxd_msgtype = Enum(Int32ul, RESULT=1, CONNECT=2, LISTEN=3, ADD=4, REMOVE=5, PAIRED=6, PLIST=8)
+    usbmuxd_header = Struct('version' / usbmuxd_version, 'message' / usbmuxd_msgtype, 'tag' / Int32ul)
+    usbmuxd_request = Prefixed(Int32ul, Struct(
+        'header' / usbmuxd_header,
+        'data' / Switch(this.header.message, {
+            usbmuxd_msgtype.CONNECT: Struct('device_id' / Int32ul, 'port' / Int16ul, 'reserved' / Const(0, Int16ul)),
+            usbmuxd_msgtype.PLIST: GreedyBytes,
+        }),
+    ), includelength=True)
+    usbmuxd_device_record = Struct('device_id' / Int32ul, 'product_id' / Int16ul,
+                                   'serial_number' / FixedSized(256, CString('ascii')), Padding(2),
+                                   'location' / Int32ul)
+    usbmuxd_response = Prefixed(Int32ul, Struct(
+        'header' / usbmuxd_header,
+        'data' / Switch(this.header.message, {
+            usbmuxd_msgtype.RESULT: Struct('result' / usbmuxd_result),
+            usbmuxd_msgtype.ADD: usbmuxd_device_record,
+            usbmuxd_msgtype.REMOVE: Struct('device_id' / Int32ul),
+            usbmuxd_msgtype.PLIST: GreedyBytes,
+        }),
+    ), includelength=True)
+
+    assert _codec.MSG_PLIST == int(usbmuxd_msgtype.PLIST)
+    assert _codec.RESULT_BADVERSION == int(usbmuxd_result.BADVERSION)
+
+    assert _codec.build_connect(_codec.VERSION_BINARY, 3, 7, socket.htons(8100)) == usbmuxd_request.build({
+        'header': {'version': usbmuxd_version.BINARY, 'message': usbmuxd_msgtype.CONNECT, 'tag': 3},
+        'data': {'device_id': 7, 'port': socket.htons(8100)}})
+    payload = plistlib.dumps({'MessageType': 'Listen'})
+    assert _codec.build(_codec.VERSION_PLIST, _codec.MSG_PLIST, 2, payload) == usbmuxd_request.build({
+        'header': {'version': usbmuxd_version.PLIST, 'message': usbmuxd_msgtype.PLIST, 'tag': 2}, 'data': payload})
+
+    header = {'version': usbmuxd_version.BINARY, 'tag': 5}
+    for message, data in [
+        (usbmuxd_msgtype.RESULT, {'result': usbmuxd_result.BADDEV}),
+        (usbmuxd_msgtype.ADD, {'device_id': 9, 'product_id': 0x12a8, 'serial_number': '00008101-0001',
+                               'location': 0x90000}),
+        (usbmuxd_msgtype.REMOVE, {'device_id': 9}),
+    ]:
+        packet = usbmuxd_response.build({'header': dict(header, message=message), 'data': data})
+        expected = usbmuxd_response.parse(packet)
+        response = _codec.parse(packet)
+        assert response.header == (0, int(message), 5)
+        for key in data:
+            value = getattr(expected.data, key)
+            if key != 'serial_number':
+                value = int(value)  # construct returns enum strings
+            assert getattr(response.data, key) == value
+
+
+@pytest.fixture
+def stream_pair(tmp_path):
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(str(tmp_path / "s"))
+    server.listen(1)
+    stream = SafeStreamSocket(str(tmp_path / "s"), socket.AF_UNIX)
+    peer, _ = server.accept()
+    server.close()
+    yield stream, peer
+    stream.close()
+    peer.close()
+
+
+def test_stream_buffered(stream_pair):
+    stream, peer = stream_pair
+    data = bytes(range(256)) * 400
+    peer.sendall(data[:100])
+    assert stream.recv(4) == data[:4]
+    assert stream.pending == 96
+    assert stream.recv(16) == data[4:20]
+    peer.sendall(data[100:])
+    buf = bytearray(len(data) - 20)
+    assert stream.readinto(buf) == len(buf)
+    assert bytes(buf) == data[20:]
+    assert stream.tell() == len(data)
+
+
+def test_stream_timeout_keeps_data(stream_pair):
+    stream, peer = stream_pair
+    stream.settimeout(0.05)
+    peer.sendall(b"hello ")
+    with pytest.raises(socket.timeout):
+        stream.recv(11)
+    peer.sendall(b"world")
+    assert stream.recv(11) == b"hello world"
+
+    stream.unread(b"abc")
+    assert stream.recv(3) == b"abc"
+
+
+def test_stream_no_readahead(stream_pair):
+    stream, peer = stream_pair
+    stream.readahead = False
+    peer.sendall(b"RESULT" + b"DEVICE")
+    assert stream.recv(6) == b"RESULT"
+    assert stream.pending == 0
+    assert stream.sock.recv(6) == b"DEVICE"
+
+
+@pytest.fixture(scope="module")
+def wda():
+    with FakeWDA() as server:
+        yield server
+
+
+@pytest.fixture(params=["plist", "binary"])
+def usbmuxd(request, wda):
+    with FakeUsbmuxd(devices=3, protocol=request.param, ports={8100: wda.address}) as server:
+        yield server
+
+
+def test_protocol_detect(usbmuxd):
+    mux = create_mux(usbmuxd.address)
+    expected = PlistMuxConnection if usbmuxd.protocol == "plist" else BinaryMuxConnection
+    assert type(mux) is expected
+    mux.close()
+
+
+def test_protocol_version_cached(usbmuxd):
+    list_devices(usbmuxd.address)
+    list_devices(usbmuxd.address)
+    assert usbmuxd.connections == 3  # one probe, then one socket per call
+    expected = VERSION_PLIST if usbmuxd.protocol == "plist" else VERSION_BINARY
+    assert get_protocol_version(usbmuxd.address) == expected
+
+
+def test_protocol_version_pinned():
+    with FakeUsbmuxd(devices=1, protocol="binary") as usbmuxd:
+        set_protocol_version(VERSION_BINARY, usbmuxd.address)
+        try:
+            assert len(list_devices(usbmuxd.address)) == 1
+            assert usbmuxd.connections == 1
+            assert type(create_mux(usbmuxd.address, version=VERSION_PLIST)) is PlistMuxConnection
+        finally:
+            set_protocol_version(None, usbmuxd.address)
+        assert get_protocol_version(usbmuxd.address) is None
+
+
+def test_protocol_version_invalidated():
+    with FakeUsbmuxd(devices=1, protocol="binary") as usbmuxd:
+        # negotiated with a daemon that was replaced by a binary only one
+        pyusbmux._cache_protocol_version(usbmuxd.address, VERSION_PLIST)
+        with pytest.raises(MuxVersionError):
+            list_devices(usbmuxd.address)
+        assert get_protocol_version(usbmuxd.address) is None
+        assert len(list_devices(usbmuxd.address)) == 1
+        assert get_protocol_version(usbmuxd.address) == VERSION_BINARY
+
+
+def test_list_devices(usbmuxd):
+    devices = list_devices(usbmuxd.address)
+    assert [d.serial for d in devices] == [d.serial for d in usbmuxd.devices]
+    assert all(d.is_usb for d in devices)
+
+    usbmuxd.detach(devices[0].devid)
+    usbmuxd.attach(FakeDevice(10, "00008101-NETWORK", "Network"))
+    devices = list_devices(usbmuxd.address)
+    assert len(devices) == 3
+    assert devices[0].devid == 2
+
+
+def test_select_device(usbmuxd):
+    serial = usbmuxd.devices[1].serial
+    device = select_device(serial.replace("-", ""), usbmux_address=usbmuxd.address)
+    assert device.serial == serial
+    assert select_device("not-exist", usbmux_address=usbmuxd.address) is None
+
+
+def test_listen_events():
+    with FakeUsbmuxd(devices=1) as usbmuxd:
+        mux = create_mux(usbmuxd.address)
+
+        def events():
+            while usbmuxd.listeners == 0:
+                time.sleep(0.01)
+            usbmuxd.attach()
+            usbmuxd.detach(1)
+
+        t = threading.Thread(target=events)
+        t.start()
+        mux.get_device_list(0.3)
+        t.join()
+        mux.close()
+        assert [d.devid for d in mux.devices] == [2]
+
+
+def test_connect_relay(usbmuxd):
+    device = select_device(usbmux_address=usbmuxd.address)
+    with USBMuxHTTPConnection(device, 8100, usbmux_address=usbmuxd.address) as conn:
+        for _ in range(2):
+            conn.request("GET", "/status")
+            resp = conn.getresponse()
+            assert resp.status == 200
+            assert json.loads(resp.read())["value"]["ready"] is True
+    assert usbmuxd.requests["Connect"] == 1
+
+
+def test_connect_errors(usbmuxd):
+    with pytest.raises(BadDevError):
+        MuxDevice(100, "unknown", "USB").connect(8100, usbmux_address=usbmuxd.address)
+    with pytest.raises(MuxConnectError):
+        MuxDevice(1, usbmuxd.devices[0].serial, "USB").connect(9999, usbmux_address=usbmuxd.address)
+
+
+def test_connect_refused_by_device(wda):
+    # port mapped but nothing listens there
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    address = s.getsockname()
+    s.close()
+    with FakeUsbmuxd(devices=1, ports={8100: address}) as usbmuxd:
+        with pytest.raises(MuxConnectError):
+            MuxDevice(1, "x", "USB").connect(8100, usbmux_address=usbmuxd.address)
+
+
+def test_no_daemon(tmp_path):
+    with pytest.raises(MuxConnectToUsbmuxdError):
+        list_devices(str(tmp_path / "nothing"))
+
+
+def test_pair_record():
+    with FakeUsbmuxd(devices=1) as usbmuxd:
+        mux = create_mux(usbmuxd.address)
+        assert mux.get_buid() == usbmuxd.buid
+        mux.save_pair_record("SERIAL", 1, b"<plist/>")
+        assert usbmuxd.pair_records["SERIAL"] == b"<plist/>"
+        with pytest.raises(NotPairedError):
+            mux.get_pair_record("OTHER")
+        mux.close()
+
+
+def test_aio_list_and_connect(wda):
+    with FakeUsbmuxd(devices=2, ports={8100: wda.address}) as usbmuxd:
+        async def main():
+            devices = await aio.list_devices(usbmuxd.address)
+            assert [d.devid for d in devices] == [1, 2]
+            reader, writer = await aio.connect(devices[1], 8100, usbmuxd.address)
+            writer.write(b"GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            line = await reader.readline()
+            writer.close()
+            return line
+
+        assert asyncio.run(main()).startswith(b"HTTP/1.1 200")
+
+
+@pytest.mark.parametrize("protocol,list_devices_supported", [("plist", True), ("plist", False), ("binary", False)])
+def test_list_devices_fast(protocol, list_devices_supported):
+    with FakeUsbmuxd(devices=5, protocol=protocol, list_devices=list_devices_supported) as usbmuxd:
+        start = time.perf_counter()
+        assert len(list_devices(usbmuxd.address)) == 5
+        assert time.perf_counter() - start < 0.09  # the old fixed Listen window was 0.1s
+        assert usbmuxd.requests["ListDevices"] == (1 if protocol == "plist" else 0)
+        assert usbmuxd.requests["Listen"] == (0 if list_devices_supported else 1)
+
+
+def test_list_devices_loaded_hub():
+    # events trickle in slower than the first quiet window, the window adapts to the gaps
+    with FakeUsbmuxd(devices=6, protocol="binary", event_interval=0.015) as usbmuxd:
+        assert len(list_devices(usbmuxd.address)) == 6
+    # a busy daemon answers Listen late too, its first event gets more time
+    with FakeUsbmuxd(devices=6, protocol="binary", latency=0.02, event_interval=0.025) as usbmuxd:
+        assert len(list_devices(usbmuxd.address)) == 6
+        start = time.perf_counter()
+        assert len(list_devices(usbmuxd.address, mode=COMPLETE, timeout=0.5)) == 6
+        assert time.perf_counter() - start >= 0.5
+        assert len(list_devices(usbmuxd.address, mode=COMPLETE, timeout=0.06)) < 6
+        with pytest.raises(ValueError):
+            list_devices(usbmuxd.address, mode="slow")
+
+
+def test_aio_binary_only_usbmuxd():
+    with FakeUsbmuxd(devices=1, protocol="binary") as usbmuxd:
+        with pytest.raises(MuxVersionError):
+            asyncio.run(aio.list_devices(usbmuxd.address))
+
+
+def test_aio_usb_client_create(wda, monkeypatch):
+    from wdapy import AsyncAppiumUSBClient
+    from wdapy.usbmux.registry import get_registry
+
+    def blocking_list_devices(*args, **kwargs):  # pragma: no cover
+        raise AssertionError("blocking usbmuxd query on the event loop")
+
+    monkeypatch.setattr("wdapy._wdapy.list_devices", blocking_list_devices)
+    with FakeUsbmuxd(devices=1, ports={8100: wda.address}) as usbmuxd:
+        monkeypatch.setattr(pyusbmux.MuxConnection, "USBMUXD_PIPE", usbmuxd.address)
+        udid = usbmuxd.devices[0].serial
+
+        async def main():
+            async with await AsyncAppiumUSBClient.create() as c:
+                return await c.status()
+
+        try:
+            assert asyncio.run(main()).message
+            assert usbmuxd.requests["Connect"] == 1
+        finally:
+            get_registry().invalidate(udid)
+
+
+@pytest.mark.parametrize("list_devices_supported", [True, False])
+def test_aio_list_devices_fast(list_devices_supported):
+    with FakeUsbmuxd(devices=3, list_devices=list_devices_supported) as usbmuxd:
+        async def main():
+            start = time.perf_counter()
+            devices = await aio.list_devices(usbmuxd.address)
+            assert time.perf_counter() - start < 0.09  # the old fixed Listen window was 0.1s
+            complete = await aio.list_devices(usbmuxd.address, mode=COMPLETE, timeout=0.1)
+            return devices, complete
+
+        devices, complete = asyncio.run(main())
+        assert [d.devid for d in devices] == [d.devid for d in complete] == [1, 2, 3]
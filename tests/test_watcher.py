@@ -0,0 +1,113 @@
+# coding: utf-8
+#
+
+import threading
+import time
+
+import pytest
+
+from wdapy.testing.usbmuxd import FakeUsbmuxd
+from wdapy.usbmux.pyusbmux import MuxDevice, list_devices, select_device
+from wdapy.usbmux.registry import get_registry
+from wdapy.usbmux.watcher import ATTACHED, DETACHED, DeviceWatcher, get_watcher
+
+
+def wait_until(fn, timeout: float = 2.0):
+    deadline = time.time() + timeout
+    while not fn():
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+@pytest.fixture(params=["plist", "binary"])
+def usbmuxd(request):
+    with FakeUsbmuxd(devices=2, protocol=request.param) as server:
+        yield server
+
+
+def test_watcher_events(usbmuxd):
+    received = []
+    with DeviceWatcher(usbmuxd.address) as watcher:
+        watcher.add_listener(received.append)
+        assert watcher.wait_ready(2)
+        assert [d.devid for d in watcher.devices] == [1, 2]
+
+        events = watcher.events(timeout=2)
+        assert [(e.kind, e.device.devid) for e in [next(events), next(events)]] == [(ATTACHED, 1), (ATTACHED, 2)]
+
+        device = usbmuxd.attach()
+        assert next(events).device.serial == device.serial
+        usbmuxd.detach(1)
+        event = next(events)
+        assert (event.kind, event.device.devid) == (DETACHED, 1)
+        assert [d.devid for d in watcher.devices] == [2, 3]
+        assert watcher.select_device(device.serial).devid == 3
+        events.close()
+
+    kinds = [(e.kind, e.device.devid) for e in received]
+    assert kinds[-2:] == [(ATTACHED, 3), (DETACHED, 1)]
+
+
+def test_watcher_events_end_on_close(usbmuxd):
+    watcher = DeviceWatcher(usbmuxd.address).start()
+    assert watcher.wait_ready(2)
+    result = []
+    t = threading.Thread(target=lambda: result.extend(watcher.events(initial=False)))
+    t.start()
+    time.sleep(0.05)
+    watcher.close()
+    t.join(2)
+    assert not t.is_alive()
+    assert result == []
+    assert not watcher.ready
+
+
+def test_watcher_drops_registry_on_detach(usbmuxd):
+    serial = usbmuxd.devices[0].serial
+    registry = get_registry(usbmuxd.address)
+    registry.register(serial, MuxDevice(1, serial, "USB"))
+    with DeviceWatcher(usbmuxd.address) as watcher:
+        assert watcher.wait_ready(2)
+        usbmuxd.detach(1)
+        wait_until(lambda: serial not in registry)
+
+
+def test_watcher_reconnect(tmp_path):
+    path = str(tmp_path / "usbmuxd")
+    first = FakeUsbmuxd(devices=2, path=path).start()
+    watcher = DeviceWatcher(path, reconnect_delay=0.05).start()
+    try:
+        assert watcher.wait_ready(2)
+        events = watcher.events(initial=False, timeout=3)
+        first.close()
+        wait_until(lambda: not watcher.ready)
+
+        # usbmuxd comes back with only the second device
+        with FakeUsbmuxd(devices=0, path=path) as second:
+            second.attach(first.devices[1])
+            wait_until(lambda: watcher.ready)
+            event = next(events)
+            assert (event.kind, event.device.devid) == (DETACHED, 1)
+            assert [d.devid for d in watcher.devices] == [2]
+            assert watcher.connections == 2
+        events.close()
+    finally:
+        watcher.close()
+
+
+def test_list_devices_from_watcher(usbmuxd):
+    watcher = get_watcher(usbmuxd.address)
+    try:
+        assert watcher.ready
+        connections = usbmuxd.connections
+        start = time.perf_counter()
+        assert len(list_devices(usbmuxd.address)) == 2
+        assert select_device(usbmuxd.devices[1].serial, usbmux_address=usbmuxd.address).devid == 2
+        assert time.perf_counter() - start < 0.05
+        assert usbmuxd.connections == connections
+        assert get_watcher(usbmuxd.address) is watcher
+    finally:
+        watcher.close()
+    # falls back to enumeration
+    assert len(list_devices(usbmuxd.address)) == 2
+    assert usbmuxd.connections > connections
@@ -2,6 +2,9 @@
 #
 
 from ._wdapy import (AppiumClient, AppiumUSBClient, NanoClient, NanoUSBClient)
+from .aio import (AsyncAppiumClient, AsyncAppiumUSBClient)
+from ._retry import (CircuitBreaker, RetryPolicy)
+from ._diff import (SnapshotDiff, diff_snapshots, structure_hash)
 
 from wdapy import exceptions
 from wdapy import _types as types
@@ -4,24 +4,42 @@
 """Created on Tue Sep 14 2021 15:26:27 by codeskyblue
 """
 
-from http.client import HTTPConnection, HTTPSConnection
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, HTTPResponse, IncompleteRead
 import logging
+import socket
+import threading
+import time
 import typing
 from typing import Optional, Union
 
 import json
-from retry import retry
 from urllib.parse import urlparse
 
+from wdapy import _deadline
+from wdapy._codec import JSONCodec, default_codec
+from wdapy._metrics import AfterRequestHook, BeforeRequestHook, Metrics, RequestRecord, RequestTiming, \
+    normalize_endpoint
+from wdapy._pool import ConnectionPool
 from wdapy._proto import *
+from wdapy._retry import CircuitBreaker, RetryPolicy, get_circuit_breaker, is_device_failure
+from wdapy._session import SessionManager
 from wdapy._types import Recover, StatusInfo
 from wdapy.exceptions import *
-from wdapy.usbmux.exceptions import MuxConnectError
-from wdapy.usbmux.pyusbmux import select_device
+from wdapy.usbmux.exceptions import BadDevError, MuxConnectError
+from wdapy.usbmux.registry import get_registry
 
 
 logger = logging.getLogger(__name__)
 
+# errors raised when a kept-alive connection was closed by the server
+_STALE_CONNECTION_ERRORS = (ConnectionResetError, BrokenPipeError, HTTPException)
+# the subset raised while writing the request, WDA did not get a complete request
+_UNSENT_ERRORS = (ConnectionResetError, BrokenPipeError)
+
+READ_CHUNK_SIZE = 256 * 1024
+DEFAULT_MAX_BODY_SIZE = 128 * 1024 * 1024
+
+
 class HTTPResponseWrapper:
     def __init__(self, content: Union[bytes, bytearray], status_code: int):
         self.content = content
@@ -38,11 +56,65 @@ class HTTPResponseWrapper:
         return self.status_code
 
 
-def http_create(url: str) -> typing.Union[HTTPConnection, HTTPSConnection]:
+def read_response_body(response: HTTPResponse, max_size: Optional[int] = DEFAULT_MAX_BODY_SIZE,
+                       deadline: Optional[float] = None, sock: Optional[socket.socket] = None) -> bytearray:
+    """ read the whole body into one buffer
+
+    With Content-Length the buffer is allocated once and filled with readinto,
+    otherwise (chunked encoding or read until close) it grows by READ_CHUNK_SIZE reads.
+
+    Args:
+        deadline: time.monotonic() value, the body is read in READ_CHUNK_SIZE steps
+            and the timeout of sock is shrunk to the remaining time before each step
+
+    Raises:
+        ResponseTooLarge, IncompleteRead, DeadlineExceeded
+    """
+    def check_deadline():
+        if deadline is not None:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise DeadlineExceeded("deadline exceeded while reading response body")
+            if sock is not None:
+                sock.settimeout(left)
+
+    length = response.length
+    if length is not None:
+        if max_size is not None and length > max_size:
+            raise ResponseTooLarge(f"Content-Length {length} exceeds max_body_size {max_size}")
+        content = bytearray(length)
+        view = memoryview(content)
+        step = length if deadline is None else READ_CHUNK_SIZE
+        pos = 0
+        while pos < length:
+            check_deadline()
+            n = response.readinto(view[pos:pos + step])
+            if not n:
+                raise IncompleteRead(bytes(view[:pos]), length - pos)
+            pos += n
+        view.release()
+        return content
+
+    content = bytearray()
+    while True:
+        check_deadline()
+        if not (chunk := response.read(READ_CHUNK_SIZE)):
+            break
+        content += chunk
+        if max_size is not None and len(content) > max_size:
+            raise ResponseTooLarge(f"response body exceeds max_body_size {max_size}")
+    return content
+
+
+def http_create(url: str, timeout: Optional[float] = None) -> typing.Union[HTTPConnection, HTTPSConnection]:
+    """
+    Args:
+        timeout: bounds usbmux device resolution, the connection itself gets the timeout of each request
+    """
     u = urlparse(url)
     if u.scheme == "http+usbmux":
         udid, device_wda_port = u.netloc.split(":")
-        device = select_device(udid)
+        device = get_registry().resolve(udid, timeout=timeout)
         return device.make_http_connection(int(device_wda_port))
     elif u.scheme == "http":
         return HTTPConnection(u.netloc)
@@ -53,14 +125,34 @@ def http_create(url: str) -> typing.Union[HTTPConnection, HTTPSConnection]:
 
 
 class BaseClient:
+    """
+    A client can be shared by many threads: every request checks out its own connection
+    from the pool, the session id lives in a SessionManager, and recovery runs once at a time.
+    """
+
     def __init__(self, wda_url: str):
         self._wda_url = wda_url.rstrip("/") + "/"
 
-        self._session_id: Optional[str] = None
+        self._sessions = SessionManager()
         self._recover: Optional[Recover] = None
+        self._recover_lock = threading.Lock()
+        self._recover_count = 0
 
         self.__request_timeout = DEFAULT_HTTP_TIMEOUT
         self.__debug = False
+        self._pool = ConnectionPool(self._create_connection)
+        # replaceable, e.g. client.json_codec = JSONCodec() to force stdlib json
+        self.json_codec: JSONCodec = default_codec()
+        # None means unlimited
+        self.max_body_size: Optional[int] = DEFAULT_MAX_BODY_SIZE
+        self.metrics = Metrics()
+        self.retry_policy = RetryPolicy()
+        # shared by all clients of the same device, None to disable
+        self.circuit_breaker: Optional[CircuitBreaker] = get_circuit_breaker(urlparse(self._wda_url).netloc)
+        # wdapy.transport.Transport wrapping every HTTP exchange, e.g. RecordingTransport or ReplayTransport
+        self.transport = None
+        self._before_request_hooks: typing.List[BeforeRequestHook] = []
+        self._after_request_hooks: typing.List[AfterRequestHook] = []
 
     @property
     def debug(self) -> bool:
@@ -78,6 +170,96 @@ class BaseClient:
     def request_timeout(self, timeout: float):
         self.__request_timeout = timeout
 
+    @property
+    def _session_id(self) -> Optional[str]:
+        return self._sessions.session_id
+
+    @_session_id.setter
+    def _session_id(self, session_id: Optional[str]):
+        self._sessions.set(session_id)
+
+    @property
+    def session_stats(self) -> dict:
+        """ current session id, age and validity, with created, adopted, reused and renewed counts """
+        return self._sessions.stats()
+
+    @property
+    def connection_pool(self) -> ConnectionPool:
+        return self._pool
+
+    @property
+    def pool_stats(self) -> dict:
+        """ created, reused, discarded, reconnects and idle connection counts """
+        return self._pool.stats()
+
+    def close(self):
+        """ close all kept-alive connections """
+        self._pool.clear()
+
+    def with_timeout(self, seconds: float) -> "BaseClient":
+        """ return a view of this client where each method call, including its retries
+        and session recovery, must finish within seconds
+
+        Example:
+            c.with_timeout(2.0).tap(100, 200)
+        """
+        return _deadline.TimeoutProxy(self, seconds)
+
+    @staticmethod
+    def deadline(seconds: Optional[float]):
+        """ context manager, all requests in the block share one budget of seconds
+
+        Example:
+            with c.deadline(5):
+                c.tap(100, 200)
+                c.screenshot()
+        """
+        return _deadline.deadline(seconds)
+
+    def add_before_request_hook(self, hook: BeforeRequestHook):
+        """ hook(record) is called before every request, record only has method, url, endpoint and payload """
+        self._before_request_hooks.append(hook)
+
+    def add_after_request_hook(self, hook: AfterRequestHook):
+        """ hook(record) is called after every request, with status_code or error, bytes and timing """
+        self._after_request_hooks.append(hook)
+
+    def remove_request_hook(self, hook: typing.Union[BeforeRequestHook, AfterRequestHook]):
+        for hooks in (self._before_request_hooks, self._after_request_hooks):
+            if hook in hooks:
+                hooks.remove(hook)
+
+    @staticmethod
+    def _call_hooks(hooks: typing.List[typing.Callable[[RequestRecord], None]], record: RequestRecord):
+        for hook in hooks:
+            try:
+                hook(record)
+            except Exception:
+                logger.exception("request hook %r failed", hook)
+
+    def _start_record(self, method: RequestMethod, full_url: str, urlpath: str,
+                      payload: Optional[dict]) -> RequestRecord:
+        record = RequestRecord(method.value, full_url, normalize_endpoint(urlpath), payload)
+        self._call_hooks(self._before_request_hooks, record)
+        return record
+
+    def _finish_record(self, record: RequestRecord):
+        self.metrics.observe(record)
+        self._call_hooks(self._after_request_hooks, record)
+
+    def _create_connection(self, url: str) -> typing.Union[HTTPConnection, HTTPSConnection]:
+        # device resolution spends the same budget as the request
+        return http_create(url, _deadline.budget(self.request_timeout))
+
+    def _open_device_socket(self, port: int) -> socket.socket:
+        """ open a raw TCP socket to another port of the device (e.g. mjpeg server) """
+        u = urlparse(self._wda_url)
+        timeout = _deadline.budget(self.request_timeout)
+        if u.scheme == "http+usbmux":
+            udid = u.netloc.split(":")[0]
+            return get_registry().resolve(udid, timeout=timeout).connect(port, timeout=timeout)
+        return socket.create_connection((u.hostname, port), timeout=timeout)
+
     def status(self) -> StatusInfo:
         data = self.request(GET, "/status")
         return StatusInfo.value_of(data)
@@ -87,6 +269,16 @@ class BaseClient:
                 arguments: Optional[list] = None,
                 environment: Optional[dict] = None) -> Optional[str]:
         """ create session and return session id """
+        payload = self._session_payload(bundle_id, arguments, environment)
+        data = self.request(POST, "/session", payload)
+
+        # update cached session_id
+        self._sessions.set(data['sessionId'], created=True)
+        self.metrics.inc("sessions_created")
+        return self._session_id
+
+    @staticmethod
+    def _session_payload(bundle_id: Optional[str], arguments: Optional[list], environment: Optional[dict]) -> dict:
         capabilities = {}
         if bundle_id:
             always_match = {
@@ -96,29 +288,25 @@ class BaseClient:
                 "shouldWaitForQuiescence": False,
             }
             capabilities['alwaysMatch'] = always_match
-        payload = {
+        return {
             "capabilities": capabilities,
             "desiredCapabilities": capabilities.get('alwaysMatch',
                                                     {}),  # 兼容旧版的wda
         }
-        data = self.request(POST, "/session", payload)
-
-        # update cached session_id
-        self._session_id = data['sessionId']
-        return self._session_id
 
     def set_recover_handler(self, recover: Recover):
         self._recover = recover
 
     def _get_valid_session_id(self) -> Optional[str]:
-        if self._session_id:
-            return self._session_id
+        # concurrent callers wait for one in-flight creation
+        return self._sessions.get(self._find_or_create_session)
+
+    def _find_or_create_session(self):
         old_session_id = self.status().session_id
         if old_session_id:
-            self._session_id = old_session_id
+            self._sessions.set(old_session_id)
         else:
-            self._session_id = self.session()
-        return self._session_id
+            self.session()
 
     def session_request(self, method: RequestMethod, urlpath: str, payload: Optional[dict] = None) -> dict:
         """ request with session_id """
@@ -130,74 +318,271 @@ class BaseClient:
             # In some condition, session_id exist in /status, but not working
             # The bellow code fix that case
             logger.info("session %r does not exist, generate new one", session_id)
-            session_id = self._session_id = self.session()
+            session_id = self._sessions.renew(session_id, self._recreate_session)
             session_urlpath = f"/session/{session_id}/" + urlpath.lstrip("/")
             return self.request(method, session_urlpath, payload)
 
+    def _recreate_session(self):
+        self.metrics.inc("sessions_recreated")
+        self.session()
+
     def request(self, method: RequestMethod, urlpath: str, payload: Optional[dict] = None) -> dict:
         """
         Raises:
             RequestError, WDASessionDoesNotExist
         """
         full_url = self._wda_url.rstrip("/") + "/" + urlpath.lstrip("/")
-        payload_debug = payload or ""
-        payload_debug = json.dumps(payload_debug, ensure_ascii=False)
         if self.debug:
-            print(f"$ curl -X{method} --max-time {self.request_timeout:d} {full_url} -d {payload_debug!r}")
-        resp = self._request_http(method, full_url, payload)
+            self._print_curl(method, full_url, payload)
+        record = self._start_record(method, full_url, urlpath, payload)
+        start = time.perf_counter()
+        try:
+            resp = self._request_http(method, full_url, payload, record=record)
+            decode_start = time.perf_counter()
+            try:
+                return self._parse_response(resp)
+            finally:
+                record.timing.decode = time.perf_counter() - decode_start
+        except BaseException as e:
+            record.error = e
+            raise
+        finally:
+            record.timing.total = time.perf_counter() - start
+            self._finish_record(record)
+
+    def _print_curl(self, method: RequestMethod, full_url: str, payload: Optional[dict]):
+        payload_debug = json.dumps(payload or "", ensure_ascii=False)
+        print(f"$ curl -X{method} --max-time {self.request_timeout:d} {full_url} -d {payload_debug!r}")
+
+    def _parse_response(self, resp: HTTPResponseWrapper) -> dict:
+        """ decode response body exactly once
+
+        Raises:
+            RequestError, ApiError
+        """
         try:
-            short_json = resp.json().copy()
-        except json.JSONDecodeError:
+            data = self.json_codec.loads(resp.content)
+        except ValueError:
             raise RequestError("response is not json format", resp.text)
 
-        for k, v in short_json.items():
-            if isinstance(v, str) and len(v) > 40:
-                v = v[:20] + "... skip ..." + v[-10:]
-            short_json[k] = v
         if self.debug:
+            short_json = {}
+            for k, v in data.items():
+                if isinstance(v, str) and len(v) > 40:
+                    v = v[:20] + "... skip ..." + v[-10:]
+                short_json[k] = v
             print(f"==> Response <==\n{json.dumps(short_json, indent=4, ensure_ascii=False)}")
 
-        value = resp.json().get("value")
+        value = data.get("value")
         if value and isinstance(value, dict) and value.get("error"):
             raise ApiError(resp.status_code, value["error"], value.get("message"))
 
-        return resp.json()
+        return data
 
-    @retry(RequestError, tries=2, delay=0.2, jitter=0.1, logger=logging)
     def _request_http(self, method: RequestMethod, url: str, payload: Optional[dict] = None, **kwargs) -> HTTPResponseWrapper:
+        """ send through circuit_breaker, retry by retry_policy
+
+        Raises:
+            RequestError, WDAFatalError, CircuitOpenError
+            WDASessionDoesNotExist
+        """
+        record: Optional[RequestRecord] = kwargs.get("record")
+        endpoint = record.endpoint if record is not None else normalize_endpoint(urlparse(url).path)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                _deadline.check_deadline()
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.before_request(self._probe)
+                resp = self._request_http_once(method, url, payload, **kwargs)
+            except Exception as e:
+                self._record_breaker(e)
+                delay = self._retry_delay(attempt, e, method, endpoint, start)
+                if delay is None:
+                    raise
+                logger.warning("%s, retrying in %.2f seconds...", e, delay)
+                time.sleep(delay)
+                continue
+            self._record_breaker(None)
+            return resp
+
+    def _retry_delay(self, attempt: int, error: Exception, method: RequestMethod, endpoint: str,
+                     start: float) -> Optional[float]:
+        delay = self.retry_policy.next_delay(attempt, error, method.value, endpoint, time.monotonic() - start)
+        left = _deadline.remaining()
+        if delay is not None and left is not None and delay >= left:
+            # no budget left for another attempt
+            return None
+        return delay
+
+    def _record_breaker(self, error: Optional[BaseException]):
+        # a spent deadline says nothing about the device
+        if self.circuit_breaker is None or isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+            return
+        if error is not None and is_device_failure(error):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    def _probe(self) -> bool:
+        """ half-open circuit probe """
+        try:
+            self._request_http_once(GET, self._wda_url + "status")
+            return True
+        except Exception as e:
+            logger.info("probe /status failed: %s", e)
+            return False
+
+    def _request_http_once(self, method: RequestMethod, url: str, payload: Optional[dict] = None,
+                           **kwargs) -> HTTPResponseWrapper:
         """
         Raises:
             RequestError, WDAFatalError
             WDASessionDoesNotExist
         """
         logger.info("request: %s %s %s", method, url, payload)
+        record: Optional[RequestRecord] = kwargs.get("record")
         try:
-            conn = http_create(url)
-            conn.timeout = kwargs.get("timeout", self.request_timeout)
             u = urlparse(url)
             urlpath = url[len(u.scheme) + len(u.netloc) + 3:]
+            timeout = _deadline.budget(kwargs.get("timeout", self.request_timeout))
+            body = self.json_codec.dumps(payload) if payload else None
+            if record is not None:
+                record.attempts += 1
 
-            if not payload:
-                conn.request(method.value, urlpath)
+            timing = record.timing if record is not None else None
+            if self.transport is not None:
+                resp = self.transport.request(method.value, urlpath, payload,
+                                              lambda: self._exchange(method, url, urlpath, body, timeout, timing))
             else:
-                conn.request(method.value, urlpath, json.dumps(payload), headers={"Content-Type": "application/json"})
-            response = conn.getresponse()
-            content = bytearray()
-            while chunk := response.read(4096):
-                content.extend(chunk)
-            resp = HTTPResponseWrapper(content, response.status)
-
-            if response.getcode() == 200:
-                return resp
-            else:
-                # handle unexpected response
-                if "Session does not exist" in resp.text:
-                    raise WDASessionDoesNotExist(resp.text)
-                else:
-                    raise RequestError(f"response code: {response.getcode()}", resp.text)
+                resp = self._exchange(method, url, urlpath, body, timeout, timing)
+
+            if record is not None:
+                record.status_code = resp.status_code
+                record.bytes_sent += len(body or b"")
+                record.bytes_received += len(resp.content)
+            return self._check_status(resp)
+        except (socket.timeout, TimeoutError) as err:
+            if _deadline.expired():
+                raise DeadlineExceeded("deadline exceeded", url) from err
+            raise
+        except BadDevError:
+            self._invalidate_usbmux_device(url)
+            raise
         except MuxConnectError as err:
+            self._invalidate_usbmux_device(url)
             if self._recover:
-                if not self._recover.recover():
+                _deadline.check_deadline()
+                if not self._run_recover():
                     raise WDAFatalError("recover failed")
-            raise RequestError("ConnectionBroken", err)
+            raise RequestError("ConnectionBroken", err) from err
+
+    def _exchange(self, method: RequestMethod, url: str, urlpath: str, body: Optional[bytes], timeout: float,
+                  timing: Optional[RequestTiming]) -> HTTPResponseWrapper:
+        """ send over a pooled connection and return the response of any status
+
+        A kept-alive connection closed by the server is replaced silently when the request could not be
+        written. Once written, WDA may have run it, so it is resent only when retry_policy says it is idempotent.
+        """
+        while True:
+            conn, reused = self._pool.acquire(url)
+            try:
+                self._write_request(conn, method, urlpath, body, timeout, timing)
+            except _UNSENT_ERRORS:
+                self._pool.discard(conn)
+                if not self._maybe_stale(conn, reused):
+                    raise
+                self._pool.mark_reconnect()
+                continue
+            except BaseException:
+                self._pool.discard(conn)
+                raise
+            try:
+                resp, will_close = self._read_response(conn, self.max_body_size, timing, _deadline.get_deadline())
+            except _STALE_CONNECTION_ERRORS:
+                self._pool.discard(conn)
+                if not self._maybe_stale(conn, reused) or not self.retry_policy.is_idempotent(method.value, normalize_endpoint(urlpath)):
+                    raise
+                self._pool.mark_reconnect()
+                continue
+            except BaseException:
+                self._pool.discard(conn)
+                raise
+            if will_close:
+                self._pool.discard(conn)
+            else:
+                self._pool.release(url, conn)
+            return resp
+
+    @staticmethod
+    def _maybe_stale(conn: HTTPConnection, reused: bool) -> bool:
+        # usbmux connections set prefetched in connect(), read it only after the request was written
+        return reused or getattr(conn, "prefetched", False)
+
+    def _run_recover(self) -> bool:
+        """ only one thread recovers, the others wait and reuse its result """
+        count = self._recover_count
+        left = _deadline.remaining()
+        if not self._recover_lock.acquire(timeout=-1 if left is None else max(0.0, left)):
+            raise DeadlineExceeded("deadline exceeded while waiting for recover")
+        try:
+            if count != self._recover_count:
+                # recovered by another thread while waiting
+                return True
+            if not self._recover.recover():
+                return False
+            self._recover_count += 1
+            return True
+        finally:
+            self._recover_lock.release()
+
+    @staticmethod
+    def _check_status(resp: HTTPResponseWrapper) -> HTTPResponseWrapper:
+        if resp.status_code == 200:
+            return resp
+        else:
+            # handle unexpected response
+            if "Session does not exist" in resp.text:
+                raise WDASessionDoesNotExist(resp.text)
+            else:
+                raise RequestError(f"response code: {resp.status_code}", resp.text)
+
+    @staticmethod
+    def _invalidate_usbmux_device(url: str):
+        u = urlparse(url)
+        if u.scheme == "http+usbmux":
+            udid = u.netloc.split(":")[0]
+            get_registry().invalidate(udid)
+
+    @staticmethod
+    def _write_request(conn: HTTPConnection, method: RequestMethod, urlpath: str, body: Optional[bytes],
+                       timeout: float, timing: Optional[RequestTiming] = None):
+        conn.timeout = timeout
+        t0 = time.perf_counter()
+        if conn.sock is None:
+            conn.connect()
+        else:
+            conn.sock.settimeout(timeout)
+        t1 = time.perf_counter()
+        if body is None:
+            conn.request(method.value, urlpath)
+        else:
+            conn.request(method.value, urlpath, body, headers={"Content-Type": "application/json"})
+        if timing is not None:
+            timing.connect += t1 - t0
+            timing.send += time.perf_counter() - t1
 
+    @staticmethod
+    def _read_response(conn: HTTPConnection, max_body_size: Optional[int] = DEFAULT_MAX_BODY_SIZE,
+                       timing: Optional[RequestTiming] = None,
+                       deadline: Optional[float] = None) -> typing.Tuple[HTTPResponseWrapper, bool]:
+        t0 = time.perf_counter()
+        response = conn.getresponse()
+        t1 = time.perf_counter()
+        content = read_response_body(response, max_body_size, deadline, conn.sock)
+        if timing is not None:
+            timing.ttfb += t1 - t0
+            timing.body += time.perf_counter() - t1
+        return HTTPResponseWrapper(content, response.status), response.will_close
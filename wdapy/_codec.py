@@ -0,0 +1,46 @@
+# coding: utf-8
+#
+"""
+JSON codec used to encode request payloads and decode WDA responses
+
+orjson is used automatically when installed, it is several times faster on
+large bodies like /screenshot and /source.
+"""
+
+from __future__ import annotations
+
+import json
+import typing
+
+
+class JSONCodec:
+    name = "json"
+
+    def loads(self, data: typing.Union[bytes, bytearray, memoryview, str]) -> typing.Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def dumps(self, obj: typing.Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, data: typing.Union[bytes, bytearray, memoryview, str]) -> typing.Any:
+        return self._orjson.loads(data)
+
+    def dumps(self, obj: typing.Any) -> bytes:
+        return self._orjson.dumps(obj)
+
+
+def default_codec() -> JSONCodec:
+    try:
+        return OrjsonCodec()
+    except ImportError:
+        return JSONCodec()
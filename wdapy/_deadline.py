@@ -0,0 +1,129 @@
+# coding: utf-8
+#
+"""
+Per-call deadlines carried in a contextvar
+
+Every request inside a deadline scope uses the remaining budget as its socket timeout,
+retries and session recovery stop when the budget is spent.
+
+Usage:
+    with deadline(2.0):
+        c.tap(100, 200)
+        c.screenshot()  # shares the same 2 seconds
+
+    c.with_timeout(2.0).tap(100, 200)
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import time
+import typing
+
+from wdapy.exceptions import DeadlineExceeded
+
+# absolute time.monotonic() value
+_deadline: contextvars.ContextVar[typing.Optional[float]] = contextvars.ContextVar("wdapy_deadline", default=None)
+
+
+def get_deadline() -> typing.Optional[float]:
+    return _deadline.get()
+
+
+def remaining() -> typing.Optional[float]:
+    """ seconds left in current deadline scope, None when there is no deadline """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check_deadline():
+    """
+    Raises:
+        DeadlineExceeded
+    """
+    if expired():
+        raise DeadlineExceeded("deadline exceeded")
+
+
+def budget(timeout: typing.Optional[float]) -> typing.Optional[float]:
+    """ return min(timeout, remaining)
+
+    Raises:
+        DeadlineExceeded
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("deadline exceeded")
+    return left if timeout is None else min(timeout, left)
+
+
+@contextlib.contextmanager
+def deadline(seconds: typing.Optional[float]):
+    """ run the block with at most seconds budget, a nested scope never extends the outer one """
+    if seconds is None:
+        yield
+        return
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        new_deadline = min(current, new_deadline)
+    token = _deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(fn: typing.Callable, seconds: typing.Optional[float]) -> typing.Callable:
+    """ wrap fn to run in a deadline scope, coroutine functions get the scope when awaited """
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def _async_inner(*args, **kwargs):
+            with deadline(seconds):
+                return await fn(*args, **kwargs)
+        return _async_inner
+
+    @functools.wraps(fn)
+    def _inner(*args, **kwargs):
+        with deadline(seconds):
+            result = fn(*args, **kwargs)
+        if inspect.isawaitable(result):
+            # e.g. async properties returning awaitables, start the scope when awaited
+            return _await_with_deadline(result, seconds)
+        return result
+    return _inner
+
+
+async def _await_with_deadline(awaitable: typing.Awaitable, seconds: typing.Optional[float]):
+    with deadline(seconds):
+        return await awaitable
+
+
+class TimeoutProxy:
+    """ returned by client.with_timeout(seconds), every method call runs in its own deadline scope """
+
+    def __init__(self, client, seconds: float):
+        self._client = client
+        self._seconds = seconds
+
+    def __getattr__(self, name: str):
+        # properties such as scale may send requests too
+        with deadline(self._seconds):
+            value = getattr(self._client, name)
+        if callable(value):
+            return with_deadline(value, self._seconds)
+        if inspect.isawaitable(value):
+            return _await_with_deadline(value, self._seconds)
+        return value
@@ -0,0 +1,240 @@
+# coding: utf-8
+#
+"""
+Compare /source snapshots by subtree hashes
+
+Equal subtrees have equal hashes, so the diff only walks into subtrees that changed; an
+unchanged page costs one comparison. Hashes are computed once per snapshot (and ignore set).
+
+Usage:
+    before = c.sourcetree()
+    c.tap(100, 200)
+    source = c.wait_ui_stable(ignore={"value"})  # a clock or progress text keeps changing
+    changes = diff_snapshots(before, source, ignore={"value"})
+    for element in changes.added:
+        print("new", element)
+"""
+
+from __future__ import annotations
+
+import bisect
+import collections
+import time
+import typing
+from dataclasses import dataclass, field
+
+from wdapy._source import ParsedSource, SourceElement
+from wdapy._types import SourceTree
+from wdapy.exceptions import UINotStable
+
+Snapshot = typing.Union[ParsedSource, SourceTree]
+Pair = typing.Tuple[SourceElement, SourceElement]
+
+
+@dataclass
+class SnapshotDiff:
+    added: typing.List[SourceElement] = field(default_factory=list)  # roots of new subtrees, in the new snapshot
+    removed: typing.List[SourceElement] = field(default_factory=list)  # roots of gone subtrees, in the old one
+    moved: typing.List[Pair] = field(default_factory=list)  # (old, new), same subtree at another place
+    changed: typing.List[Pair] = field(default_factory=list)  # (old, new), same element with other attributes
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.moved or self.changed)
+
+
+def _parsed(snapshot: Snapshot) -> ParsedSource:
+    return snapshot if isinstance(snapshot, ParsedSource) else snapshot.tree
+
+
+def structure_hash(snapshot: Snapshot, ignore: typing.AbstractSet[str] = frozenset()) -> int:
+    """ hash of the whole page, equal for equal pages """
+    tree = _parsed(snapshot)
+    if tree.root is None:
+        return 0
+    return tree.hashes(ignore)[0][0]
+
+
+def diff_snapshots(old: Snapshot, new: Snapshot, ignore: typing.AbstractSet[str] = frozenset()) -> SnapshotDiff:
+    """ what changed from old to new
+
+    Args:
+        ignore: attribute names not compared, e.g. {"value"} or {"x", "y"} for scrolling
+    """
+    return _Differ(_parsed(old), _parsed(new), ignore).run()
+
+
+class _Differ:
+    def __init__(self, old: ParsedSource, new: ParsedSource, ignore: typing.AbstractSet[str]):
+        self.old = old
+        self.new = new
+        self.old_subtree, self.old_own = old.hashes(ignore)
+        self.new_subtree, self.new_own = new.hashes(ignore)
+        self.result = SnapshotDiff()
+
+    def run(self) -> SnapshotDiff:
+        old_root, new_root = self.old.root, self.new.root
+        if old_root is None or new_root is None:
+            self.result.removed.extend([old_root] if old_root else [])
+            self.result.added.extend([new_root] if new_root else [])
+            return self.result
+        if old_root.type == new_root.type:
+            self._compare(old_root, new_root)
+        else:
+            self.result.removed.append(old_root)
+            self.result.added.append(new_root)
+        self._find_moves()
+        return self.result
+
+    def _compare(self, root_old: SourceElement, root_new: SourceElement):
+        stack = [(root_old, root_new)]
+        while stack:
+            o, n = stack.pop()
+            if self.old_subtree[o.pos] == self.new_subtree[n.pos]:
+                continue
+            if self.old_own[o.pos] != self.new_own[n.pos]:
+                self.result.changed.append((o, n))
+            stack.extend(self._match_children(o.children, n.children))
+
+    def _match_children(self, old: typing.List[SourceElement], new: typing.List[SourceElement]) -> typing.List[Pair]:
+        """ pair up children, unchanged subtrees first; return the pairs that differ inside """
+        # 1. identical subtrees, in order
+        by_hash: typing.Dict[int, typing.Deque[int]] = collections.defaultdict(collections.deque)
+        for j, e in enumerate(new):
+            by_hash[self.new_subtree[e.pos]].append(j)
+        new_taken = [False] * len(new)
+        same: typing.List[typing.Tuple[int, int]] = []
+        rest_old: typing.List[int] = []
+        for i, e in enumerate(old):
+            queue = by_hash.get(self.old_subtree[e.pos])
+            if queue:
+                j = queue.popleft()
+                new_taken[j] = True
+                same.append((i, j))
+            else:
+                rest_old.append(i)
+        # identical subtrees out of order moved among their siblings
+        keep = _longest_increasing([j for _, j in same])
+        self.result.moved.extend((old[i], new[j]) for k, (i, j) in enumerate(same) if k not in keep)
+
+        # 2. same element with changes inside: match by (type, name), then unnamed ones by type, in order
+        rest_new = [j for j in range(len(new)) if not new_taken[j]]
+        pairs: typing.List[Pair] = []
+        for key in (_key_named, _key_unnamed):
+            candidates: typing.Dict[typing.Any, typing.Deque[int]] = collections.defaultdict(collections.deque)
+            for j in rest_new:
+                candidates[key(new[j])].append(j)
+            unmatched = []
+            for i in rest_old:
+                k = key(old[i])
+                queue = candidates.get(k) if k is not None else None
+                if queue:
+                    j = queue.popleft()
+                    new_taken[j] = True
+                    pairs.append((old[i], new[j]))
+                else:
+                    unmatched.append(i)
+            rest_old = unmatched
+            rest_new = [j for j in rest_new if not new_taken[j]]
+
+        # 3. renamed: the only child of its type on both sides, e.g. a navigation bar with a new title
+        old_types = collections.Counter(e.type for e in old)
+        new_types = collections.Counter(e.type for e in new)
+        single_new = {new[j].type: j for j in rest_new if new_types[new[j].type] == 1}
+        unmatched = []
+        for i in rest_old:
+            j = single_new.get(old[i].type) if old_types[old[i].type] == 1 else None
+            if j is None:
+                unmatched.append(i)
+            else:
+                new_taken[j] = True
+                pairs.append((old[i], new[j]))
+        rest_old = unmatched
+        rest_new = [j for j in rest_new if not new_taken[j]]
+
+        self.result.removed.extend(old[i] for i in rest_old)
+        self.result.added.extend(new[j] for j in rest_new)
+        return pairs
+
+    def _find_moves(self):
+        """ a subtree removed in one place and added in another is a move """
+        removed: typing.Dict[int, typing.Deque[SourceElement]] = collections.defaultdict(collections.deque)
+        for e in self.result.removed:
+            removed[self.old_subtree[e.pos]].append(e)
+        added = []
+        for e in self.result.added:
+            queue = removed.get(self.new_subtree[e.pos])
+            if queue:
+                self.result.moved.append((queue.popleft(), e))
+            else:
+                added.append(e)
+        moved_old = {o.pos for o, _ in self.result.moved}
+        self.result.added = added
+        self.result.removed = [e for e in self.result.removed if e.pos not in moved_old]
+
+
+def _key_named(e: SourceElement) -> typing.Tuple[str, typing.Optional[str]]:
+    return e.type, e.name
+
+
+def _key_unnamed(e: SourceElement) -> typing.Optional[str]:
+    # elements with another name are different elements
+    return e.type if e.name is None else None
+
+
+def _longest_increasing(values: typing.List[int]) -> typing.Set[int]:
+    """ indexes of a longest strictly increasing subsequence, O(n log n) """
+    tails: typing.List[int] = []  # value at the end of the best subsequence of each length
+    tail_index: typing.List[int] = []
+    previous = [-1] * len(values)
+    for k, v in enumerate(values):
+        n = bisect.bisect_left(tails, v)
+        if n == len(tails):
+            tails.append(v)
+            tail_index.append(k)
+        else:
+            tails[n] = v
+            tail_index[n] = k
+        previous[k] = tail_index[n - 1] if n > 0 else -1
+    keep = set()
+    k = tail_index[-1] if tail_index else -1
+    while k >= 0:
+        keep.add(k)
+        k = previous[k]
+    return keep
+
+
+class StableChecker:
+    """ feed snapshots in polling order, stable once stable_count in a row have the same structure hash """
+
+    def __init__(self, stable_count: int = 2, ignore: typing.AbstractSet[str] = frozenset()):
+        self.stable_count = stable_count
+        self.ignore = frozenset(ignore)
+        self._hash: typing.Optional[int] = None
+        self._count = 0
+
+    def feed(self, snapshot: Snapshot) -> bool:
+        h = structure_hash(snapshot, self.ignore)
+        self._count = self._count + 1 if h == self._hash else 1
+        self._hash = h
+        return self._count >= self.stable_count
+
+
+def wait_ui_stable(get_source: typing.Callable[[], SourceTree], timeout: float = 10.0, interval: float = 0.3,
+                   stable_count: int = 2, ignore: typing.AbstractSet[str] = frozenset()) -> SourceTree:
+    """ poll get_source() until stable_count snapshots in a row have the same structure
+
+    Returns:
+        the last snapshot
+
+    Raises:
+        UINotStable: when timeout seconds passed, with the last snapshot
+    """
+    checker = StableChecker(stable_count, ignore)
+    deadline = time.monotonic() + timeout
+    while True:
+        source = get_source()
+        if checker.feed(source):
+            return source
+        if time.monotonic() + interval > deadline:
+            raise UINotStable(f"UI still changing after {timeout} seconds", source)
+        time.sleep(interval)
@@ -0,0 +1,237 @@
+# coding: utf-8
+#
+"""
+Request instrumentation: hooks and per-endpoint latency histograms
+
+Usage:
+    c = AppiumClient()
+    c.add_after_request_hook(lambda record: print(record.endpoint, record.timing.total))
+    c.tap(100, 200)
+    print(c.metrics.to_dict())
+    print(c.metrics.to_prometheus())
+"""
+
+from __future__ import annotations
+
+import bisect
+import collections
+import dataclasses
+import re
+import threading
+import typing
+
+# seconds, Prometheus style upper bounds, +Inf is implicit
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PHASES = ("connect", "send", "ttfb", "body", "decode", "total")
+
+_SESSION_RE = re.compile(r"/session/[^/]+")
+_ELEMENT_RE = re.compile(r"/element/[^/]+")
+
+
+def normalize_endpoint(urlpath: str) -> str:
+    """ make urlpath a low cardinality label
+
+    /session/3F2A.../element/5B1C.../click -> /session/{sessionId}/element/{elementId}/click
+    """
+    path = "/" + urlpath.split("?", 1)[0].strip("/")
+    path = _SESSION_RE.sub("/session/{sessionId}", path)
+    return _ELEMENT_RE.sub("/element/{elementId}", path)
+
+
+@dataclasses.dataclass
+class RequestTiming:
+    """ seconds spent in each phase, summed over retries """
+    connect: float = 0.0
+    send: float = 0.0
+    ttfb: float = 0.0  # from request sent to response headers received
+    body: float = 0.0
+    decode: float = 0.0
+    total: float = 0.0
+
+
+@dataclasses.dataclass
+class RequestRecord:
+    """ passed to request hooks, before hooks see it without the result fields """
+    method: str
+    url: str
+    endpoint: str
+    payload: typing.Any = None
+    status_code: typing.Optional[int] = None
+    error: typing.Optional[BaseException] = None
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    attempts: int = 0
+    timing: RequestTiming = dataclasses.field(default_factory=RequestTiming)
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempts - 1)
+
+
+BeforeRequestHook = typing.Callable[[RequestRecord], None]
+AfterRequestHook = typing.Callable[[RequestRecord], None]
+
+
+class Histogram:
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> typing.List[typing.Tuple[str, int]]:
+        """ [(le, count), ...] including +Inf """
+        result, total = [], 0
+        for le, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            result.append(("+Inf" if le == float("inf") else repr(le), total))
+        return result
+
+    def quantile(self, q: float) -> typing.Optional[float]:
+        """ estimate by the upper bound of the bucket containing the q-th value """
+        if not self.count:
+            return None
+        rank, total = q * self.count, 0
+        for le, n in zip(self.buckets, self.counts):
+            total += n
+            if total >= rank:
+                return le
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class Metrics:
+    """ thread-safe request metrics of one client, labeled by (method, endpoint) """
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms: typing.Dict[typing.Tuple[str, str, str], Histogram] = {}
+        self._requests: typing.Counter[typing.Tuple[str, str, str]] = collections.Counter()
+        self._bytes_sent: typing.Counter[typing.Tuple[str, str]] = collections.Counter()
+        self._bytes_received: typing.Counter[typing.Tuple[str, str]] = collections.Counter()
+        self._retries: typing.Counter[typing.Tuple[str, str]] = collections.Counter()
+        self._counters: typing.Counter[str] = collections.Counter()
+
+    def observe(self, record: RequestRecord):
+        key = (record.method, record.endpoint)
+        if record.error is not None:
+            status = type(record.error).__name__
+        else:
+            status = str(record.status_code)
+        with self._lock:
+            for phase in PHASES:
+                hkey = key + (phase,)
+                hist = self._histograms.get(hkey)
+                if hist is None:
+                    hist = self._histograms[hkey] = Histogram(self._buckets)
+                hist.observe(getattr(record.timing, phase))
+            self._requests[key + (status,)] += 1
+            self._bytes_sent[key] += record.bytes_sent
+            self._bytes_received[key] += record.bytes_received
+            if record.retries:
+                self._retries[key] += record.retries
+
+    def inc(self, name: str, value: int = 1):
+        """ client level counters, e.g. sessions_created """
+        with self._lock:
+            self._counters[name] += value
+
+    def histogram(self, method: str, endpoint: str, phase: str = "total") -> typing.Optional[Histogram]:
+        return self._histograms.get((method, endpoint, phase))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._requests.clear()
+            self._bytes_sent.clear()
+            self._bytes_received.clear()
+            self._retries.clear()
+            self._counters.clear()
+
+    def to_dict(self) -> dict:
+        """
+        {
+            "endpoints": {"GET /status": {"requests": {"200": 3}, "bytes_sent": 0, "bytes_received": 600,
+                                          "retries": 0, "latency": {"connect": {...}, ..., "total": {...}}}},
+            "counters": {"sessions_created": 1, ...}
+        }
+        """
+        endpoints: typing.Dict[str, dict] = {}
+        with self._lock:
+            for (method, endpoint, phase), hist in self._histograms.items():
+                item = self._endpoint_item(endpoints, method, endpoint)
+                item["latency"][phase] = hist.to_dict()
+            for (method, endpoint, status), n in self._requests.items():
+                self._endpoint_item(endpoints, method, endpoint)["requests"][status] = n
+            return {"endpoints": endpoints, "counters": dict(self._counters)}
+
+    def _endpoint_item(self, endpoints: dict, method: str, endpoint: str) -> dict:
+        name = f"{method} {endpoint}"
+        if name not in endpoints:
+            key = (method, endpoint)
+            endpoints[name] = {
+                "requests": {},
+                "bytes_sent": self._bytes_sent[key],
+                "bytes_received": self._bytes_received[key],
+                "retries": self._retries[key],
+                "latency": {},
+            }
+        return endpoints[name]
+
+    def to_prometheus(self, prefix: str = "wdapy") -> str:
+        """ Prometheus text exposition format """
+        lines = []
+
+        def labels(**kwargs) -> str:
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in kwargs.items()) + "}"
+
+        with self._lock:
+            name = f"{prefix}_request_duration_seconds"
+            lines.append(f"# HELP {name} Request latency split by phase.")
+            lines.append(f"# TYPE {name} histogram")
+            for (method, endpoint, phase), hist in sorted(self._histograms.items()):
+                for le, n in hist.cumulative():
+                    lines.append(f"{name}_bucket{labels(method=method, endpoint=endpoint, phase=phase, le=le)} {n}")
+                lines.append(f"{name}_sum{labels(method=method, endpoint=endpoint, phase=phase)} {hist.sum!r}")
+                lines.append(f"{name}_count{labels(method=method, endpoint=endpoint, phase=phase)} {hist.count}")
+
+            name = f"{prefix}_requests_total"
+            lines.append(f"# HELP {name} Requests by response status or exception name.")
+            lines.append(f"# TYPE {name} counter")
+            for (method, endpoint, status), n in sorted(self._requests.items()):
+                lines.append(f"{name}{labels(method=method, endpoint=endpoint, status=status)} {n}")
+
+            for metric, counter, help_text in (
+                    ("request_bytes_sent_total", self._bytes_sent, "Request body bytes sent."),
+                    ("response_bytes_received_total", self._bytes_received, "Response body bytes received."),
+                    ("request_retries_total", self._retries, "Request retries.")):
+                name = f"{prefix}_{metric}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for (method, endpoint), n in sorted(counter.items()):
+                    lines.append(f"{name}{labels(method=method, endpoint=endpoint)} {n}")
+
+            for counter_name, n in sorted(self._counters.items()):
+                name = f"{prefix}_{counter_name}_total"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {n}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,226 @@
+# coding: utf-8
+#
+"""
+MJPEG screen stream of WebDriverAgent (mjpegServerPort, default 9100)
+
+WDA response looks like:
+    HTTP/1.0 200 OK
+    Content-Type: multipart/x-mixed-replace; boundary=--BoundaryString
+
+    --BoundaryString
+    Content-type: image/jpg
+    Content-Length: 12345
+
+    <jpeg data>
+"""
+
+from __future__ import annotations
+
+import collections
+import dataclasses
+import io
+import logging
+import socket
+import threading
+import time
+import typing
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MJPEG_PORT = 9100
+
+
+class MJPEGParser:
+    """ incremental multipart/x-mixed-replace parser, feed bytes and get complete JPEG frames """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._delimiter: typing.Optional[bytes] = None
+        # None: waiting for part header, -1: part without Content-Length
+        self._part_length: typing.Optional[int] = None
+
+    def feed(self, data: bytes) -> typing.List[bytes]:
+        self._buf += data
+        frames = []
+        while True:
+            if self._part_length is None:
+                start = 0
+                while self._buf.startswith(b"\r\n", start):
+                    start += 2
+                end = self._buf.find(b"\r\n\r\n", start)
+                if end < 0:
+                    break
+                lines = bytes(self._buf[start:end]).split(b"\r\n")
+                del self._buf[:end + 4]
+                if lines[0].startswith(b"HTTP/"):
+                    # response header of the stream
+                    continue
+                if lines[0].startswith(b"--"):
+                    self._delimiter = lines[0]
+                self._part_length = -1
+                for line in lines:
+                    key, _, value = line.partition(b":")
+                    if key.strip().lower() == b"content-length":
+                        self._part_length = int(value)
+            if self._part_length >= 0:
+                if len(self._buf) < self._part_length:
+                    break
+                frames.append(bytes(self._buf[:self._part_length]))
+                del self._buf[:self._part_length]
+            else:
+                idx = self._buf.find(self._delimiter) if self._delimiter else -1
+                if idx < 0:
+                    break
+                frames.append(bytes(self._buf[:idx]).rstrip(b"\r\n"))
+                del self._buf[:idx]
+            self._part_length = None
+        return frames
+
+
+@dataclasses.dataclass
+class MJPEGFrame:
+    data: bytes  # JPEG bytes
+    timestamp: float  # time.monotonic() when the frame was received
+    index: int
+    image: typing.Optional[Image.Image] = None  # set when stream is created with decode=True
+
+
+class MJPEGStream:
+    """ read frames in a background thread into a bounded ring buffer, stale frames are dropped
+
+    Usage:
+        with client.screen_stream() as stream:
+            for frame in stream:
+                frame.image.save("frame.jpg")
+                print(stream.fps)
+    """
+
+    def __init__(self,
+                 connect: typing.Callable[[], socket.socket],
+                 buffer_size: int = 2,
+                 decode: bool = True,
+                 fps_window: int = 30):
+        """
+        Args:
+            connect: function to open the socket to the mjpeg server
+            buffer_size: max frames kept, the oldest frame is dropped when full
+            decode: decode JPEG to PIL.Image when the frame is consumed
+        """
+        self._connect = connect
+        self._decode = decode
+        self._frames: typing.Deque[MJPEGFrame] = collections.deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._arrivals: typing.Deque[float] = collections.deque(maxlen=fps_window)
+        self._sock: typing.Optional[socket.socket] = None
+        self._thread: typing.Optional[threading.Thread] = None
+        self._closed = False
+        self._error: typing.Optional[BaseException] = None
+        self._received = 0
+        self._dropped = 0
+        self._decode_time = 0.0
+        self._decoded = 0
+
+    def start(self) -> "MJPEGStream":
+        self._sock = self._connect()
+        self._sock.settimeout(None)
+        self._sock.sendall(b"GET / HTTP/1.0\r\nHost: localhost\r\n\r\n")
+        self._thread = threading.Thread(target=self._reader, name="wdapy-mjpeg", daemon=True)
+        self._thread.start()
+        return self
+
+    def _reader(self):
+        parser = MJPEGParser()
+        try:
+            while not self._closed:
+                data = self._sock.recv(256 * 1024)
+                if not data:
+                    raise EOFError("mjpeg stream closed by server")
+                for data in parser.feed(data):
+                    now = time.monotonic()
+                    with self._cond:
+                        if len(self._frames) == self._frames.maxlen:
+                            self._dropped += 1
+                        self._frames.append(MJPEGFrame(data, now, self._received))
+                        self._received += 1
+                        self._arrivals.append(now)
+                        self._cond.notify_all()
+        except (OSError, EOFError) as e:
+            if not self._closed:
+                logger.warning("mjpeg stream stopped: %s", e)
+                self._error = e
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+    def read(self, timeout: typing.Optional[float] = None) -> typing.Optional[MJPEGFrame]:
+        """ return the oldest buffered frame, None when timeout or stream closed """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frames or self._closed, timeout):
+                return None
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+        if self._decode:
+            start = time.perf_counter()
+            frame.image = Image.open(io.BytesIO(frame.data))
+            frame.image.load()
+            with self._cond:
+                self._decode_time += time.perf_counter() - start
+                self._decoded += 1
+        return frame
+
+    def latest(self, timeout: typing.Optional[float] = None) -> typing.Optional[MJPEGFrame]:
+        """ drop everything buffered except the newest frame, then read it """
+        with self._cond:
+            while len(self._frames) > 1:
+                self._frames.popleft()
+                self._dropped += 1
+        return self.read(timeout)
+
+    def __iter__(self) -> typing.Iterator[MJPEGFrame]:
+        while (frame := self.read()) is not None:
+            yield frame
+        if self._error is not None:
+            raise ConnectionError("mjpeg stream broken") from self._error
+
+    @property
+    def fps(self) -> float:
+        """ frames per second received, measured over the last fps_window frames """
+        with self._cond:
+            if len(self._arrivals) < 2:
+                return 0.0
+            elapsed = self._arrivals[-1] - self._arrivals[0]
+            return (len(self._arrivals) - 1) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def decode_latency(self) -> float:
+        """ average seconds to decode one JPEG frame """
+        with self._cond:
+            return self._decode_time / self._decoded if self._decoded else 0.0
+
+    def stats(self) -> dict:
+        with self._cond:
+            received, dropped = self._received, self._dropped
+        return {"fps": self.fps, "received": received, "dropped": dropped, "decode_latency": self.decode_latency}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+
+    def __enter__(self) -> "MJPEGStream":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,146 @@
+# coding: utf-8
+#
+
+from __future__ import annotations
+
+import collections
+import select
+import socket
+import threading
+import time
+import typing
+from http.client import HTTPConnection
+from urllib.parse import urlparse
+
+
+DEFAULT_POOL_MAXSIZE = 4
+DEFAULT_POOL_IDLE_TIMEOUT = 30.0
+
+
+def pool_key(url: str) -> typing.Tuple[str, str]:
+    u = urlparse(url)
+    return u.scheme, u.netloc
+
+
+def is_readable(sock: socket.socket) -> bool:
+    """ readable now, or closed
+
+    poll() has no FD_SETSIZE limit, select() raises ValueError for fds >= 1024 and is only
+    the fallback where poll() is missing (Windows, where it has no such limit).
+    """
+    if sock.fileno() < 0:
+        return True
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(0))
+    readable, _, _ = select.select([sock], [], [], 0)
+    return bool(readable)
+
+
+def is_connection_alive(conn: HTTPConnection) -> bool:
+    """ check whether an idle keep-alive connection can still be used
+
+    An idle HTTP connection should never be readable. If it is, the peer either
+    closed it (read returns EOF) or sent unexpected data, both mean the socket can not be reused.
+    """
+    sock = conn.sock
+    if sock is None:
+        return False
+    try:
+        return not is_readable(sock)
+    except (OSError, ValueError):
+        return False
+
+
+class ConnectionPool:
+    """ keep-alive HTTP connections, keyed by scheme and netloc
+
+    Connections are checked out exclusively by acquire() and given back by release(),
+    so the same pool can be shared between threads.
+    """
+
+    def __init__(self,
+                 factory: typing.Callable[[str], HTTPConnection],
+                 maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT):
+        """
+        Args:
+            factory: function to create a new connection from url
+            maxsize: max idle connections kept for each scheme/netloc
+            idle_timeout: idle connections older than this (seconds) are closed instead of reused
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._idle: typing.Dict[typing.Tuple[str, str], typing.Deque[typing.Tuple[HTTPConnection, float]]] = {}
+        self._stats = collections.Counter()
+
+    def acquire(self, url: str) -> typing.Tuple[HTTPConnection, bool]:
+        """
+        Returns:
+            (connection, reused)
+        """
+        key = pool_key(url)
+        stale = []
+        try:
+            with self._lock:
+                idle = self._idle.get(key)
+                while idle:
+                    conn, released_at = idle.pop()  # most recently used first
+                    if time.monotonic() - released_at > self.idle_timeout or not self._is_alive(conn):
+                        stale.append(conn)
+                        continue
+                    self._stats["reused"] += 1
+                    return conn, True
+                self._stats["created"] += 1
+        finally:
+            for conn in stale:
+                self.discard(conn)
+        return self._factory(url), False
+
+    def release(self, url: str, conn: HTTPConnection):
+        """ put a connection back, the response must be fully read before release """
+        if not self._is_open(conn):
+            return
+        key = pool_key(url)
+        with self._lock:
+            idle = self._idle.setdefault(key, collections.deque())
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.monotonic()))
+                return
+        self.discard(conn)
+
+    def _is_alive(self, conn: HTTPConnection) -> bool:
+        return is_connection_alive(conn)
+
+    def _is_open(self, conn: HTTPConnection) -> bool:
+        return conn.sock is not None
+
+    def discard(self, conn: HTTPConnection):
+        with self._lock:
+            self._stats["discarded"] += 1
+        conn.close()
+
+    def mark_reconnect(self):
+        with self._lock:
+            self._stats["reconnects"] += 1
+
+    def clear(self):
+        """ close all idle connections """
+        with self._lock:
+            conns = [conn for idle in self._idle.values() for conn, _ in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "created": self._stats["created"],
+                "reused": self._stats["reused"],
+                "discarded": self._stats["discarded"],
+                "reconnects": self._stats["reconnects"],
+                "idle": sum(len(idle) for idle in self._idle.values()),
+            }
@@ -0,0 +1,217 @@
+# coding: utf-8
+#
+"""
+Retry policy and per-device circuit breaker used by BaseClient
+
+Usage:
+    c = AppiumClient()
+    c.retry_policy = RetryPolicy(tries=4, delay=0.2, backoff=2, deadline=10)
+    c.circuit_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=5)
+    c.circuit_breaker = None # disable
+"""
+
+from __future__ import annotations
+
+import enum
+import random
+import threading
+import time
+import typing
+from http.client import HTTPException
+
+from wdapy.exceptions import CircuitOpenError, DeadlineExceeded, RequestError, WDAFatalError
+from wdapy.usbmux.exceptions import MuxError
+
+# POST endpoints which are safe to send twice, relative to /session/{sessionId} when under a session
+IDEMPOTENT_ENDPOINTS = frozenset([
+    "/url",
+    "/appium/settings",
+    "/wda/apps/launch",
+    "/wda/apps/terminate",
+    "/wda/apps/state",
+    "/wda/setPasteboard",
+    "/wda/getPasteboard",
+    "/wda/keyboard/dismiss",
+    "/wda/unlock",
+    "/wda/lock",
+    "/wda/homescreen",
+])
+
+_SESSION_PREFIX = "/session/{sessionId}"
+
+
+def is_device_failure(error: BaseException) -> bool:
+    """ True when WDA could not be reached, an HTTP error response means WDA is alive """
+    if isinstance(error, (OSError, HTTPException, MuxError, WDAFatalError)):
+        return True
+    return isinstance(error, RequestError) and isinstance(error.__cause__, MuxError)
+
+
+class RetryPolicy:
+    def __init__(self,
+                 tries: int = 2,
+                 delay: float = 0.2,
+                 backoff: float = 2.0,
+                 max_delay: float = 2.0,
+                 jitter: float = 0.1,
+                 deadline: typing.Optional[float] = None,
+                 retry_on: typing.Tuple[typing.Type[BaseException], ...] = (RequestError,),
+                 idempotent_endpoints: typing.Iterable[str] = IDEMPOTENT_ENDPOINTS):
+        """
+        Args:
+            tries: max attempts, 1 means no retry
+            delay: seconds to wait before the first retry, multiplied by backoff for each next retry
+            max_delay: upper bound of a single wait
+            jitter: random extra seconds added to each wait
+            deadline: seconds since the first attempt after which no retry is started
+            retry_on: errors to retry, CircuitOpenError, DeadlineExceeded and WDAFatalError are never retried
+            idempotent_endpoints: POST endpoints (normalized, without session prefix) safe to resend
+        """
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.idempotent_endpoints = frozenset(idempotent_endpoints)
+
+    def is_idempotent(self, method: str, endpoint: str) -> bool:
+        if method in ("GET", "HEAD", "OPTIONS", "DELETE"):
+            return True
+        if endpoint.startswith(_SESSION_PREFIX + "/"):
+            endpoint = endpoint[len(_SESSION_PREFIX):]
+        return endpoint in self.idempotent_endpoints
+
+    def backoff_delay(self, attempt: int) -> float:
+        """ seconds to wait after the attempt-th (1-based) failure """
+        return min(self.max_delay, self.delay * self.backoff ** (attempt - 1)) + random.uniform(0, self.jitter)
+
+    def next_delay(self, attempt: int, error: BaseException, method: str, endpoint: str,
+                   elapsed: float) -> typing.Optional[float]:
+        """ return seconds to wait before retry, None means give up """
+        if attempt >= self.tries:
+            return None
+        if not isinstance(error, self.retry_on) or isinstance(error, (CircuitOpenError, DeadlineExceeded, WDAFatalError)):
+            return None
+        # a request never delivered to WDA (usbmux connect failed) can always be resent
+        if not self.is_idempotent(method, endpoint) and not isinstance(error.__cause__, MuxError):
+            return None
+        delay = self.backoff_delay(attempt)
+        if self.deadline is not None and elapsed + delay >= self.deadline:
+            return None
+        return delay
+
+
+NO_RETRY = RetryPolicy(tries=1)
+
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """ stop sending requests to a device after consecutive failures
+
+    CLOSED: requests pass, failure_threshold device failures in a row switch to OPEN
+    OPEN: requests fail fast with CircuitOpenError until reset_timeout passed
+    HALF_OPEN: one caller runs the probe (GET /status), success closes the circuit, failure opens it again
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"opened": 0, "rejected": 0, "probes": 0}
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return CircuitState.HALF_OPEN
+            return self._state
+
+    def before_request(self, probe: typing.Callable[[], bool]):
+        """
+        Args:
+            probe: return True when the device is reachable again
+
+        Raises:
+            CircuitOpenError
+        """
+        if self._enter():
+            ok = False
+            try:
+                ok = probe()
+            finally:
+                self._exit_probe(ok)
+
+    async def abefore_request(self, probe: typing.Callable[[], typing.Awaitable[bool]]):
+        """ asyncio version of before_request """
+        if self._enter():
+            ok = False
+            try:
+                ok = await probe()
+            finally:
+                self._exit_probe(ok)
+
+    def _enter(self) -> bool:
+        """ return True when the caller has to run the probe """
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return False
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(f"circuit open, device failed {self._failures} times in a row")
+            self._state = CircuitState.HALF_OPEN
+            self._probing = True
+            self._stats["probes"] += 1
+            return True
+
+    def _exit_probe(self, ok: bool):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._state = CircuitState.CLOSED
+                self._failures = 0
+            else:
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+        if not ok:
+            raise CircuitOpenError("circuit open, /status probe failed")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = CircuitState.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state != CircuitState.OPEN and self._failures >= self.failure_threshold:
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+                self._stats["opened"] += 1
+
+    def stats(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {"state": state.value, "failures": self._failures, **self._stats}
+
+
+_breakers: typing.Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(device: str) -> CircuitBreaker:
+    """ process-wide breaker shared by all clients of one device (host:port or udid:port) """
+    with _breakers_lock:
+        if device not in _breakers:
+            _breakers[device] = CircuitBreaker()
+        return _breakers[device]
@@ -0,0 +1,140 @@
+# coding: utf-8
+#
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import threading
+import time
+import typing
+
+from wdapy import _deadline
+from wdapy.exceptions import DeadlineExceeded
+
+
+class SessionManager:
+    """ hold the WDA session id shared by all threads of one client
+
+    Session creation is single-flight: when the session is missing or broken,
+    only one caller runs the (slow) creation, concurrent callers wait and reuse its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # protect state below
+        self._create_lock = threading.Lock()  # serialize creation
+        self._async_create_lock: typing.Optional[asyncio.Lock] = None
+        self._session_id: typing.Optional[str] = None
+        self._since: typing.Optional[float] = None
+        self._stats = collections.Counter()
+
+    @property
+    def session_id(self) -> typing.Optional[str]:
+        return self._session_id
+
+    @property
+    def age(self) -> typing.Optional[float]:
+        """ seconds since the current session was created or adopted """
+        since = self._since
+        return None if since is None else time.monotonic() - since
+
+    def set(self, session_id: typing.Optional[str], created: bool = False):
+        """
+        Args:
+            created: True when the session is created by POST /session, False when adopted from /status
+        """
+        with self._lock:
+            if session_id and session_id != self._session_id:
+                self._stats["created" if created else "adopted"] += 1
+                self._since = time.monotonic()
+            elif not session_id:
+                self._since = None
+            self._session_id = session_id
+
+    def invalidate(self, session_id: typing.Optional[str] = None):
+        """ forget current session, only if it is still session_id when given """
+        with self._lock:
+            if session_id is None or session_id == self._session_id:
+                self._session_id = None
+                self._since = None
+
+    def _reuse(self, stale_id: typing.Optional[str]) -> typing.Optional[str]:
+        with self._lock:
+            if self._session_id and self._session_id != stale_id:
+                self._stats["reused"] += 1
+                return self._session_id
+            return None
+
+    def get(self, create: typing.Callable[[], typing.Optional[str]]) -> typing.Optional[str]:
+        """ return current session id, or run create() once for all concurrent callers
+
+        create() must store the new session id with set()
+        """
+        return self.renew(None, create)
+
+    def renew(self, stale_id: typing.Optional[str], create: typing.Callable[[], typing.Optional[str]]) \
+            -> typing.Optional[str]:
+        """ replace stale_id with a new session, unless another caller already did it
+
+        Raises:
+            DeadlineExceeded: deadline spent while waiting for another caller's creation
+        """
+        if (session_id := self._reuse(stale_id)) is not None:
+            return session_id
+        left = _deadline.remaining()
+        if not self._create_lock.acquire(timeout=-1 if left is None else max(0.0, left)):
+            raise DeadlineExceeded("deadline exceeded while waiting for session creation")
+        try:
+            if (session_id := self._reuse(stale_id)) is not None:
+                return session_id
+            if stale_id is not None:
+                self.invalidate(stale_id)
+                with self._lock:
+                    self._stats["renewed"] += 1
+            create()
+            return self._session_id
+        finally:
+            self._create_lock.release()
+
+    async def aget(self, create: typing.Callable[[], typing.Awaitable[typing.Optional[str]]]) \
+            -> typing.Optional[str]:
+        return await self.arenew(None, create)
+
+    async def arenew(self, stale_id: typing.Optional[str],
+                     create: typing.Callable[[], typing.Awaitable[typing.Optional[str]]]) -> typing.Optional[str]:
+        """ asyncio version of renew() """
+        if (session_id := self._reuse(stale_id)) is not None:
+            return session_id
+        if self._async_create_lock is None:
+            self._async_create_lock = asyncio.Lock()
+        left = _deadline.remaining()
+        if left is None:
+            await self._async_create_lock.acquire()
+        else:
+            try:
+                await asyncio.wait_for(self._async_create_lock.acquire(), left)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("deadline exceeded while waiting for session creation")
+        try:
+            if (session_id := self._reuse(stale_id)) is not None:
+                return session_id
+            if stale_id is not None:
+                self.invalidate(stale_id)
+                with self._lock:
+                    self._stats["renewed"] += 1
+            await create()
+            return self._session_id
+        finally:
+            self._async_create_lock.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "session_id": self._session_id,
+                "valid": self._session_id is not None,
+                "age": self.age,
+                "created": self._stats["created"],
+                "adopted": self._stats["adopted"],
+                "reused": self._stats["reused"],
+                "renewed": self._stats["renewed"],
+            }
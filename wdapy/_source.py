@@ -0,0 +1,553 @@
+# coding: utf-8
+#
+"""
+Parsed /source page with indexes, for many element lookups per snapshot
+
+Usage:
+    tree = client.sourcetree().tree  # parsed once per snapshot
+    tree.find(type="Button", name="Login")
+    tree.find_all(label="OK", visible=True)
+    tree.xpath('//Cell[2]/StaticText[@visible="true"]')
+    cell.find_all(type="Button")  # descendants of cell only
+
+Lookups by type, name, label (and accessibility id, which WDA reports as name) are dict lookups;
+other predicates filter the smallest indexed candidate list, so a query costs O(matches).
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+import typing
+from xml.etree.ElementTree import XMLParser
+
+TYPE_PREFIX = "XCUIElementType"
+
+
+def normalize_type(type: str) -> str:
+    """ "Button" -> "XCUIElementTypeButton" """
+    if type == "*" or type.startswith(TYPE_PREFIX):
+        return type
+    return TYPE_PREFIX + type
+
+
+class SourceElement:
+    """ one node of the page, attributes are the XML attribute strings """
+
+    __slots__ = ("type", "attrib", "parent", "children", "pos", "end", "tree")
+
+    def __init__(self, type: str, attrib: typing.Dict[str, str], parent: typing.Optional["SourceElement"],
+                 pos: int, tree: "ParsedSource"):
+        self.type = type
+        self.attrib = attrib
+        self.parent = parent
+        self.children: typing.List["SourceElement"] = []
+        self.pos = pos  # document order
+        self.end = pos  # pos of the last descendant
+        self.tree = tree
+
+    def __repr__(self):
+        return f"<{self.type} name={self.name!r} label={self.label!r} rect={self.rect}>"
+
+    def get(self, key: str, default: typing.Optional[str] = None) -> typing.Optional[str]:
+        return self.attrib.get(key, default)
+
+    @property
+    def name(self) -> typing.Optional[str]:
+        return self.attrib.get("name")
+
+    @property
+    def label(self) -> typing.Optional[str]:
+        return self.attrib.get("label")
+
+    @property
+    def value(self) -> typing.Optional[str]:
+        return self.attrib.get("value")
+
+    @property
+    def enabled(self) -> bool:
+        return self.attrib.get("enabled") == "true"
+
+    @property
+    def visible(self) -> bool:
+        return self.attrib.get("visible") == "true"
+
+    @property
+    def accessible(self) -> bool:
+        return self.attrib.get("accessible") == "true"
+
+    @property
+    def rect(self) -> typing.Tuple[int, int, int, int]:
+        """ (x, y, width, height) in points """
+        a = self.attrib
+        return int(a.get("x", 0)), int(a.get("y", 0)), int(a.get("width", 0)), int(a.get("height", 0))
+
+    @property
+    def center(self) -> typing.Tuple[int, int]:
+        x, y, width, height = self.rect
+        return x + width // 2, y + height // 2
+
+    def contains(self, other: "SourceElement") -> bool:
+        """ other is a descendant of self """
+        return self.pos < other.pos <= self.end
+
+    def iter(self) -> typing.Iterator["SourceElement"]:
+        """ self and its descendants in document order """
+        return iter(self.tree.elements[self.pos:self.end + 1])
+
+    def find_all(self, type: typing.Optional[str] = None, **filters) -> typing.List["SourceElement"]:
+        """ descendants matching, see ParsedSource.find_all """
+        return self.tree._query(type, filters, self)
+
+    def find(self, type: typing.Optional[str] = None, **filters) -> typing.Optional["SourceElement"]:
+        found = self.find_all(type, **filters)
+        return found[0] if found else None
+
+    def xpath(self, expr: str) -> typing.List["SourceElement"]:
+        """ expr relative to self, absolute paths start at the root anyway """
+        return _XPath.compile(expr).evaluate(self.tree, self)
+
+
+_INDEXED = ("type", "name", "label")
+
+
+class ParsedSource:
+    """ elements of one snapshot, indexed by type, name and label """
+
+    def __init__(self):
+        self.elements: typing.List[SourceElement] = []
+        self._index: typing.Dict[str, typing.Dict[str, typing.List[SourceElement]]] = {key: {} for key in _INDEXED}
+        self._hashes: typing.Dict[typing.FrozenSet[str], typing.Tuple[typing.List[int], typing.List[int]]] = {}
+
+    @classmethod
+    def from_xml(cls, source: str) -> "ParsedSource":
+        tree = cls()
+        builder = _Builder(tree)
+        parser = XMLParser(target=builder)
+        parser.feed(source)
+        parser.close()
+        return tree
+
+    @classmethod
+    def from_json(cls, source: dict) -> "ParsedSource":
+        """ from /source?format=json """
+        tree = cls()
+        stack: typing.List[typing.Tuple[dict, typing.Optional[SourceElement]]] = [(source, None)]
+        while stack:
+            node, parent = stack.pop()
+            element = tree._add(normalize_type(node.get("type") or ""), _json_attrib(node), parent)
+            # pushed in reverse, so children come out in document order
+            stack.extend((child, element) for child in reversed(node.get("children") or []))
+        tree._finish()
+        return tree
+
+    @property
+    def root(self) -> typing.Optional[SourceElement]:
+        return self.elements[0] if self.elements else None
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def __iter__(self) -> typing.Iterator[SourceElement]:
+        return iter(self.elements)
+
+    def find_all(self, type: typing.Optional[str] = None, **filters) -> typing.List[SourceElement]:
+        """ elements in document order matching every filter
+
+        Args:
+            type: element type, "Button" or "XCUIElementTypeButton"
+            filters: name, label, accessibility_id (same as name), visible, enabled, accessible (bool)
+                or any attribute, a value may also be a callable taking the attribute string
+        """
+        return self._query(type, filters, None)
+
+    def find(self, type: typing.Optional[str] = None, **filters) -> typing.Optional[SourceElement]:
+        found = self.find_all(type, **filters)
+        return found[0] if found else None
+
+    def by_type(self, type: str) -> typing.List[SourceElement]:
+        return list(self._index["type"].get(normalize_type(type), ()))
+
+    def by_name(self, name: str) -> typing.List[SourceElement]:
+        return list(self._index["name"].get(name, ()))
+
+    def by_label(self, label: str) -> typing.List[SourceElement]:
+        return list(self._index["label"].get(label, ()))
+
+    def by_accessibility_id(self, accessibility_id: str) -> typing.List[SourceElement]:
+        return self.by_name(accessibility_id)
+
+    def xpath(self, expr: str) -> typing.List[SourceElement]:
+        """ a subset of XPath 1.0, see _XPath """
+        return _XPath.compile(expr).evaluate(self, None)
+
+    def hashes(self, ignore: typing.AbstractSet[str] = frozenset()) \
+            -> typing.Tuple[typing.List[int], typing.List[int]]:
+        """ (subtree hashes, own attribute hashes) by element pos, computed once per ignore set
+
+        A subtree hash covers the type and attributes of the element and, in order, its children,
+        so equal hashes mean equal subtrees. Values are only comparable within one process.
+
+        Args:
+            ignore: attribute names left out, e.g. {"value", "x", "y"}
+        """
+        ignore = frozenset(ignore)
+        cached = self._hashes.get(ignore)
+        if cached is not None:
+            return cached
+        own = [0] * len(self.elements)
+        subtree = [0] * len(self.elements)
+        for element in reversed(self.elements):
+            attrib = element.attrib
+            if ignore:
+                attrib = {k: v for k, v in attrib.items() if k not in ignore}
+            h = own[element.pos] = hash((element.type, frozenset(attrib.items())))
+            subtree[element.pos] = hash((h, tuple(subtree[child.pos] for child in element.children)))
+        self._hashes[ignore] = result = (subtree, own)
+        return result
+
+    def _add(self, type: str, attrib: typing.Dict[str, str], parent: typing.Optional[SourceElement]) \
+            -> SourceElement:
+        element = SourceElement(type, attrib, parent, len(self.elements), self)
+        self.elements.append(element)
+        if parent is not None:
+            parent.children.append(element)
+        index = self._index
+        index["type"].setdefault(type, []).append(element)
+        for key in ("name", "label"):
+            value = attrib.get(key)
+            if value is not None:
+                index[key].setdefault(value, []).append(element)
+        return element
+
+    def _finish(self):
+        # end of every element, children always come after their parent
+        for element in reversed(self.elements):
+            if element.children:
+                element.end = element.children[-1].end
+
+    def _candidates(self, type: typing.Optional[str], filters: typing.Dict[str, typing.Any]) \
+            -> typing.Tuple[typing.Sequence[SourceElement], typing.Dict[str, typing.Any]]:
+        """ the smallest indexed list covering the query, and the filters left to check """
+        filters = dict(filters)
+        if "accessibility_id" in filters:
+            filters.setdefault("name", filters.pop("accessibility_id"))
+        keys = dict(filters)
+        if type is not None and type != "*":
+            keys["type"] = normalize_type(type)
+        best: typing.Optional[typing.Sequence[SourceElement]] = None
+        best_key = None
+        for key in _INDEXED:
+            value = keys.get(key)
+            if isinstance(value, str):
+                bucket = self._index[key].get(value, ())
+                if best is None or len(bucket) < len(best):
+                    best, best_key = bucket, key
+        if best is None:
+            best = self.elements
+        if type is not None and type != "*" and best_key != "type":
+            filters["type"] = keys["type"]
+        filters.pop(best_key, None)
+        return best, filters
+
+    def _query(self, type: typing.Optional[str], filters: typing.Dict[str, typing.Any],
+               scope: typing.Optional[SourceElement]) -> typing.List[SourceElement]:
+        candidates, rest = self._candidates(type, filters)
+        if scope is not None:
+            # candidates are in document order, descendants are the positions (pos, end]
+            candidates = candidates[_after(candidates, scope.pos):_after(candidates, scope.end)]
+        if not rest:
+            return list(candidates)
+        checks = [_make_check(key, value) for key, value in rest.items()]
+        return [e for e in candidates if all(check(e) for check in checks)]
+
+
+def _after(elements: typing.Sequence[SourceElement], pos: int) -> int:
+    """ bisect_right by pos, elements are in document order """
+    lo, hi = 0, len(elements)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if elements[mid].pos <= pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+_BOOL_ATTRIBUTES = ("visible", "enabled", "accessible")
+
+
+def _make_check(key: str, expected: typing.Any) -> typing.Callable[[SourceElement], bool]:
+    if key == "type":
+        return lambda e: e.type == expected
+    if key in _BOOL_ATTRIBUTES and isinstance(expected, bool):
+        return lambda e: (e.attrib.get(key) == "true") is expected
+    if callable(expected):
+        return lambda e: e.attrib.get(key) is not None and bool(expected(e.attrib[key]))
+    return lambda e: e.attrib.get(key) == expected
+
+
+class _Builder:
+    """ expat target, creates elements without an intermediate ElementTree """
+
+    def __init__(self, tree: ParsedSource):
+        self.tree = tree
+        self.stack: typing.List[SourceElement] = []
+
+    def start(self, tag: str, attrib: typing.Dict[str, str]):
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(self.tree._add(attrib.get("type", tag), attrib, parent))
+
+    def end(self, tag: str):
+        self.stack.pop()
+
+    def close(self):
+        self.tree._finish()
+
+
+def _json_bool(value: typing.Any) -> str:
+    return "true" if value in (True, 1, "1", "true") else "false"
+
+
+def _json_attrib(node: dict) -> typing.Dict[str, str]:
+    """ keys and value strings as in the XML source """
+    attrib = {}
+    for key in ("name", "label", "value"):
+        if node.get(key) is not None:
+            attrib[key] = str(node[key])
+    for key, json_key in (("enabled", "isEnabled"), ("visible", "isVisible"), ("accessible", "isAccessible")):
+        if json_key in node:
+            attrib[key] = _json_bool(node[json_key])
+    rect = node.get("rect") or {}
+    for key in ("x", "y", "width", "height"):
+        if key in rect:
+            attrib[key] = str(int(rect[key]))
+    if node.get("type"):
+        attrib["type"] = normalize_type(node["type"])
+    return attrib
+
+
+def parse_source(source: typing.Union[str, dict]) -> ParsedSource:
+    """ source is the value of /source, XML string or the dict of format=json """
+    if isinstance(source, dict):
+        return ParsedSource.from_json(source)
+    return ParsedSource.from_xml(source)
+
+
+# XPath subset:
+#   /A/B  //A  //*  A/B  .//A  .  ..
+#   predicates: [@attr="v"] [@attr!="v"] [@attr] [contains(@attr, "v")] [starts-with(@attr, "v")]
+#               [n] [last()], combined with "and" / "or" ("and" binds tighter), several [] in a row
+# node tests are element types, the XCUIElementType prefix is optional
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<string>"[^"]*"|'[^']*')
+  | (?P<number>\d+)
+  | (?P<op>//|/|\[|\]|\(|\)|,|!=|=|@|\.\.|\.|\*)
+  | (?P<name>[A-Za-z_][\w\-]*)
+)""", re.VERBOSE)
+
+Match = typing.Callable[[SourceElement, int, int], bool]  # element, position (1-based), size
+
+
+class _Predicate:
+    """ one [...] of a step """
+
+    def __init__(self, match: Match, positional: bool = False, equals: typing.Optional[typing.Dict[str, str]] = None):
+        self.match = match
+        self.positional = positional  # uses position() or last(), needs the candidates grouped by parent
+        self.equals = equals or {}  # @attr="v" terms that must all hold, answered by the indexes
+
+
+Step = typing.Tuple[str, str, typing.List[_Predicate]]
+
+
+class _XPath:
+    def __init__(self, absolute: bool, steps: typing.List[Step]):
+        self.absolute = absolute
+        self.steps = steps  # (axis, node test, predicates), axis is "child", "descendant", "self" or "parent"
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def compile(expr: str) -> "_XPath":
+        return _Parser(expr).parse()
+
+    def evaluate(self, tree: ParsedSource, context: typing.Optional[SourceElement]) -> typing.List[SourceElement]:
+        if not tree.elements:
+            return []
+        # None stands for the document node above the root
+        nodes: typing.List[typing.Optional[SourceElement]] = [None if self.absolute else context]
+        for axis, test, predicates in self.steps:
+            if axis == "self" and test == "*" and not predicates:
+                continue  # ".", also on the document node
+            found: typing.Dict[int, SourceElement] = {}
+            for node in nodes:
+                for element in self._step(tree, node, axis, test, predicates):
+                    found[element.pos] = element
+            nodes = [found[pos] for pos in sorted(found)]
+        return typing.cast(typing.List[SourceElement], nodes)
+
+    @staticmethod
+    def _step(tree: ParsedSource, node: typing.Optional[SourceElement], axis: str, test: str,
+              predicates: typing.List[_Predicate]) -> typing.Iterator[SourceElement]:
+        if axis == "descendant" and not any(p.positional for p in predicates):
+            # no positions to count, let the indexes pick the candidates
+            equals: typing.Dict[str, str] = {}
+            for p in predicates:
+                equals.update(p.equals)
+            candidates = tree._query(test, equals, node)
+            yield from (e for e in candidates if all(p.match(e, 0, 0) for p in predicates))
+            return
+        for group in _XPath._groups(tree, node, axis, test):
+            # each [...] filters the group left by the previous one, positions count within it
+            for p in predicates:
+                size = len(group)
+                group = [e for i, e in enumerate(group, 1) if p.match(e, i, size)]
+            yield from group
+
+    @staticmethod
+    def _groups(tree: ParsedSource, node: typing.Optional[SourceElement], axis: str, test: str) \
+            -> typing.Iterator[typing.List[SourceElement]]:
+        """ candidates grouped by parent, in document order """
+        if axis == "self":
+            if node is not None and (test == "*" or node.type == test):
+                yield [node]
+        elif axis == "parent":
+            if node is not None and node.parent is not None and (test == "*" or node.parent.type == test):
+                yield [node.parent]
+        elif axis == "child":
+            children = [tree.root] if node is None else node.children
+            yield [e for e in children if test == "*" or e.type == test]
+        else:
+            # descendant::test[n] is child::test[n] of every descendant-or-self
+            groups: typing.Dict[int, typing.List[SourceElement]] = {}
+            for e in tree._query(test, {}, node):
+                groups.setdefault(-1 if e.parent is None else e.parent.pos, []).append(e)
+            yield from groups.values()
+
+
+class _Parser:
+    def __init__(self, expr: str):
+        self.expr = expr
+        self.tokens: typing.List[typing.Tuple[str, str]] = []
+        pos = 0
+        expr = expr.strip()
+        while pos < len(expr):
+            m = _TOKEN.match(expr, pos)
+            if m is None or m.end() == pos:
+                raise ValueError(f"unsupported xpath {self.expr!r} at {pos}")
+            self.tokens.append((m.lastgroup, m.group(m.lastgroup)))
+            pos = m.end()
+        self.i = 0
+
+    def peek(self) -> typing.Optional[str]:
+        return self.tokens[self.i][1] if self.i < len(self.tokens) else None
+
+    def next(self, kind: typing.Optional[str] = None) -> str:
+        if self.i >= len(self.tokens):
+            raise ValueError(f"unexpected end of xpath {self.expr!r}")
+        token_kind, value = self.tokens[self.i]
+        if kind is not None and kind != token_kind and kind != value:
+            raise ValueError(f"unsupported xpath {self.expr!r}: expect {kind}, got {value!r}")
+        self.i += 1
+        return value
+
+    def parse(self) -> _XPath:
+        absolute = self.peek() in ("/", "//")
+        steps = []
+        axis = "child"
+        if absolute:
+            axis = "descendant" if self.next() == "//" else "child"
+        while True:
+            steps.append(self.step(axis))
+            sep = self.peek()
+            if sep is None:
+                break
+            axis = "descendant" if self.next() == "//" else "child"
+            if sep not in ("/", "//"):
+                raise ValueError(f"unsupported xpath {self.expr!r}: unexpected {sep!r}")
+        return _XPath(absolute, steps)
+
+    def step(self, axis: str) -> Step:
+        token = self.next()
+        if token == ".":
+            axis, test = ("self" if axis == "child" else "descendant"), "*"
+        elif token == "..":
+            if axis != "child":
+                raise ValueError(f"unsupported xpath {self.expr!r}: //..")
+            axis, test = "parent", "*"
+        elif token == "*":
+            test = "*"
+        elif self.tokens[self.i - 1][0] == "name":
+            test = normalize_type(token)
+        else:
+            raise ValueError(f"unsupported xpath {self.expr!r}: unexpected {token!r}")
+        predicates = []
+        while self.peek() == "[":
+            self.next()
+            predicates.append(self.or_expr())
+            self.next("]")
+        return axis, test, predicates
+
+    def or_expr(self) -> _Predicate:
+        parts = [self.and_expr()]
+        while self.peek() == "or":
+            self.next()
+            parts.append(self.and_expr())
+        if len(parts) == 1:
+            return parts[0]
+        matches = [p.match for p in parts]
+        return _Predicate(lambda e, i, n: any(m(e, i, n) for m in matches), any(p.positional for p in parts))
+
+    def and_expr(self) -> _Predicate:
+        parts = [self.term()]
+        while self.peek() == "and":
+            self.next()
+            parts.append(self.term())
+        if len(parts) == 1:
+            return parts[0]
+        matches = [p.match for p in parts]
+        equals: typing.Dict[str, str] = {}
+        for p in parts:
+            equals.update(p.equals)
+        return _Predicate(lambda e, i, n: all(m(e, i, n) for m in matches), any(p.positional for p in parts),
+                          equals)
+
+    def term(self) -> _Predicate:
+        token = self.peek()
+        if token == "(":
+            self.next()
+            p = self.or_expr()
+            self.next(")")
+            return p
+        if token is not None and token.isdigit():
+            index = int(self.next())
+            return _Predicate(lambda e, i, n: i == index, positional=True)
+        if token == "@":
+            self.next()
+            attr = self.next("name")
+            if self.peek() in ("=", "!="):
+                op = self.next()
+                value = self.string()
+                if op == "=":
+                    return _Predicate(lambda e, i, n: e.attrib.get(attr) == value, equals={attr: value})
+                return _Predicate(lambda e, i, n: e.attrib.get(attr) is not None and e.attrib[attr] != value)
+            return _Predicate(lambda e, i, n: attr in e.attrib)
+        func = self.next("name")
+        self.next("(")
+        if func == "last":
+            self.next(")")
+            return _Predicate(lambda e, i, n: i == n, positional=True)
+        if func not in ("contains", "starts-with"):
+            raise ValueError(f"unsupported xpath function {func!r} in {self.expr!r}")
+        self.next("@")
+        attr = self.next("name")
+        self.next(",")
+        value = self.string()
+        self.next(")")
+        if func == "contains":
+            return _Predicate(lambda e, i, n: value in e.attrib.get(attr, ""))
+        return _Predicate(lambda e, i, n: attr in e.attrib and e.attrib[attr].startswith(value))
+
+    def string(self) -> str:
+        return self.next("string")[1:-1]
@@ -1,7 +1,7 @@
 # coding: utf-8
 #
 __all__ = ["Recover", "StatusInfo", "AppInfo", "DeviceInfo", "BatteryInfo", "SourceTree",
-           "StatusBarSize", "AppList"]
+           "ParsedSource", "SourceElement", "StatusBarSize", "AppList"]
 
 import abc
 import enum
@@ -10,6 +10,7 @@ from dataclasses import dataclass
 from typing import Optional, Union
 
 from wdapy._proto import *
+from wdapy._source import ParsedSource, SourceElement, parse_source
 from wdapy._utils import camel_to_snake
 
 
@@ -34,6 +35,8 @@ class _Base:
     def __repr__(self):
         attrs = []
         for k, v in self.__dict__.items():
+            if k.startswith("_"):
+                continue
             attrs.append(f"{k}={v!r}")
         return f"<{self.__class__.__name__} " + ", ".join(attrs) + ">"
 
@@ -93,8 +96,16 @@ class BatteryInfo(_Base):
 
 
 class SourceTree(_Base):
-    value: str
+    value: Union[str, dict]  # XML, or dict with format="json"
     sessionId: str
+    _parsed: Optional[ParsedSource] = None
+
+    @property
+    def tree(self) -> ParsedSource:
+        """ parsed on first access and kept with this snapshot """
+        if self._parsed is None:
+            self._parsed = parse_source(self.value)
+        return self._parsed
 
 class StatusBarSize(_Base):
     width: int
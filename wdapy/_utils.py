@@ -5,6 +5,7 @@ from __future__ import annotations
 
 import dataclasses
 import json
+import threading
 
 
 def camel_to_snake(s: str) -> str:
@@ -32,4 +33,32 @@ def json_dumps_omit_empty(data: dict) -> str:
     Returns:
     str: A JSON string representation of the dictionary with None values omitted.
     """
-    return json.dumps(omit_empty(data))
\ No newline at end of file
+    return json.dumps(omit_empty(data))
+
+
+class locked_cached_property:
+    """
+    Like functools.cached_property, but the value is computed once per instance
+    even when several threads read it at the same time
+    (functools.cached_property has no lock since python 3.12)
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.attrname = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        cache = instance.__dict__
+        if self.attrname in cache:
+            return cache[self.attrname]
+        # dict.setdefault is atomic, so every thread gets the same lock
+        lock = cache.setdefault("_cached_property_lock", threading.RLock())
+        with lock:
+            if self.attrname not in cache:
+                cache[self.attrname] = self.func(instance)
+            return cache[self.attrname]
@@ -4,7 +4,9 @@ from __future__ import annotations
 
 import atexit
 import base64
+import binascii
 import io
+import os
 import logging
 import queue
 import subprocess
@@ -14,22 +16,40 @@ import time
 import typing
 
 from typing import Optional
-from functools import cached_property
 from PIL import Image
 
 from wdapy._alert import Alert
 from wdapy._base import BaseClient
+from wdapy._diff import wait_ui_stable
+from wdapy._mjpeg import DEFAULT_MJPEG_PORT, MJPEGStream
 from wdapy._proto import *
 from wdapy._types import *
-from wdapy._utils import omit_empty
+from wdapy._utils import locked_cached_property, omit_empty
 
 from wdapy.exceptions import *
 from wdapy.actions import TouchActionsClient
-from wdapy.usbmux.pyusbmux import list_devices
+from wdapy.usbmux.pyusbmux import MuxDevice, list_devices
 
 
 logger = logging.getLogger(__name__)
 
+
+def decode_screenshot(value: str) -> bytes:
+    # a2b_base64 accepts the ascii str directly, b64decode would encode a copy first
+    return binascii.a2b_base64(value)
+
+
+def image_to_ndarray(raw_value: bytes) -> "numpy.ndarray":
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("numpy is required, install with: pip3 install numpy")
+    im = Image.open(io.BytesIO(raw_value))
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    return np.asarray(im)
+
+
 class CommonClient(BaseClient):
     def __init__(self, wda_url: str):
         super().__init__(wda_url)
@@ -71,14 +91,30 @@ class CommonClient(BaseClient):
             "duration": duration
         })
 
-    @cached_property
+    @locked_cached_property
     def alert(self) -> Alert:
         return Alert(self)
 
-    def sourcetree(self) -> SourceTree:
-        data = self.request(GET, "/source")
+    def sourcetree(self, format: str = "xml") -> SourceTree:
+        """
+        Args:
+            format: "xml" or "json", both are parsed by SourceTree.tree
+        """
+        data = self.request(GET, "/source" if format == "xml" else f"/source?format={format}")
         return SourceTree.value_of(data)
 
+    def wait_ui_stable(self, timeout: float = 10.0, interval: float = 0.3, stable_count: int = 2,
+                       ignore: typing.AbstractSet[str] = frozenset(), format: str = "xml") -> SourceTree:
+        """ poll the source until stable_count snapshots in a row have the same structure
+
+        Args:
+            ignore: attributes that may keep changing, e.g. {"value"} for a clock
+
+        Raises:
+            UINotStable: with the last snapshot as .source
+        """
+        return wait_ui_stable(lambda: self.sourcetree(format), timeout, interval, stable_count, ignore)
+
     def open_url(self, url: str):
         self.session_request(POST, "/url", {
             "url": url
@@ -214,7 +250,7 @@ class CommonClient(BaseClient):
     def volume_down(self):
         self.press(Keycode.VOLUME_DOWN)
 
-    @cached_property
+    @locked_cached_property
     def scale(self) -> int:
         # Response example
         # {"statusBarSize": {'width': 320, 'height': 20}, 'scale': 2}
@@ -227,14 +263,33 @@ class CommonClient(BaseClient):
         value = self.session_request(GET, "/wda/screen")['value']
         return StatusBarSize.value_of(value['statusBarSize'])
 
-    def screenshot(self) -> Image.Image:
-        """ take screenshot """
-        value = self.request(GET, "/screenshot")["value"]
-        raw_value = base64.b64decode(value)
-        buf = io.BytesIO(raw_value)
+    def screenshot(self, lazy: bool = False) -> Image.Image:
+        """ take screenshot
+
+        Args:
+            lazy: return the image without decoding pixels and converting to RGB,
+                pixels are decoded when first accessed
+        """
+        buf = io.BytesIO(self.screenshot_raw())
         im = Image.open(buf)
+        if lazy:
+            return im
         return im.convert("RGB")
 
+    def screenshot_raw(self) -> bytes:
+        """ screenshot as encoded image bytes (PNG) """
+        value = self.request(GET, "/screenshot")["value"]
+        return decode_screenshot(value)
+
+    def screenshot_ndarray(self) -> "numpy.ndarray":
+        """ screenshot as RGB numpy.ndarray with shape (height, width, 3), requires numpy """
+        return image_to_ndarray(self.screenshot_raw())
+
+    def save_screenshot(self, path: typing.Union[str, os.PathLike]):
+        """ write the encoded image (PNG) to path without decoding it """
+        with open(path, "wb") as f:
+            f.write(self.screenshot_raw())
+
     def battery_info(self) -> BatteryInfo:
         data = self.session_request(GET, "/wda/batteryInfo")["value"]
         return BatteryInfo.value_of(data)
@@ -314,9 +369,25 @@ class AppiumClient(CommonClient, TouchActionsClient):
     def __init__(self, wda_url: str = DEFAULT_WDA_URL):
         super().__init__(wda_url)
 
+    def screen_stream(self, port: int = DEFAULT_MJPEG_PORT, buffer_size: int = 2, decode: bool = True) -> MJPEGStream:
+        """ MJPEG screen stream, much faster than polling screenshot()
+
+        Frame rate and quality can be changed by appium_settings(
+        {"mjpegServerFramerate": 30, "mjpegServerScreenshotQuality": 50})
+
+        Args:
+            port: mjpeg server port of WDA
+            buffer_size: max frames kept, the oldest frame is dropped when full
+            decode: decode each consumed frame to PIL.Image (frame.image)
+        """
+        return MJPEGStream(lambda: self._open_device_socket(port), buffer_size=buffer_size, decode=decode).start()
+
 
 def get_single_device_udid() -> str:
-    devices = list_devices()
+    return _single_device_udid(list_devices())
+
+
+def _single_device_udid(devices: typing.List[MuxDevice]) -> str:
     if len(devices) == 0:
         raise WDAException("No device connected")
     if len(devices) > 1:
@@ -3,6 +3,8 @@
 
 import typing
 
+from wdapy._deadline import with_deadline
+
 
 class Wrapper:
     """
@@ -15,12 +17,7 @@ class Wrapper:
 
 
 def timeout(seconds: typing.Union[float, int]):
+    """ limit the whole call, including retries and session recovery, to seconds """
     def _timeout_wrapper(fn):
-        def _inner(self, *args, **kwargs):
-            old_timeout = self._request_timeout
-            try:
-                return fn(self, *args, **kwargs)
-            finally:
-                self._request_timeout = old_timeout
-        return _inner
+        return with_deadline(fn, seconds)
     return _timeout_wrapper
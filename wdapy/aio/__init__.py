@@ -0,0 +1,13 @@
+# coding: utf-8
+#
+"""
+asyncio clients, one event loop can drive many devices concurrently
+
+Usage:
+    async with AsyncAppiumUSBClient(udid) as c:
+        await c.tap(100, 200)
+"""
+
+from wdapy.aio._alert import AsyncAlert
+from wdapy.aio._base import AsyncBaseClient
+from wdapy.aio._wdapy import AsyncAppiumClient, AsyncAppiumUSBClient, AsyncCommonClient, AsyncTouchActionsClient
@@ -0,0 +1,47 @@
+# coding: utf-8
+#
+
+import logging
+import typing
+
+from wdapy._proto import *
+from wdapy.exceptions import RequestError
+from wdapy.aio._base import AsyncBaseClient
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAlert:
+    def __init__(self, client: AsyncBaseClient):
+        self._client = client
+
+    async def exists(self) -> bool:
+        try:
+            await self.get_text()
+            return True
+        except RequestError:
+            return False
+
+    async def buttons(self) -> typing.List[str]:
+        return (await self._client.session_request(GET, "/wda/alert/buttons"))["value"]
+
+    async def get_text(self) -> str:
+        return (await self._client.session_request(GET, "/alert/text"))["value"]
+
+    async def accept(self):
+        return await self._client.session_request(POST, "/alert/accept")
+
+    async def dismiss(self):
+        return await self._client.session_request(POST, "/alert/dismiss")
+
+    async def click(self, button_name: typing.Union[str, list]):
+        if isinstance(button_name, str):
+            await self._client.session_request(POST, "/alert/accept", {"name": button_name})
+            return
+        elif isinstance(button_name, list):
+            expect_buttons = button_name
+            buttons = await self.buttons()
+            for name in expect_buttons:
+                if name in buttons:
+                    return await self.click(name)
+            logger.debug("alert not clicked, buttons: %s, expect buttons: %s", buttons, expect_buttons)
@@ -0,0 +1,222 @@
+# coding: utf-8
+#
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from wdapy import _deadline
+from wdapy._base import BaseClient, HTTPResponseWrapper, _STALE_CONNECTION_ERRORS, _UNSENT_ERRORS
+from wdapy._metrics import RequestRecord, RequestTiming, normalize_endpoint
+from wdapy._proto import *
+from wdapy._types import StatusInfo
+from wdapy.aio._http import AsyncConnectionPool, AsyncHTTPConnection, async_http_create
+from wdapy.exceptions import *
+from wdapy.usbmux.exceptions import BadDevError, MuxConnectError
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBaseClient(BaseClient):
+    """ asyncio version of BaseClient, all request methods are coroutines """
+
+    def __init__(self, wda_url: str):
+        super().__init__(wda_url)
+        self._pool = AsyncConnectionPool(async_http_create)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def status(self) -> StatusInfo:
+        data = await self.request(GET, "/status")
+        return StatusInfo.value_of(data)
+
+    async def session(self,
+                      bundle_id: Optional[str] = None,
+                      arguments: Optional[list] = None,
+                      environment: Optional[dict] = None) -> Optional[str]:
+        """ create session and return session id """
+        payload = self._session_payload(bundle_id, arguments, environment)
+        data = await self.request(POST, "/session", payload)
+
+        # update cached session_id
+        self._sessions.set(data['sessionId'], created=True)
+        self.metrics.inc("sessions_created")
+        return self._session_id
+
+    async def _get_valid_session_id(self) -> Optional[str]:
+        return await self._sessions.aget(self._find_or_create_session)
+
+    async def _find_or_create_session(self):
+        old_session_id = (await self.status()).session_id
+        if old_session_id:
+            self._sessions.set(old_session_id)
+        else:
+            await self.session()
+
+    async def session_request(self, method: RequestMethod, urlpath: str, payload: Optional[dict] = None) -> dict:
+        """ request with session_id """
+        session_id = await self._get_valid_session_id()
+        session_urlpath = f"/session/{session_id}/" + urlpath.lstrip("/")
+        try:
+            return await self.request(method, session_urlpath, payload)
+        except WDASessionDoesNotExist:
+            logger.info("session %r does not exist, generate new one", session_id)
+            session_id = await self._sessions.arenew(session_id, self._recreate_session)
+            session_urlpath = f"/session/{session_id}/" + urlpath.lstrip("/")
+            return await self.request(method, session_urlpath, payload)
+
+    async def _recreate_session(self):
+        self.metrics.inc("sessions_recreated")
+        await self.session()
+
+    async def request(self, method: RequestMethod, urlpath: str, payload: Optional[dict] = None) -> dict:
+        """
+        Raises:
+            RequestError, WDASessionDoesNotExist
+        """
+        full_url = self._wda_url.rstrip("/") + "/" + urlpath.lstrip("/")
+        if self.debug:
+            self._print_curl(method, full_url, payload)
+        record = self._start_record(method, full_url, urlpath, payload)
+        start = time.perf_counter()
+        try:
+            resp = await self._request_http(method, full_url, payload, record=record)
+            decode_start = time.perf_counter()
+            try:
+                return self._parse_response(resp)
+            finally:
+                record.timing.decode = time.perf_counter() - decode_start
+        except BaseException as e:
+            record.error = e
+            raise
+        finally:
+            record.timing.total = time.perf_counter() - start
+            self._finish_record(record)
+
+    async def _request_http(self, method: RequestMethod, url: str, payload: Optional[dict] = None,
+                            **kwargs) -> HTTPResponseWrapper:
+        """ same retry_policy and circuit_breaker rules as BaseClient """
+        record: Optional[RequestRecord] = kwargs.get("record")
+        endpoint = record.endpoint if record is not None else normalize_endpoint(urlparse(url).path)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                _deadline.check_deadline()
+                if self.circuit_breaker is not None:
+                    await self.circuit_breaker.abefore_request(self._probe)
+                resp = await self._request_http_once(method, url, payload, **kwargs)
+            except Exception as e:
+                self._record_breaker(e)
+                delay = self._retry_delay(attempt, e, method, endpoint, start)
+                if delay is None:
+                    raise
+                logger.warning("%s, retrying in %.2f seconds...", e, delay)
+                await asyncio.sleep(delay)
+                continue
+            self._record_breaker(None)
+            return resp
+
+    async def _probe(self) -> bool:
+        try:
+            await self._request_http_once(GET, self._wda_url + "status")
+            return True
+        except Exception as e:
+            logger.info("probe /status failed: %s", e)
+            return False
+
+    async def _request_http_once(self, method: RequestMethod, url: str, payload: Optional[dict] = None,
+                                 **kwargs) -> HTTPResponseWrapper:
+        """
+        Raises:
+            RequestError, WDAFatalError
+            WDASessionDoesNotExist
+        """
+        logger.info("request: %s %s %s", method, url, payload)
+        record: Optional[RequestRecord] = kwargs.get("record")
+        try:
+            u = urlparse(url)
+            urlpath = url[len(u.scheme) + len(u.netloc) + 3:]
+            timeout = _deadline.budget(kwargs.get("timeout", self.request_timeout))
+            body = self.json_codec.dumps(payload) if payload else None
+            if record is not None:
+                record.attempts += 1
+
+            timing = record.timing if record is not None else None
+            if self.transport is not None:
+                resp = await self.transport.arequest(method.value, urlpath, payload,
+                                                     lambda: self._exchange(method, url, urlpath, body, timeout, timing))
+            else:
+                resp = await self._exchange(method, url, urlpath, body, timeout, timing)
+
+            if record is not None:
+                record.status_code = resp.status_code
+                record.bytes_sent += len(body or b"")
+                record.bytes_received += len(resp.content)
+            return self._check_status(resp)
+        except (asyncio.TimeoutError, TimeoutError) as err:
+            if _deadline.expired():
+                raise DeadlineExceeded("deadline exceeded", url) from err
+            raise
+        except BadDevError:
+            self._invalidate_usbmux_device(url)
+            raise
+        except MuxConnectError as err:
+            self._invalidate_usbmux_device(url)
+            if self._recover:
+                _deadline.check_deadline()
+                # executor threads do not inherit the deadline contextvar
+                recovered = await asyncio.get_running_loop().run_in_executor(
+                    None, contextvars.copy_context().run, self._run_recover)
+                if not recovered:
+                    raise WDAFatalError("recover failed")
+            raise RequestError("ConnectionBroken", err) from err
+
+    async def _exchange(self, method: RequestMethod, url: str, urlpath: str, body: Optional[bytes], timeout: float,
+                        timing: Optional[RequestTiming]) -> HTTPResponseWrapper:
+        """ same reconnect rules as BaseClient._exchange """
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        headers = {"Content-Type": "application/json"} if body is not None else None
+        while True:
+            conn, reused = self._pool.acquire(url)
+            try:
+                await asyncio.wait_for(conn.send_request(method.value, urlpath, body, headers, timing),
+                                       end - loop.time())
+            except _UNSENT_ERRORS:
+                self._pool.discard(conn)
+                if not reused:
+                    raise
+                self._pool.mark_reconnect()
+                continue
+            except BaseException:
+                self._pool.discard(conn)
+                raise
+            try:
+                status, content, will_close = await asyncio.wait_for(
+                    conn.read_response(self.max_body_size, timing), end - loop.time())
+            except _STALE_CONNECTION_ERRORS + (asyncio.IncompleteReadError,):
+                self._pool.discard(conn)
+                if not reused or not self.retry_policy.is_idempotent(method.value, normalize_endpoint(urlpath)):
+                    raise
+                self._pool.mark_reconnect()
+                continue
+            except BaseException:
+                self._pool.discard(conn)
+                raise
+            if will_close:
+                self._pool.discard(conn)
+            else:
+                self._pool.release(url, conn)
+            return HTTPResponseWrapper(content, status)
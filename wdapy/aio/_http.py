@@ -0,0 +1,169 @@
+# coding: utf-8
+#
+
+from __future__ import annotations
+
+import asyncio
+import ssl
+import time
+import typing
+from urllib.parse import urlparse
+
+from wdapy._base import DEFAULT_MAX_BODY_SIZE, READ_CHUNK_SIZE
+from wdapy._metrics import RequestTiming
+from wdapy._pool import ConnectionPool
+from wdapy.exceptions import ResponseTooLarge
+from wdapy.usbmux import aio as usbmux_aio
+from wdapy.usbmux.exceptions import BadDevError
+from wdapy.usbmux.registry import get_registry
+
+Opener = typing.Callable[[], typing.Awaitable[typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter]]]
+
+
+class AsyncHTTPConnection:
+    """ minimal HTTP/1.1 keep-alive connection on asyncio streams """
+
+    def __init__(self, host: str, opener: Opener):
+        self.host = host
+        self._opener = opener
+        self._reader: typing.Optional[asyncio.StreamReader] = None
+        self._writer: typing.Optional[asyncio.StreamWriter] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def is_alive(self) -> bool:
+        return self.connected and not self._reader.at_eof() and not self._writer.is_closing()
+
+    async def connect(self):
+        self._reader, self._writer = await self._opener()
+
+    async def request(self, method: str, urlpath: str, body: typing.Optional[bytes] = None,
+                      headers: typing.Optional[dict] = None,
+                      max_body_size: typing.Optional[int] = DEFAULT_MAX_BODY_SIZE,
+                      timing: typing.Optional[RequestTiming] = None) -> typing.Tuple[int, bytes, bool]:
+        """
+        Args:
+            timing: add the seconds spent in connect, send, ttfb and body phases
+
+        Returns:
+            (status_code, content, will_close)
+
+        Raises:
+            ConnectionResetError: server closed the connection before response
+            ResponseTooLarge: body exceeds max_body_size
+        """
+        await self.send_request(method, urlpath, body, headers, timing)
+        return await self.read_response(max_body_size, timing)
+
+    async def send_request(self, method: str, urlpath: str, body: typing.Optional[bytes] = None,
+                           headers: typing.Optional[dict] = None,
+                           timing: typing.Optional[RequestTiming] = None):
+        """ connect when needed and write the request """
+        t0 = time.perf_counter()
+        if not self.connected:
+            await self.connect()
+        t1 = time.perf_counter()
+        lines = [f"{method} {urlpath} HTTP/1.1", f"Host: {self.host}", "Accept-Encoding: identity"]
+        for k, v in (headers or {}).items():
+            lines.append(f"{k}: {v}")
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self._writer.drain()
+        if timing is not None:
+            timing.connect += t1 - t0
+            timing.send += time.perf_counter() - t1
+
+    async def read_response(self, max_body_size: typing.Optional[int] = DEFAULT_MAX_BODY_SIZE,
+                            timing: typing.Optional[RequestTiming] = None) -> typing.Tuple[int, bytes, bool]:
+        """ read the response of the request sent last """
+        t0 = time.perf_counter()
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Remote end closed connection without response")
+        t1 = time.perf_counter()
+        version, status, _ = (status_line.decode("latin-1").rstrip("\r\n") + " ").split(" ", 2)
+        response_headers = {}
+        while (line := await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+            k, _, v = line.decode("latin-1").partition(":")
+            response_headers[k.strip().lower()] = v.strip()
+
+        connection = response_headers.get("connection", "").lower()
+        will_close = connection == "close" or (version == "HTTP/1.0" and connection != "keep-alive")
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            content = await self._read_chunked(max_body_size)
+        elif "content-length" in response_headers:
+            length = int(response_headers["content-length"])
+            if max_body_size is not None and length > max_body_size:
+                raise ResponseTooLarge(f"Content-Length {length} exceeds max_body_size {max_body_size}")
+            content = await self._reader.readexactly(length)
+        else:
+            content = await self._read_until_eof(max_body_size)
+            will_close = True
+        if timing is not None:
+            timing.ttfb += t1 - t0
+            timing.body += time.perf_counter() - t1
+        return int(status), content, will_close
+
+    async def _read_chunked(self, max_body_size: typing.Optional[int]) -> bytearray:
+        content = bytearray()
+        while True:
+            size = int((await self._reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # skip trailers
+                while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return content
+            if max_body_size is not None and len(content) + size > max_body_size:
+                raise ResponseTooLarge(f"response body exceeds max_body_size {max_body_size}")
+            content += await self._reader.readexactly(size)
+            await self._reader.readexactly(2)
+
+    async def _read_until_eof(self, max_body_size: typing.Optional[int]) -> bytearray:
+        content = bytearray()
+        while chunk := await self._reader.read(READ_CHUNK_SIZE):
+            content += chunk
+            if max_body_size is not None and len(content) > max_body_size:
+                raise ResponseTooLarge(f"response body exceeds max_body_size {max_body_size}")
+        return content
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+def async_http_create(url: str) -> AsyncHTTPConnection:
+    u = urlparse(url)
+    if u.scheme == "http+usbmux":
+        udid, device_wda_port = u.netloc.split(":")
+
+        async def _open_usbmux():
+            registry = get_registry()
+            device = registry.lookup(udid)
+            if device is None:
+                device = await usbmux_aio.select_device(udid)
+                if device is None:
+                    raise BadDevError(f"device {udid!r} not found")
+                registry.register(udid, device)
+            return await usbmux_aio.connect(device, int(device_wda_port))
+        return AsyncHTTPConnection(u.netloc, _open_usbmux)
+    elif u.scheme == "http":
+        return AsyncHTTPConnection(u.netloc, lambda: asyncio.open_connection(u.hostname, u.port or 80))
+    elif u.scheme == "https":
+        return AsyncHTTPConnection(u.netloc, lambda: asyncio.open_connection(
+            u.hostname, u.port or 443, ssl=ssl.create_default_context()))
+    else:
+        raise ValueError(f"unknown scheme: {u.scheme}")
+
+
+class AsyncConnectionPool(ConnectionPool):
+    """ ConnectionPool of AsyncHTTPConnection, only used inside one event loop """
+
+    def _is_alive(self, conn: AsyncHTTPConnection) -> bool:
+        return conn.is_alive()
+
+    def _is_open(self, conn: AsyncHTTPConnection) -> bool:
+        return conn.connected
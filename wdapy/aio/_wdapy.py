@@ -0,0 +1,283 @@
+# coding: utf-8
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import io
+import logging
+import os
+import time
+import typing
+from functools import cached_property
+from typing import List, Optional
+
+from PIL import Image
+
+from wdapy._diff import StableChecker
+from wdapy._proto import *
+from wdapy._types import *
+from wdapy._wdapy import XCUITestRecover, _single_device_udid, decode_screenshot, get_single_device_udid, \
+    image_to_ndarray
+from wdapy.actions import TouchActions
+from wdapy.aio._alert import AsyncAlert
+from wdapy.aio._base import AsyncBaseClient
+from wdapy.exceptions import *
+from wdapy.usbmux import aio as usbmux_aio
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCommonClient(AsyncBaseClient):
+    """ asyncio version of CommonClient """
+
+    def __init__(self, wda_url: str):
+        super().__init__(wda_url)
+        self.__scale: Optional[int] = None
+
+    async def app_start(self, bundle_id: str, arguments: typing.List[str] = [], environment: typing.Dict[str, str] = {}):
+        await self.session_request(POST, "/wda/apps/launch", {
+            "bundleId": bundle_id,
+            "arguments": arguments,
+            "environment": environment,
+        })
+
+    async def app_terminate(self, bundle_id: str):
+        await self.session_request(POST, "/wda/apps/terminate", {
+            "bundleId": bundle_id
+        })
+
+    async def app_state(self, bundle_id: str) -> AppState:
+        value = (await self.session_request(POST, "/wda/apps/state", {
+            "bundleId": bundle_id
+        }))["value"]
+        return AppState(value)
+
+    async def app_current(self) -> AppInfo:
+        await self.unlock()
+        st = await self.status()
+        if st.session_id is None:
+            await self.session()
+        data = await self.request(GET, "/wda/activeAppInfo")
+        value = data['value']
+        return AppInfo.value_of(value)
+
+    async def app_list(self) -> AppList:
+        value = (await self.session_request(GET, "/wda/apps/list"))["value"][0]
+        return AppList.value_of(value)
+
+    async def deactivate(self, duration: float):
+        await self.session_request(POST, "/wda/deactivateApp", {
+            "duration": duration
+        })
+
+    @cached_property
+    def alert(self) -> AsyncAlert:
+        return AsyncAlert(self)
+
+    async def sourcetree(self, format: str = "xml") -> SourceTree:
+        data = await self.request(GET, "/source" if format == "xml" else f"/source?format={format}")
+        return SourceTree.value_of(data)
+
+    async def wait_ui_stable(self, timeout: float = 10.0, interval: float = 0.3, stable_count: int = 2,
+                             ignore: typing.AbstractSet[str] = frozenset(), format: str = "xml") -> SourceTree:
+        checker = StableChecker(stable_count, ignore)
+        deadline = time.monotonic() + timeout
+        while True:
+            source = await self.sourcetree(format)
+            if checker.feed(source):
+                return source
+            if time.monotonic() + interval > deadline:
+                raise UINotStable(f"UI still changing after {timeout} seconds", source)
+            await asyncio.sleep(interval)
+
+    async def open_url(self, url: str):
+        await self.session_request(POST, "/url", {
+            "url": url
+        })
+
+    async def set_clipboard(self, content: str, content_type="plaintext"):
+        """ only works when WDA app is foreground """
+        await self.session_request(POST, "/wda/setPasteboard", {
+            "content": base64.b64encode(content.encode()).decode(),
+            "contentType": content_type
+        })
+
+    async def get_clipboard(self, content_type="plaintext") -> str:
+        data = await self.session_request(POST, "/wda/getPasteboard", {
+            "contentType": content_type
+        })
+        return base64.b64decode(data['value']).decode('utf-8')
+
+    async def appium_settings(self, kwargs: dict = None) -> dict:
+        if kwargs is None:
+            return (await self.session_request(GET, "/appium/settings"))["value"]
+        payload = {"settings": kwargs}
+        return (await self.session_request(POST, "/appium/settings", payload))["value"]
+
+    async def is_locked(self) -> bool:
+        return (await self.request(GET, "/wda/locked"))["value"]
+
+    async def unlock(self):
+        await self.request(POST, "/wda/unlock")
+
+    async def lock(self):
+        await self.request(POST, "/wda/lock")
+
+    async def homescreen(self):
+        await self.request(POST, "/wda/homescreen")
+
+    async def shutdown(self):
+        await self.request(GET, "/wda/shutdown")
+
+    async def get_orientation(self) -> Orientation:
+        value = (await self.session_request(GET, '/orientation'))['value']
+        return Orientation(value)
+
+    async def window_size(self) -> typing.Tuple[int, int]:
+        data = await self.session_request(GET, "/window/size")
+        return data['value']['width'], data['value']['height']
+
+    async def send_keys(self, value: str):
+        """ input with some text """
+        await self.session_request(POST, "/wda/keys", {"value": list(value)})
+
+    async def tap(self, x: int, y: int):
+        try:
+            await self.session_request(POST, "/wda/tap", {"x": x, "y": y})
+        except RequestError:
+            await self.session_request(POST, "/wda/tap/0", {"x": x, "y": y})
+
+    async def touch_and_hold(self, x: int, y: int, duration: float):
+        await self.session_request(POST, "/wda/touchAndHold", {"x": x, "y": y, "duration": duration})
+
+    async def swipe(self,
+                    from_x: int,
+                    from_y: int,
+                    to_x: int,
+                    to_y: int,
+                    duration: float = 0.5):
+        payload = {
+            "fromX": from_x,
+            "fromY": from_y,
+            "toX": to_x,
+            "toY": to_y,
+            "duration": duration}
+        await self.session_request(POST, "/wda/dragfromtoforduration", payload)
+
+    async def press(self, name: Keycode):
+        payload = {
+            "name": name
+        }
+        await self.session_request(POST, "/wda/pressButton", payload)
+
+    async def press_duration(self, name: Keycode, duration: float):
+        hid_usages = {
+            "home": 0x40,
+            "volumeup": 0xE9,
+            "volumedown": 0xEA,
+            "power": 0x30,
+            "snapshot": 0x65,
+            "power_plus_home": 0x65
+        }
+        name = name.lower()
+        if name not in hid_usages:
+            raise ValueError("Invalid name:", name)
+        payload = {
+            "page": 0x0C,
+            "usage": hid_usages[name],
+            "duration": duration
+        }
+        return await self.session_request(POST, "/wda/performIoHidEvent", payload)
+
+    async def volume_up(self):
+        await self.press(Keycode.VOLUME_UP)
+
+    async def volume_down(self):
+        await self.press(Keycode.VOLUME_DOWN)
+
+    @property
+    def scale(self) -> typing.Awaitable[int]:
+        """ usage: await client.scale """
+        return self._get_scale()
+
+    async def _get_scale(self) -> int:
+        if self.__scale is None:
+            value = (await self.session_request(GET, "/wda/screen"))['value']
+            self.__scale = value['scale']
+        return self.__scale
+
+    async def status_barsize(self) -> StatusBarSize:
+        value = (await self.session_request(GET, "/wda/screen"))['value']
+        return StatusBarSize.value_of(value['statusBarSize'])
+
+    async def screenshot(self, lazy: bool = False) -> Image.Image:
+        """ take screenshot, see CommonClient.screenshot """
+        buf = io.BytesIO(await self.screenshot_raw())
+        im = Image.open(buf)
+        if lazy:
+            return im
+        return im.convert("RGB")
+
+    async def screenshot_raw(self) -> bytes:
+        value = (await self.request(GET, "/screenshot"))["value"]
+        return decode_screenshot(value)
+
+    async def screenshot_ndarray(self) -> "numpy.ndarray":
+        return image_to_ndarray(await self.screenshot_raw())
+
+    async def save_screenshot(self, path: typing.Union[str, os.PathLike]):
+        raw_value = await self.screenshot_raw()
+        with open(path, "wb") as f:
+            f.write(raw_value)
+
+    async def battery_info(self) -> BatteryInfo:
+        data = (await self.session_request(GET, "/wda/batteryInfo"))["value"]
+        return BatteryInfo.value_of(data)
+
+    @property
+    def info(self) -> typing.Awaitable[DeviceInfo]:
+        """ usage: await client.info """
+        return self.device_info()
+
+    async def device_info(self) -> DeviceInfo:
+        data = (await self.session_request(GET, "/wda/device/info"))["value"]
+        return DeviceInfo.value_of(data)
+
+    async def keyboard_dismiss(self, key_names: typing.List[str] = ["前往", "发送", "Send", "Done", "Return"]):
+        await self.session_request(POST, "/wda/keyboard/dismiss", {"keyNames": key_names})
+
+
+class AsyncTouchActionsClient(AsyncBaseClient):
+    async def perform_actions(self, actions: List[TouchActions]):
+        await self.session_request(POST, "/actions", {"actions": [a.model_dump(exclude_none=True) for a in actions]})
+
+
+class AsyncAppiumClient(AsyncCommonClient, AsyncTouchActionsClient):
+    """
+    asyncio client for https://github.com/appium/WebDriverAgent
+    """
+
+    def __init__(self, wda_url: str = DEFAULT_WDA_URL):
+        super().__init__(wda_url)
+
+
+class AsyncAppiumUSBClient(AsyncAppiumClient):
+    """
+    udid=None looks up the only connected device with a blocking usbmuxd query,
+    inside a running event loop use `await AsyncAppiumUSBClient.create()` instead
+    """
+
+    def __init__(self, udid: Optional[str] = None, port: int = 8100):
+        if udid is None:
+            udid = get_single_device_udid()
+        super().__init__(f"http+usbmux://{udid}:{port}")
+        self.set_recover_handler(XCUITestRecover(udid))
+
+    @classmethod
+    async def create(cls, udid: Optional[str] = None, port: int = 8100) -> AsyncAppiumUSBClient:
+        """ same as the constructor, the device lookup does not block the event loop """
+        if udid is None:
+            udid = _single_device_udid(await usbmux_aio.list_devices())
+        return cls(udid, port)
@@ -18,4 +18,24 @@ class ApiError(RequestError):
 
 
 class WDAFatalError(RequestError):
-    """ unrecoverable error """
\ No newline at end of file
+    """ unrecoverable error """
+
+
+class DeadlineExceeded(RequestError):
+    """ per-call timeout or deadline spent, see client.with_timeout """
+
+
+class CircuitOpenError(RequestError):
+    """ device is marked as down by the circuit breaker, request not sent """
+
+
+class ResponseTooLarge(WDAException):
+    """ response body exceeds client.max_body_size """
+
+
+class UINotStable(WDAException):
+    """ the page kept changing until the timeout """
+
+    def __init__(self, message: str, source=None):
+        super().__init__(message)
+        self.source = source  # the last snapshot
@@ -0,0 +1,248 @@
+# coding: utf-8
+#
+"""
+Run the same command on many devices in parallel
+
+Usage example:
+    fleet = DeviceFleet(max_workers=16)
+    for result in fleet.iter_run("screenshot_raw", timeout=10):
+        print(result.udid, result.ok, result.elapsed)
+
+    results = fleet.run(lambda c: c.app_start("com.apple.Preferences"), raise_on_error=True)
+"""
+
+from __future__ import annotations
+
+__all__ = ["DeviceFleet", "FleetResult", "FleetError"]
+
+import dataclasses
+import logging
+import threading
+import time
+import typing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from wdapy._deadline import deadline
+from wdapy._wdapy import AppiumUSBClient
+from wdapy.exceptions import WDAException
+from wdapy.usbmux.pyusbmux import MuxDevice, list_devices
+from wdapy.usbmux.registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+DeviceCall = typing.Union[str, typing.Callable[..., typing.Any]]
+
+
+@dataclasses.dataclass
+class FleetResult:
+    udid: str
+    value: typing.Any = None
+    error: typing.Optional[BaseException] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class FleetError(WDAException):
+    """ one or more devices failed """
+
+    def __init__(self, errors: typing.Dict[str, BaseException]):
+        self.errors = errors
+        lines = [f"{udid}: {err!r}" for udid, err in errors.items()]
+        super().__init__(f"{len(errors)} device(s) failed\n" + "\n".join(lines))
+
+
+class DeviceFleet:
+    """ discover devices through usbmux, keep one client per device and run calls on all of them
+
+    A slow or dead device only holds its own worker, results of the other devices
+    are returned as soon as they finish.
+    """
+
+    def __init__(self,
+                 client_factory: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+                 max_workers: int = 32,
+                 usbmux_address: typing.Optional[str] = None):
+        """
+        Args:
+            client_factory: create client from udid, default AppiumUSBClient
+            max_workers: max devices running at the same time
+            usbmux_address: discover devices on a non-default usbmuxd, the clients of client_factory
+                must connect through the same daemon
+
+        Raises:
+            ValueError: usbmux_address without client_factory, AppiumUSBClient uses the default usbmuxd
+        """
+        if client_factory is None:
+            if usbmux_address is not None:
+                raise ValueError("AppiumUSBClient connects through the default usbmuxd, "
+                                 "pass a client_factory for usbmux_address")
+            client_factory = AppiumUSBClient
+        self._client_factory = client_factory
+        self._usbmux_address = usbmux_address
+        self._lock = threading.Lock()
+        self._devices: typing.Dict[str, MuxDevice] = {}
+        self._clients: typing.Dict[str, typing.Any] = {}
+        self._futures: typing.Set[Future] = set()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="wdapy-fleet")
+
+    def refresh(self) -> typing.List[str]:
+        """ rediscover devices, clients of detached devices are dropped
+
+        Returns:
+            udid list
+        """
+        devices: typing.Dict[str, MuxDevice] = {}
+        for device in list_devices(usbmux_address=self._usbmux_address):
+            # prefer usb when the device is also connected by network
+            if device.serial not in devices or device.is_usb:
+                devices[device.serial] = device
+        registry = get_registry(self._usbmux_address)
+        with self._lock:
+            gone = (set(self._devices) | set(self._clients)) - set(devices)
+            for udid in gone & set(self._clients):
+                client = self._clients.pop(udid)
+                if hasattr(client, "close"):
+                    client.close()
+            self._devices = devices
+        for udid in gone:
+            # re-attached devices get a new devid, do not keep the old one
+            registry.invalidate(udid)
+        for udid, device in devices.items():
+            # clients resolve the device from registry without enumerating again
+            registry.register(udid, device)
+        return list(devices)
+
+    @property
+    def udids(self) -> typing.List[str]:
+        with self._lock:
+            return list(self._devices)
+
+    def client(self, udid: str):
+        """ return the cached client of udid """
+        with self._lock:
+            client = self._clients.get(udid)
+            if client is None:
+                client = self._clients[udid] = self._client_factory(udid)
+            return client
+
+    def _select(self,
+                udids: typing.Optional[typing.Iterable[str]],
+                where: typing.Optional[typing.Callable[[MuxDevice], bool]]) -> typing.List[str]:
+        if not self._devices:
+            self.refresh()
+        with self._lock:
+            devices = dict(self._devices)
+        selected = list(udids) if udids is not None else list(devices)
+        if where is not None:
+            selected = [udid for udid in selected if udid in devices and where(devices[udid])]
+        return selected
+
+    def _call(self, udid: str, fn: DeviceCall, args: tuple, kwargs: dict) -> typing.Any:
+        client = self.client(udid)
+        if isinstance(fn, str):
+            return getattr(client, fn)(*args, **kwargs)
+        return fn(client, *args, **kwargs)
+
+    def iter_run(self,
+                 fn: DeviceCall,
+                 *args,
+                 udids: typing.Optional[typing.Iterable[str]] = None,
+                 where: typing.Optional[typing.Callable[[MuxDevice], bool]] = None,
+                 timeout: typing.Optional[float] = None,
+                 **kwargs) -> typing.Iterator[FleetResult]:
+        """ run on devices and yield results in completion order
+
+        Args:
+            fn: client method name, or callable called as fn(client, *args, **kwargs)
+            udids: only run on these devices, default all discovered devices
+            where: filter devices, e.g. lambda d: d.is_usb
+            timeout: per device seconds, counted from when the device starts running.
+                It is also the deadline of the requests sent by the call, so a hung device frees its worker
+                once the budget is spent. A timed out device yields a TimeoutError result.
+        """
+        started: typing.Dict[str, float] = {}
+
+        def task(udid: str) -> FleetResult:
+            start = started[udid] = time.monotonic()
+            try:
+                with deadline(timeout):
+                    value = self._call(udid, fn, args, kwargs)
+                return FleetResult(udid, value=value, elapsed=time.monotonic() - start)
+            except Exception as e:
+                logger.debug("device %s failed: %r", udid, e)
+                return FleetResult(udid, error=e, elapsed=time.monotonic() - start)
+
+        futures: typing.Dict[Future, str] = {self._submit(task, udid): udid for udid in self._select(udids, where)}
+        pending = set(futures)
+        try:
+            while pending:
+                wait_timeout = None
+                if timeout is not None:
+                    now = time.monotonic()
+                    for f in list(pending):
+                        udid = futures[f]
+                        if not f.done() and udid in started and now - started[udid] >= timeout:
+                            pending.discard(f)
+                            yield FleetResult(udid, error=TimeoutError(f"device {udid} not finished in {timeout}s"),
+                                              elapsed=now - started[udid])
+                    deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+                    # poll for devices still waiting for a free worker
+                    wait_timeout = max(0.0, min(deadlines) - now) if deadlines else 0.05
+                done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                for f in done:
+                    yield f.result()
+        finally:
+            for f in pending:
+                f.cancel()
+
+    def _submit(self, fn: typing.Callable[..., FleetResult], *args) -> Future:
+        future = self._executor.submit(fn, *args)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget_future)
+        return future
+
+    def _forget_future(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def run(self,
+            fn: DeviceCall,
+            *args,
+            udids: typing.Optional[typing.Iterable[str]] = None,
+            where: typing.Optional[typing.Callable[[MuxDevice], bool]] = None,
+            timeout: typing.Optional[float] = None,
+            raise_on_error: bool = False,
+            **kwargs) -> typing.Dict[str, FleetResult]:
+        """ same as iter_run, but wait for all devices
+
+        Raises:
+            FleetError: when raise_on_error is True and any device failed
+        """
+        results = {r.udid: r for r in self.iter_run(fn, *args, udids=udids, where=where, timeout=timeout, **kwargs)}
+        errors = {udid: r.error for udid, r in results.items() if not r.ok}
+        if raise_on_error and errors:
+            raise FleetError(errors)
+        return results
+
+    def close(self):
+        # shutdown(cancel_futures=True) needs python 3.9
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            if hasattr(client, "close"):
+                client.close()
+
+    def __enter__(self) -> "DeviceFleet":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
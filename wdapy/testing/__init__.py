@@ -0,0 +1,5 @@
+# coding: utf-8
+#
+"""
+Local fake servers, used by tests and benchmarks without a real device
+"""
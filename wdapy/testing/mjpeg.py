@@ -0,0 +1,102 @@
+# coding: utf-8
+#
+"""
+Fake WDA mjpeg server for tests and benchmarks
+
+Usage:
+    with FakeMJPEGServer(fps=30) as server:
+        stream = AppiumClient("http://127.0.0.1:8100").screen_stream(port=server.port)
+"""
+
+from __future__ import annotations
+
+import io
+import socket
+import threading
+import time
+import typing
+
+from PIL import Image
+
+BOUNDARY = b"--BoundaryString"
+
+
+def make_jpeg_frames(count: int = 10, size: typing.Tuple[int, int] = (64, 128)) -> typing.List[bytes]:
+    frames = []
+    for i in range(count):
+        buf = io.BytesIO()
+        Image.new("RGB", size, ((i * 25) % 256, 80, 160)).save(buf, format="JPEG")
+        frames.append(buf.getvalue())
+    return frames
+
+
+class FakeMJPEGServer:
+    def __init__(self,
+                 frames: typing.Optional[typing.List[bytes]] = None,
+                 fps: float = 30,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 content_length: bool = True):
+        """
+        Args:
+            frames: JPEG frames sent in a loop
+            fps: frames per second sent to each client
+            content_length: send Content-Length in every part, like WDA does
+        """
+        self.frames = frames or make_jpeg_frames()
+        self.fps = fps
+        self.content_length = content_length
+        self._listener = socket.create_server((host, port))
+        self._closed = threading.Event()
+        self._clients: typing.List[socket.socket] = []
+
+    @property
+    def port(self) -> int:
+        return self._listener.getsockname()[1]
+
+    def start(self) -> "FakeMJPEGServer":
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            self._clients.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        try:
+            conn.recv(4096)  # request header
+            conn.sendall(b"HTTP/1.0 200 OK\r\n"
+                         b"Content-Type: multipart/x-mixed-replace; boundary=" + BOUNDARY + b"\r\n\r\n")
+            index = 0
+            while not self._closed.is_set():
+                frame = self.frames[index % len(self.frames)]
+                header = BOUNDARY + b"\r\nContent-type: image/jpg\r\n"
+                if self.content_length:
+                    header += b"Content-Length: %d\r\n" % len(frame)
+                conn.sendall(header + b"\r\n" + frame + b"\r\n\r\n")
+                index += 1
+                time.sleep(1 / self.fps)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self._closed.set()
+        self._listener.close()
+        for conn in self._clients:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self) -> "FakeMJPEGServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
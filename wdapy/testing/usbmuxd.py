@@ -0,0 +1,399 @@
+# coding: utf-8
+#
+"""
+Fake usbmuxd on a unix socket for tests and benchmarks
+
+Speaks the binary and plist protocols, keeps a table of fake devices, pushes
+Attached/Detached events to Listen connections and relays Connect to local TCP ports.
+
+Usage:
+    with FakeWDA() as wda, FakeUsbmuxd(devices=3, ports={8100: wda.address}) as mux:
+        device = select_device(mux.devices[0].serial, usbmux_address=mux.address)
+        with USBMuxHTTPConnection(device, 8100, usbmux_address=mux.address) as conn:
+            conn.request("GET", "/status")
+
+        d = mux.attach()  # Attached event to every listener
+        mux.detach(d.device_id)
+
+    FakeUsbmuxd(protocol="binary")  # old daemon, plist packets are answered with BADVERSION
+"""
+
+from __future__ import annotations
+
+import collections
+import os
+import plistlib
+import shutil
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
+
+from wdapy.usbmux import _codec
+
+Address = typing.Tuple[str, int]
+
+# the fake packs packets itself, so tests also check the client codec
+_HEADER = struct.Struct("<IIII")  # length, version, message, tag
+_RESULT = struct.Struct("<I")
+_CONNECT = struct.Struct("<IHH")  # device_id, port (network order), reserved
+_DEVICE_RECORD = struct.Struct("<IH256s2xI")  # device_id, product_id, serial, location
+
+BINARY = _codec.VERSION_BINARY
+PLIST = _codec.VERSION_PLIST
+
+MSG_RESULT = _codec.MSG_RESULT
+MSG_CONNECT = _codec.MSG_CONNECT
+MSG_LISTEN = _codec.MSG_LISTEN
+MSG_ADD = _codec.MSG_ADD
+MSG_REMOVE = _codec.MSG_REMOVE
+MSG_PLIST = _codec.MSG_PLIST
+
+RESULT_OK = _codec.RESULT_OK
+RESULT_BADCOMMAND = _codec.RESULT_BADCOMMAND
+RESULT_BADDEV = _codec.RESULT_BADDEV
+RESULT_CONNREFUSED = _codec.RESULT_CONNREFUSED
+RESULT_BADVERSION = _codec.RESULT_BADVERSION
+
+
+@dataclass
+class FakeDevice:
+    device_id: int
+    serial: str
+    connection_type: str = "USB"
+    product_id: int = 0x12a8
+    # device port -> local TCP address, falls back to FakeUsbmuxd.ports
+    ports: typing.Dict[int, Address] = field(default_factory=dict)
+
+    def properties(self) -> dict:
+        return {
+            "ConnectionType": self.connection_type,
+            "DeviceID": self.device_id,
+            "LocationID": self.device_id << 16,
+            "ProductID": self.product_id,
+            "SerialNumber": self.serial,
+            "ConnectionSpeed": 480000000,
+        }
+
+    def attached(self) -> dict:
+        return {"MessageType": "Attached", "DeviceID": self.device_id, "Properties": self.properties()}
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakeUsbmuxd:
+    def __init__(self,
+                 devices: typing.Union[int, typing.Iterable[FakeDevice]] = 1,
+                 protocol: str = "plist",
+                 ports: typing.Optional[typing.Dict[int, Address]] = None,
+                 path: typing.Optional[str] = None,
+                 latency: float = 0.0,
+                 event_interval: float = 0.0,
+                 list_devices: bool = True):
+        """
+        Args:
+            devices: number of USB devices to attach at start, or the devices
+            protocol: "plist" answers both protocols like a modern usbmuxd, "binary" only the binary one
+            ports: device port -> local TCP address used by Connect for every device
+            path: unix socket path, a temporary one by default
+            latency: seconds to sleep before each reply, simulates a busy daemon
+            event_interval: seconds between the Attached events replayed after Listen, simulates a loaded hub
+            list_devices: answer ListDevices, older daemons reply BADCOMMAND
+        """
+        if protocol not in ("plist", "binary"):
+            raise ValueError(f"unknown protocol: {protocol}")
+        self.protocol = protocol
+        self.ports = dict(ports or {})
+        self.latency = latency
+        self.event_interval = event_interval
+        self.list_devices = list_devices
+        self.buid = "00000000-0000-0000-0000-000000000000"
+        self.pair_records: typing.Dict[str, bytes] = {}
+        self.connections = 0
+        self.requests: typing.Counter[str] = collections.Counter()
+        self._devices: typing.Dict[int, FakeDevice] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._listeners: typing.Set["_Client"] = set()
+        self._clients: typing.Set["_Client"] = set()
+
+        self._tmpdir = None
+        if path is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="usbmuxd-")
+            path = os.path.join(self._tmpdir, "usbmuxd")
+        self.address = path
+        self._server = _Server(path, self._handler_class())
+        self._thread: typing.Optional[threading.Thread] = None
+
+        if isinstance(devices, int):
+            for _ in range(devices):
+                self.attach()
+        else:
+            for device in devices:
+                self.attach(device)
+
+    def start(self) -> "FakeUsbmuxd":
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.1,), daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+        elif os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __enter__(self) -> "FakeUsbmuxd":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def devices(self) -> typing.List[FakeDevice]:
+        with self._lock:
+            return list(self._devices.values())
+
+    @property
+    def listeners(self) -> int:
+        """ number of connections receiving device events """
+        with self._lock:
+            return len(self._listeners)
+
+    def attach(self, device: typing.Optional[FakeDevice] = None, connection_type: str = "USB") -> FakeDevice:
+        """ add a device and send Attached to every listener """
+        with self._lock:
+            if device is None:
+                device = FakeDevice(self._next_id, f"00008101-{self._next_id:016X}", connection_type)
+            self._next_id = max(self._next_id, device.device_id) + 1
+            self._devices[device.device_id] = device
+            listeners = list(self._listeners)
+        for client in listeners:
+            client.send_attached(device)
+        return device
+
+    def detach(self, device_id: int) -> FakeDevice:
+        """ remove a device and send Detached to every listener """
+        with self._lock:
+            device = self._devices.pop(device_id)
+            listeners = list(self._listeners)
+        for client in listeners:
+            client.send_detached(device_id)
+        return device
+
+    def resolve_port(self, device: FakeDevice, port: int) -> typing.Optional[Address]:
+        return device.ports.get(port) or self.ports.get(port)
+
+    def _handler_class(self):
+        usbmuxd = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                client = _Client(usbmuxd, self.request)
+                with usbmuxd._lock:
+                    usbmuxd.connections += 1
+                    usbmuxd._clients.add(client)
+                try:
+                    client.serve()
+                finally:
+                    with usbmuxd._lock:
+                        usbmuxd._listeners.discard(client)
+                        usbmuxd._clients.discard(client)
+                    client.close()
+
+        return Handler
+
+
+class _Client:
+    """ one connection to the fake daemon """
+
+    def __init__(self, usbmuxd: FakeUsbmuxd, sock: socket.socket):
+        self.usbmuxd = usbmuxd
+        self.sock = sock
+        self.version = PLIST
+        self._wlock = threading.Lock()
+        self._relay: typing.Optional[socket.socket] = None
+
+    def close(self):
+        for s in (self.sock, self._relay):
+            if s is None:
+                continue
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            s.close()
+
+    def _recv_exactly(self, size: int) -> typing.Optional[bytes]:
+        buf = bytearray()
+        while len(buf) < size:
+            try:
+                chunk = self.sock.recv(size - len(buf))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            buf += chunk
+        return bytes(buf)
+
+    def _write(self, version: int, message: int, tag: int, payload: bytes):
+        packet = _HEADER.pack(_HEADER.size + len(payload), version, message, tag) + payload
+        with self._wlock:
+            self.sock.sendall(packet)
+
+    def send_result(self, tag: int, number: int):
+        if self.version == PLIST:
+            self.send_plist(tag, {"MessageType": "Result", "Number": number})
+        else:
+            self._write(BINARY, MSG_RESULT, tag, _RESULT.pack(number))
+
+    def send_plist(self, tag: int, data: dict):
+        self._write(PLIST, MSG_PLIST, tag, plistlib.dumps(data))
+
+    def send_attached(self, device: FakeDevice):
+        try:
+            if self.version == PLIST:
+                self.send_plist(0, device.attached())
+            else:
+                record = _DEVICE_RECORD.pack(device.device_id, device.product_id, device.serial.encode("ascii"),
+                                             device.device_id << 16)
+                self._write(BINARY, MSG_ADD, 0, record)
+        except OSError:
+            pass
+
+    def send_detached(self, device_id: int):
+        try:
+            if self.version == PLIST:
+                self.send_plist(0, {"MessageType": "Detached", "DeviceID": device_id})
+            else:
+                self._write(BINARY, MSG_REMOVE, 0, _RESULT.pack(device_id))
+        except OSError:
+            pass
+
+    def serve(self):
+        while True:
+            header = self._recv_exactly(_HEADER.size)
+            if header is None:
+                return
+            length, version, message, tag = _HEADER.unpack(header)
+            payload = self._recv_exactly(length - _HEADER.size) if length > _HEADER.size else b""
+            if payload is None:
+                return
+            if self.usbmuxd.latency:
+                time.sleep(self.usbmuxd.latency)
+            if version == PLIST and self.usbmuxd.protocol == "binary":
+                self.version = BINARY
+                self.send_result(tag, RESULT_BADVERSION)
+                continue
+            self.version = version
+            if message == MSG_PLIST and version == PLIST:
+                request = plistlib.loads(payload)
+                name = request.get("MessageType", "")
+                if name == "Connect":
+                    device_id, port = request.get("DeviceID"), request.get("PortNumber", 0)
+                else:
+                    self._handle_plist(tag, name, request)
+                    continue
+            elif message == MSG_CONNECT:
+                name = "Connect"
+                device_id, port, _ = _CONNECT.unpack(payload[:_CONNECT.size])
+            elif message == MSG_LISTEN:
+                name = "Listen"
+                self._listen(tag)
+                self.usbmuxd.requests[name] += 1
+                continue
+            else:
+                self.send_result(tag, RESULT_BADCOMMAND)
+                continue
+
+            self.usbmuxd.requests[name] += 1
+            if self._connect(tag, device_id, socket.ntohs(port)):
+                self._pipe()
+                return
+
+    def _listen(self, tag: int):
+        self.send_result(tag, RESULT_OK)
+        with self.usbmuxd._lock:
+            self.usbmuxd._listeners.add(self)
+            devices = list(self.usbmuxd._devices.values())
+        for device in devices:
+            if self.usbmuxd.event_interval:
+                time.sleep(self.usbmuxd.event_interval)
+            self.send_attached(device)
+
+    def _handle_plist(self, tag: int, name: str, request: dict):
+        usbmuxd = self.usbmuxd
+        usbmuxd.requests[name] += 1
+        if name == "Listen":
+            self._listen(tag)
+        elif name == "ListDevices" and usbmuxd.list_devices:
+            self.send_plist(tag, {"DeviceList": [d.attached() for d in usbmuxd.devices]})
+        elif name == "ReadBUID":
+            self.send_plist(tag, {"BUID": usbmuxd.buid})
+        elif name == "ReadPairRecord":
+            record = usbmuxd.pair_records.get(request.get("PairRecordID"))
+            if record is None:
+                self.send_result(tag, RESULT_BADDEV)
+            else:
+                self.send_plist(tag, {"PairRecordData": record})
+        elif name == "SavePairRecord":
+            usbmuxd.pair_records[request["PairRecordID"]] = request["PairRecordData"]
+            self.send_result(tag, RESULT_OK)
+        else:
+            self.send_result(tag, RESULT_BADCOMMAND)
+
+    def _connect(self, tag: int, device_id: int, port: int) -> bool:
+        with self.usbmuxd._lock:
+            device = self.usbmuxd._devices.get(device_id)
+        if device is None:
+            self.send_result(tag, RESULT_BADDEV)
+            return False
+        address = self.usbmuxd.resolve_port(device, port)
+        if address is None:
+            self.send_result(tag, RESULT_CONNREFUSED)
+            return False
+        try:
+            self._relay = socket.create_connection(address)
+        except OSError:
+            self.send_result(tag, RESULT_CONNREFUSED)
+            return False
+        self._relay.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_result(tag, RESULT_OK)
+        return True
+
+    def _pipe(self):
+        """ relay bytes in both directions until either side closes """
+        t = threading.Thread(target=_copy, args=(self._relay, self.sock), daemon=True)
+        t.start()
+        _copy(self.sock, self._relay)
+        # the device side may keep the connection alive, do not wait for it
+        self.close()
+        t.join()
+
+
+def _copy(src: socket.socket, dst: socket.socket):
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            dst.sendall(data)
+    except OSError:
+        pass
+    try:
+        dst.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
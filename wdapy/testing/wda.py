@@ -0,0 +1,319 @@
+# coding: utf-8
+#
+"""
+Fake WebDriverAgent HTTP server for tests and benchmarks
+
+Usage:
+    with FakeWDA(latency=0.01) as wda:
+        c = AppiumClient(wda.url)
+        c.tap(100, 200)
+
+    # per-endpoint latency (session prefix stripped) and payload sizes
+    FakeWDA(latency=0.005, latencies={"/screenshot": 0.15, "GET /source": 0.3},
+            screenshot_size=2_000_000, source_size=500_000)
+"""
+
+from __future__ import annotations
+
+import base64
+import collections
+import functools
+import io
+import json
+import os
+import re
+import threading
+import time
+import typing
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SESSION_PATH = re.compile(r"^/session/(?P<session_id>[^/]+)(?P<path>/.*)?$")
+
+Route = typing.Callable[[typing.Any], typing.Any]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+@functools.lru_cache(maxsize=8)
+def make_png(size: int) -> bytes:
+    """ a valid PNG of about size bytes, noise so it does not compress """
+    from PIL import Image
+    width = 256
+    height = max(1, size // (width * 3))
+    im = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+@functools.lru_cache(maxsize=8)
+def make_source(size: int) -> str:
+    """ a nested XCUIElementType XML page of about size characters """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<XCUIElementTypeApplication type="XCUIElementTypeApplication" name="Fake" label="Fake" '
+             'enabled="true" visible="true" accessible="false" x="0" y="0" width="390" height="844" index="0">',
+             '  <XCUIElementTypeWindow type="XCUIElementTypeWindow" enabled="true" visible="true" accessible="false" '
+             'x="0" y="0" width="390" height="844" index="0">']
+    total = sum(len(line) + 1 for line in lines)
+    i = 0
+    while total < size:
+        y = (i * 44) % 800
+        group = [
+            f'    <XCUIElementTypeCell type="XCUIElementTypeCell" enabled="true" visible="true" accessible="false" '
+            f'x="0" y="{y}" width="390" height="44" index="{i}">',
+            f'      <XCUIElementTypeStaticText type="XCUIElementTypeStaticText" value="Item {i}" name="Item {i}" '
+            f'label="Item {i}" enabled="true" visible="true" accessible="true" x="16" y="{y + 12}" width="200" '
+            f'height="20" index="0"/>',
+            f'      <XCUIElementTypeButton type="XCUIElementTypeButton" name="more-{i}" label="More" enabled="true" '
+            f'visible="true" accessible="true" x="340" y="{y + 7}" width="30" height="30" index="1"/>',
+            '    </XCUIElementTypeCell>',
+        ]
+        lines.extend(group)
+        total += sum(len(line) + 1 for line in group)
+        i += 1
+    lines.extend(['  </XCUIElementTypeWindow>', '</XCUIElementTypeApplication>'])
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=8)
+def make_source_json(size: int) -> dict:
+    """ make_source(size) in the shape of /source?format=json """
+    def convert(node: ET.Element) -> dict:
+        a = node.attrib
+        data = {"type": a["type"], "name": a.get("name"), "label": a.get("label"), "value": a.get("value"),
+                "rect": {key: int(a[key]) for key in ("x", "y", "width", "height")},
+                "isEnabled": a["enabled"] == "true", "isVisible": a["visible"] == "true",
+                "isAccessible": a["accessible"] == "true"}
+        children = [convert(child) for child in node]
+        if children:
+            data["children"] = children
+        return data
+    return convert(ET.fromstring(make_source(size)))
+
+
+class FakeWDA:
+    def __init__(self,
+                 latency: float = 0.0,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latencies: typing.Optional[typing.Dict[str, float]] = None,
+                 screenshot_size: int = 0,
+                 source_size: int = 0,
+                 source: typing.Optional[typing.Callable[[], typing.Union[str, dict]]] = None):
+        """
+        Args:
+            latency: seconds to sleep before each response, simulates device time
+            latencies: override latency by "METHOD /path" or "/path", session prefix stripped
+            screenshot_size: approximate PNG bytes of /screenshot, 0 means a tiny image
+            source_size: approximate characters of /source XML, 0 means a tiny page
+            source: returns the value of each /source request instead, e.g. a page that keeps changing
+        """
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        self.screenshot_size = screenshot_size
+        self.source_size = source_size
+        self.source = source
+        self.session_id: typing.Optional[str] = None
+        self.requests: typing.Counter[str] = collections.Counter()
+        self.alert_text: typing.Optional[str] = None
+        self.locked = False
+        self.pasteboard = b""
+        self.drop_responses = 0  # the next n requests are handled, then the connection closes without a response
+        self._routes: typing.Optional[typing.Dict[typing.Tuple[str, str], Route]] = None
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> typing.Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeWDA":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeWDA":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def kill_session(self):
+        """ simulate WDA restart, the current session becomes invalid """
+        with self._lock:
+            self.session_id = None
+
+    def _drop_response(self) -> bool:
+        with self._lock:
+            if self.drop_responses <= 0:
+                return False
+            self.drop_responses -= 1
+            return True
+
+    def latency_of(self, method: str, path: str) -> float:
+        return self.latencies.get(f"{method} {path}", self.latencies.get(path, self.latency))
+
+    def handle(self, method: str, path: str, payload: typing.Any) -> typing.Tuple[int, dict]:
+        """ return (status_code, json response) """
+        path, _, query = path.partition("?")
+        if query and payload is None:
+            payload = dict(urllib.parse.parse_qsl(query))
+        with self._lock:
+            self.requests[f"{method} {path}"] += 1
+
+        m = _SESSION_PATH.match(path)
+        if m:
+            path = m.group("path") or ""
+        latency = self.latency_of(method, path)
+        if latency:
+            time.sleep(latency)
+        if m:
+            if m.group("session_id") != self.session_id:
+                return 404, {"sessionId": None, "value": {
+                    "error": "invalid session id",
+                    "message": f"Session does not exist: {m.group('session_id')}"}}
+            if method == "DELETE" and not path:
+                self.kill_session()
+                return 200, {"sessionId": None, "value": None}
+
+        if self._routes is None:
+            self._routes = self.routes()
+        route = self._routes.get((method, path))
+        if route is None:
+            return 404, {"sessionId": self.session_id, "value": {
+                "error": "unknown command", "message": f"Unhandled endpoint: {path}"}}
+        try:
+            value = route(payload)
+        except LookupError as e:
+            return 404, {"sessionId": self.session_id, "value": {"error": "no such alert", "message": str(e)}}
+        return 200, {"sessionId": self.session_id, "value": value}
+
+    def routes(self) -> typing.Dict[typing.Tuple[str, str], Route]:
+        ok: Route = lambda _: None
+        return {
+            ("GET", "/status"): lambda _: {"message": "WebDriverAgent is ready to accept commands",
+                                           "ready": True, "ios": {"ip": "127.0.0.1"}},
+            ("POST", "/session"): self._create_session,
+            ("GET", "/screenshot"): self._screenshot,
+            ("GET", "/source"): self._source,
+            ("GET", "/wda/locked"): lambda _: self.locked,
+            ("POST", "/wda/lock"): lambda _: setattr(self, "locked", True),
+            ("POST", "/wda/unlock"): lambda _: setattr(self, "locked", False),
+            ("POST", "/wda/homescreen"): ok,
+            ("GET", "/wda/activeAppInfo"): lambda _: {"name": "", "processArguments": {}, "pid": 100,
+                                                      "bundleId": "com.apple.springboard"},
+            ("GET", "/window/size"): lambda _: {"width": 390, "height": 844},
+            ("GET", "/wda/screen"): lambda _: {"statusBarSize": {"width": 390, "height": 47}, "scale": 3},
+            ("GET", "/orientation"): lambda _: "PORTRAIT",
+            ("GET", "/wda/batteryInfo"): lambda _: {"level": 0.8, "state": 2},
+            ("GET", "/wda/device/info"): lambda _: {"timeZone": "Asia/Shanghai", "currentLocale": "en_US",
+                                                    "model": "iPhone", "uuid": "FAKE-UUID", "name": "Fake iPhone",
+                                                    "userInterfaceIdiom": 0, "userInterfaceStyle": "light",
+                                                    "isSimulator": False},
+            ("POST", "/wda/apps/launch"): ok,
+            ("POST", "/wda/apps/terminate"): lambda _: True,
+            ("POST", "/wda/apps/state"): lambda _: 4,
+            ("GET", "/wda/apps/list"): lambda _: [{"pid": 100, "bundleId": "com.apple.springboard"}],
+            ("POST", "/wda/deactivateApp"): ok,
+            ("POST", "/url"): ok,
+            ("POST", "/wda/setPasteboard"): self._set_pasteboard,
+            ("POST", "/wda/getPasteboard"): lambda _: base64.b64encode(self.pasteboard).decode(),
+            ("GET", "/appium/settings"): lambda _: {"snapshotMaxDepth": 50},
+            ("POST", "/appium/settings"): lambda payload: payload["settings"],
+            ("POST", "/wda/keys"): ok,
+            ("POST", "/wda/tap"): ok,
+            ("POST", "/wda/tap/0"): ok,
+            ("POST", "/wda/touchAndHold"): ok,
+            ("POST", "/wda/dragfromtoforduration"): ok,
+            ("POST", "/wda/swipe"): ok,
+            ("POST", "/wda/pressButton"): ok,
+            ("POST", "/wda/performIoHidEvent"): ok,
+            ("POST", "/wda/keyboard/dismiss"): ok,
+            ("POST", "/actions"): ok,
+            ("GET", "/alert/text"): lambda _: self._alert(),
+            ("GET", "/wda/alert/buttons"): lambda _: self._alert() and ["Cancel", "OK"],
+            ("POST", "/alert/accept"): lambda _: self._close_alert(),
+            ("POST", "/alert/dismiss"): lambda _: self._close_alert(),
+        }
+
+    def _create_session(self, payload: typing.Any) -> dict:
+        with self._lock:
+            self.session_id = str(uuid.uuid4()).upper()
+        return {"sessionId": self.session_id, "capabilities": {}}
+
+    def _screenshot(self, payload: typing.Any) -> str:
+        png = make_png(self.screenshot_size) if self.screenshot_size else b"\x89PNG\r\n\x1a\n"
+        return base64.b64encode(png).decode()
+
+    def _source(self, payload: typing.Any) -> typing.Union[str, dict]:
+        if self.source is not None:
+            return self.source()
+        if payload and payload.get("format") == "json":
+            return make_source_json(self.source_size)
+        return make_source(self.source_size)
+
+    def _set_pasteboard(self, payload: typing.Any):
+        self.pasteboard = base64.b64decode(payload["content"])
+
+    def _alert(self) -> str:
+        if self.alert_text is None:
+            raise LookupError("An attempt was made to operate on a modal dialog when one was not open")
+        return self.alert_text
+
+    def _close_alert(self):
+        self._alert()
+        self.alert_text = None
+
+    def _handler_class(self):
+        wda = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, avoid the Nagle and delayed ACK stall
+            disable_nagle_algorithm = True
+
+            def _serve(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length)) if length else None
+                status, data = wda.handle(method, self.path, payload)
+                if wda._drop_response():
+                    self.close_connection = True
+                    return
+                if method == "POST" and self.path == "/session" and status == 200:
+                    data["sessionId"] = data["value"]["sessionId"]
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_DELETE(self):
+                self._serve("DELETE")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
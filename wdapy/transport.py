@@ -0,0 +1,193 @@
+# coding: utf-8
+#
+"""
+Record WDA traffic to a file and replay it without a device
+
+Usage:
+    c = AppiumClient()
+    c.transport = RecordingTransport("wda.jsonl")
+    c.tap(100, 200)  # sent to WDA and appended to wda.jsonl
+
+    c = AppiumClient("http://replay")
+    c.transport = ReplayTransport("wda.jsonl")  # realtime=True sleeps the recorded latency
+    c.tap(100, 200)  # served from wda.jsonl
+
+File format: one JSON object per line, appended as exchanges complete
+    {"t": 1700000000.123, "m": "GET", "p": "/status", "q": null, "s": 200, "d": 0.012, "b": "{...}"}
+    t: wall time  m: method  p: urlpath  q: payload  s: status  d: seconds  b: body (text)
+    "e": base64 body when not utf-8, "x": ["ExceptionName", "message"] when the exchange failed
+"""
+
+from __future__ import annotations
+
+__all__ = ["Transport", "RecordingTransport", "ReplayTransport"]
+
+import asyncio
+import base64
+import builtins
+import collections
+import json
+import threading
+import time
+import typing
+
+from wdapy import exceptions
+from wdapy._base import HTTPResponseWrapper
+from wdapy._metrics import normalize_endpoint
+from wdapy.exceptions import RequestError
+from wdapy.usbmux import exceptions as usbmux_exceptions
+
+Send = typing.Callable[[], HTTPResponseWrapper]
+AsyncSend = typing.Callable[[], typing.Awaitable[HTTPResponseWrapper]]
+
+
+class Transport:
+    """ wraps the raw HTTP exchange of a client, see client.transport """
+
+    def request(self, method: str, urlpath: str, payload: typing.Any, send: Send) -> HTTPResponseWrapper:
+        return send()
+
+    async def arequest(self, method: str, urlpath: str, payload: typing.Any, send: AsyncSend) -> HTTPResponseWrapper:
+        return await send()
+
+    def close(self):
+        pass
+
+
+class RecordingTransport(Transport):
+    """ pass requests to WDA and append every exchange to path """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fp = open(path, "ab")
+
+    def request(self, method: str, urlpath: str, payload: typing.Any, send: Send) -> HTTPResponseWrapper:
+        start, wall = time.perf_counter(), time.time()
+        try:
+            resp = send()
+        except Exception as e:
+            self._write(wall, method, urlpath, payload, time.perf_counter() - start, error=e)
+            raise
+        self._write(wall, method, urlpath, payload, time.perf_counter() - start, resp=resp)
+        return resp
+
+    async def arequest(self, method: str, urlpath: str, payload: typing.Any, send: AsyncSend) -> HTTPResponseWrapper:
+        start, wall = time.perf_counter(), time.time()
+        try:
+            resp = await send()
+        except Exception as e:
+            self._write(wall, method, urlpath, payload, time.perf_counter() - start, error=e)
+            raise
+        self._write(wall, method, urlpath, payload, time.perf_counter() - start, resp=resp)
+        return resp
+
+    def _write(self, wall: float, method: str, urlpath: str, payload: typing.Any, elapsed: float,
+               resp: typing.Optional[HTTPResponseWrapper] = None, error: typing.Optional[BaseException] = None):
+        item = {"t": round(wall, 3), "m": method, "p": urlpath, "q": payload, "d": round(elapsed, 6)}
+        if resp is not None:
+            item["s"] = resp.status_code
+            try:
+                item["b"] = bytes(resp.content).decode("utf-8")
+            except UnicodeDecodeError:
+                item["e"] = base64.b64encode(resp.content).decode()
+        else:
+            item["x"] = [type(error).__name__, str(error)]
+        line = json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            self._fp.write(line)
+            self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+def _payload_key(payload: typing.Any) -> str:
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"))
+
+
+def _make_error(name: str, message: str) -> BaseException:
+    for module in (exceptions, usbmux_exceptions, builtins):
+        cls = getattr(module, name, None)
+        if isinstance(cls, type) and issubclass(cls, Exception):
+            try:
+                return cls(message)
+            except TypeError:
+                break
+    return RequestError(f"{name}: {message}")
+
+
+class ReplayTransport(Transport):
+    """ serve recorded exchanges, nothing is sent
+
+    Each request takes the next recorded exchange with the same method, urlpath and payload,
+    then falls back to the same method and endpoint (session and element ids normalized) with any payload.
+    When all matching exchanges were served, the last one is served again.
+    """
+
+    def __init__(self, path: str, realtime: bool = False, speed: float = 1.0):
+        """
+        Args:
+            realtime: sleep the recorded duration of each exchange, divided by speed
+        """
+        self.realtime = realtime
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._exact: typing.Dict[tuple, typing.Deque[dict]] = collections.defaultdict(collections.deque)
+        self._loose: typing.Dict[tuple, typing.Deque[dict]] = collections.defaultdict(collections.deque)
+        self._last: typing.Dict[tuple, dict] = {}
+        self.served = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                self._exact[(item["m"], item["p"], _payload_key(item.get("q")))].append(item)
+                self._loose[(item["m"], normalize_endpoint(item["p"]))].append(item)
+
+    def __len__(self) -> int:
+        """ number of exchanges not served yet """
+        return sum(1 for q in self._exact.values() for item in q if not item.get("_served"))
+
+    def _next(self, method: str, urlpath: str, payload: typing.Any) -> dict:
+        exact_key = (method, urlpath, _payload_key(payload))
+        loose_key = (method, normalize_endpoint(urlpath))
+        with self._lock:
+            self.served += 1
+            for key, queues in ((exact_key, self._exact), (loose_key, self._loose)):
+                queue = queues.get(key)
+                # every item is in both indexes, skip the ones served through the other
+                while queue and queue[0].get("_served"):
+                    queue.popleft()
+                if queue:
+                    item = queue.popleft()
+                    item["_served"] = True
+                    self._last[exact_key] = self._last[loose_key] = item
+                    return item
+            for key in (exact_key, loose_key):
+                if key in self._last:
+                    return self._last[key]
+        raise RequestError(f"no recorded exchange for {method} {urlpath}")
+
+    @staticmethod
+    def _response(item: dict) -> HTTPResponseWrapper:
+        if "x" in item:
+            raise _make_error(*item["x"])
+        if "e" in item:
+            content = base64.b64decode(item["e"])
+        else:
+            content = item["b"].encode("utf-8")
+        return HTTPResponseWrapper(content, item["s"])
+
+    def request(self, method: str, urlpath: str, payload: typing.Any, send: Send) -> HTTPResponseWrapper:
+        item = self._next(method, urlpath, payload)
+        if self.realtime:
+            time.sleep(item["d"] / self.speed)
+        return self._response(item)
+
+    async def arequest(self, method: str, urlpath: str, payload: typing.Any, send: AsyncSend) -> HTTPResponseWrapper:
+        item = self._next(method, urlpath, payload)
+        if self.realtime:
+            await asyncio.sleep(item["d"] / self.speed)
+        return self._response(item)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Usage:
+    python -m wdapy.usbmux forward 8100 9100  # localhost:8100 -> device:8100, localhost:9100 -> device:9100
+    python -m wdapy.usbmux forward 18100:8100 --udid 00008101-... --usbmux-address /var/run/usbmuxd
+"""
+
+import argparse
+import logging
+import signal
+import sys
+import threading
+from typing import Tuple
+
+from wdapy.usbmux.forward import Forwarder
+
+
+def parse_port_pair(value: str) -> Tuple[int, int]:
+    """ "LOCAL:DEVICE" or "PORT" for the same port on both sides """
+    local, _, device = value.partition(":")
+    try:
+        return int(local), int(device or local)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid port pair: {value!r}")
+
+
+def forward(args: argparse.Namespace):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    with Forwarder(args.udid, args.usbmux_address, host=args.host) as forwarder:
+        for local_port, device_port in args.ports:
+            port = forwarder.add(local_port, device_port)
+            print(f"forward {args.host}:{port} -> {args.udid or 'first device'}:{device_port}", flush=True)
+        try:
+            stop.wait()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m wdapy.usbmux")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p = subparsers.add_parser("forward", help="forward local TCP ports to device ports")
+    p.add_argument("ports", nargs="+", type=parse_port_pair, metavar="LOCAL[:DEVICE]")
+    p.add_argument("-u", "--udid", help="device udid, default the first device")
+    p.add_argument("--usbmux-address", help="usbmuxd unix socket path or host:port")
+    p.add_argument("--host", default="127.0.0.1", help="local address to listen on")
+    p.add_argument("-v", "--verbose", action="store_true", help="log every tunnel opened")
+    args = parser.parse_args(argv)
+
+    # closed tunnels are logged at info level with their throughput
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == "forward":
+        forward(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
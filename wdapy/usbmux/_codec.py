@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Precompiled struct codec for usbmuxd packets
+
+tests/test_usbmux.py cross-checks it against a construct description of the same layout
+when construct is installed.
+"""
+
+import plistlib
+import struct
+from typing import Callable, Mapping, NamedTuple, Tuple, Union
+
+VERSION_BINARY = 0
+VERSION_PLIST = 1
+
+MSG_RESULT = 1
+MSG_CONNECT = 2
+MSG_LISTEN = 3
+MSG_ADD = 4
+MSG_REMOVE = 5
+MSG_PAIRED = 6
+MSG_PLIST = 8
+
+RESULT_OK = 0
+RESULT_BADCOMMAND = 1
+RESULT_BADDEV = 2
+RESULT_CONNREFUSED = 3
+RESULT_BADVERSION = 6
+
+HEADER = struct.Struct('<IIII')  # length (header included), version, message, tag
+CONNECT = struct.Struct('<IHH')  # device_id, port (network order), reserved
+RESULT = struct.Struct('<I')
+DEVICE_RECORD = struct.Struct('<IH256s2xI')  # device_id, product_id, serial_number, location
+REMOVE = struct.Struct('<I')
+
+PLIST_CLIENT_INFO = {'ClientVersionString': 'qt4i-usbmuxd', 'ProgName': 'pymobiledevice3', 'kLibUSBMuxVersion': 3}
+
+
+class Header(NamedTuple):
+    version: int
+    message: int
+    tag: int
+
+
+class Result(NamedTuple):
+    result: int
+
+
+class DeviceRecord(NamedTuple):
+    device_id: int
+    product_id: int
+    serial_number: str
+    location: int
+
+
+class Removed(NamedTuple):
+    device_id: int
+
+
+class Packet(NamedTuple):
+    header: Header
+    # plist and unknown messages keep the raw body
+    data: Union[Result, DeviceRecord, Removed, bytes]
+
+
+def build(version: int, message: int, tag: int, body: bytes = b'') -> bytes:
+    return HEADER.pack(HEADER.size + len(body), version, message, tag) + body
+
+
+def build_connect(version: int, tag: int, device_id: int, port: int) -> bytes:
+    """ port is in network byte order, as usbmuxd expects it """
+    return build(version, MSG_CONNECT, tag, CONNECT.pack(device_id, port, 0))
+
+
+def build_plist(tag: int, data: Mapping) -> bytes:
+    request = dict(PLIST_CLIENT_INFO)
+    request.update(data)
+    return build(VERSION_PLIST, MSG_PLIST, tag, plistlib.dumps(request))
+
+
+def parse_header(buf: bytes) -> Tuple[int, Header]:
+    """ return (body length, header) of the first 16 bytes of a packet """
+    length, version, message, tag = HEADER.unpack_from(buf)
+    return length - HEADER.size, Header(version, message, tag)
+
+
+def parse_body(header: Header, body: bytes) -> Packet:
+    message = header.message
+    if message == MSG_RESULT:
+        data = Result(*RESULT.unpack_from(body))
+    elif message == MSG_ADD:
+        device_id, product_id, serial, location = DEVICE_RECORD.unpack_from(body)
+        data = DeviceRecord(device_id, product_id, serial.split(b'\0', 1)[0].decode('ascii'), location)
+    elif message == MSG_REMOVE:
+        data = Removed(*REMOVE.unpack_from(body))
+    else:
+        data = body
+    return Packet(header, data)
+
+
+def parse(packet: bytes) -> Packet:
+    length, header = parse_header(packet)
+    return parse_body(header, packet[HEADER.size:HEADER.size + length])
+
+
+def read_packet(read: Callable[[int], bytes]) -> Packet:
+    """ read one packet with read(size), which returns exactly size bytes """
+    length, header = parse_header(read(HEADER.size))
+    return parse_body(header, read(length) if length > 0 else b'')
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+asyncio version of the usbmuxd plist protocol (same packets as PlistMuxConnection)
+
+Only the plist protocol is implemented, which usbmuxd on macOS, Windows and current Linux
+speaks. An old binary only daemon is reported as MuxVersionError, use the sync clients
+with it (wdapy.usbmux.pyusbmux negotiates the protocol).
+"""
+
+import asyncio
+import plistlib
+import socket
+import sys
+from typing import List, Mapping, Optional, Tuple
+
+from wdapy.usbmux import _codec
+from wdapy.usbmux.exceptions import BadCommandError, BadDevError, MuxConnectError, \
+    MuxConnectToUsbmuxdError, MuxError, MuxVersionError
+from wdapy.usbmux import pyusbmux
+from wdapy.usbmux.pyusbmux import COMPLETE, FAST, LISTEN_QUIET, MuxConnection, MuxDevice, pick_device
+
+Stream = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+async def open_usbmux_stream(usbmux_address: Optional[str] = None) -> Stream:
+    try:
+        if usbmux_address is not None:
+            if ':' in usbmux_address:
+                # assume tcp address
+                hostname, port = usbmux_address.split(':')
+                return await asyncio.open_connection(hostname, int(port))
+            # assume unix domain address
+            return await asyncio.open_unix_connection(usbmux_address)
+        if sys.platform in ['win32', 'cygwin']:
+            return await asyncio.open_connection(*MuxConnection.ITUNES_HOST)
+        return await asyncio.open_unix_connection(MuxConnection.USBMUXD_PIPE)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise MuxConnectToUsbmuxdError()
+
+
+class AsyncMuxConnection:
+    """ asyncio version of PlistMuxConnection """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        # after "Connect", the stream belongs to the device service
+        self._connected = False
+        self._tag = 1
+        self.devices: List[MuxDevice] = []
+
+    @classmethod
+    async def create(cls, usbmux_address: Optional[str] = None) -> "AsyncMuxConnection":
+        reader, writer = await open_usbmux_stream(usbmux_address)
+        return cls(reader, writer)
+
+    async def get_device_list(self, timeout: float, quiet: Optional[float] = None) -> None:
+        """ collect Attached/Detached events for timeout seconds, see MuxConnection._collect_device_events """
+        self.devices = []
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await self._send_receive({'MessageType': 'Listen'})
+        now = last = loop.time()
+        end = now + timeout
+        window = MuxConnection._first_window(quiet, now - start)
+        while (remaining := end - now) > 0:
+            if quiet is not None:
+                idle = last + window - now
+                if idle <= 0:
+                    break
+                remaining = min(remaining, idle)
+            try:
+                response = await asyncio.wait_for(self._receive(), remaining)
+            except asyncio.TimeoutError:
+                # either the whole timeout or the quiet window is over
+                break
+            now = loop.time()
+            if quiet is not None:
+                window = max(window, 3 * (now - last))
+            last = now
+            if response['MessageType'] == 'Attached':
+                self.devices.append(MuxDevice(response['DeviceID'], response['Properties']['SerialNumber'],
+                                              response['Properties']['ConnectionType']))
+            elif response['MessageType'] == 'Detached':
+                self.devices = [device for device in self.devices if device.devid != response['DeviceID']]
+            else:
+                raise MuxError(f'Invalid packet type received: {response}')
+
+    async def read_device_list(self) -> List[MuxDevice]:
+        """ get the whole device list in one reply, raise BadCommandError when usbmuxd does not support it """
+        await self._send({'MessageType': 'ListDevices'})
+        response = await self._receive(self._tag - 1)
+        if 'DeviceList' not in response:
+            self._check_result(response)
+            raise MuxError(f'got an invalid message: {response}')
+        self.devices = [MuxDevice(item['DeviceID'], item['Properties']['SerialNumber'],
+                                  item['Properties']['ConnectionType']) for item in response['DeviceList']]
+        return self.devices
+
+    async def connect(self, device: MuxDevice, port: int) -> Stream:
+        """ connect to a relay port on target machine, the returned stream is tunneled to the device """
+        await self._send_receive({'MessageType': 'Connect', 'DeviceID': device.devid, 'PortNumber': socket.htons(port)})
+        self._connected = True
+        return self._reader, self._writer
+
+    def close(self):
+        self._writer.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def _send(self, data: Mapping):
+        if self._connected:
+            raise MuxError('Mux is connected, cannot issue control packets')
+        self._writer.write(_codec.build_plist(self._tag, data))
+        await self._writer.drain()
+        self._tag += 1
+
+    async def _receive(self, expected_tag: Optional[int] = None) -> Mapping:
+        try:
+            length, header = _codec.parse_header(await self._reader.readexactly(_codec.HEADER.size))
+            body = await self._reader.readexactly(length) if length > 0 else b''
+        except asyncio.IncompleteReadError:
+            raise MuxError('socket connection broken')
+        response = _codec.parse_body(header, body)
+        if expected_tag and response.header.tag != expected_tag:
+            raise MuxError(f'Reply tag mismatch: expected {expected_tag}, got {response.header.tag}')
+        if response.header.message == _codec.MSG_RESULT and response.header.version == _codec.VERSION_BINARY:
+            # a binary only usbmuxd rejects plist packets
+            raise MuxVersionError(f'usbmuxd does not speak plist, use the sync client: {response}')
+        if response.header.message != _codec.MSG_PLIST:
+            raise MuxError(f'Received non-plist type {response}')
+        return plistlib.loads(response.data)
+
+    async def _send_receive(self, data: Mapping):
+        await self._send(data)
+        response = await self._receive(self._tag - 1)
+        if response['MessageType'] != 'Result':
+            raise MuxError(f'got an invalid message: {response}')
+        self._check_result(response)
+
+    @staticmethod
+    def _check_result(response: Mapping):
+        if response.get('MessageType') == 'Result' and response.get('Number'):
+            exceptions = {1: BadCommandError, 2: BadDevError, 3: MuxConnectError, 6: MuxVersionError}
+            raise exceptions.get(response['Number'], MuxError)(f'got an error message: {response}')
+
+
+async def list_devices(usbmux_address: Optional[str] = None, mode: str = FAST, timeout: float = 1.0) \
+        -> List[MuxDevice]:
+    """ see wdapy.usbmux.pyusbmux.list_devices """
+    if mode not in (FAST, COMPLETE):
+        raise ValueError(f'unknown mode: {mode}')
+    watcher = pyusbmux._watchers.get(usbmux_address)
+    if watcher is not None and watcher.ready:
+        return watcher.devices
+    async with await AsyncMuxConnection.create(usbmux_address) as mux:
+        if mode == COMPLETE:
+            await mux.get_device_list(timeout)
+            return mux.devices
+        if usbmux_address not in pyusbmux._list_devices_unsupported:
+            try:
+                return await mux.read_device_list()
+            except BadCommandError:
+                pyusbmux._list_devices_unsupported.add(usbmux_address)
+        await mux.get_device_list(timeout, quiet=LISTEN_QUIET)
+        return mux.devices
+
+
+async def select_device(udid: Optional[str] = None, connection_type: Optional[str] = None,
+                        usbmux_address: Optional[str] = None, mode: str = FAST) -> Optional[MuxDevice]:
+    return pick_device(await list_devices(usbmux_address, mode=mode), udid, connection_type)
+
+
+async def connect(device: MuxDevice, port: int, usbmux_address: Optional[str] = None) -> Stream:
+    mux = await AsyncMuxConnection.create(usbmux_address)
+    try:
+        return await mux.connect(device, port)
+    except:  # noqa: E722
+        mux.close()
+        raise
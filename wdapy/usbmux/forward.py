@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Forward local TCP ports to device ports through usbmux, like iproxy
+
+One selector thread pumps every tunnel with a single reusable buffer; tunnels to the device
+are opened in a small thread pool, so a slow usbmuxd never stalls the connections already running.
+Forwarded ports never use prefetched tunnels (wdapy.usbmux.tunnels): a service that speaks first,
+like an ssh banner, makes every idle tunnel look stale.
+
+Usage:
+    with Forwarder(udid="00008101-...") as fwd:
+        fwd.add(8100)  # localhost:8100 -> device:8100
+        port = fwd.add(0, 9100)  # any free local port -> device:9100
+        ...
+        for tunnel in fwd.tunnels:
+            print(tunnel.client, tunnel.bytes_sent, tunnel.bytes_received, tunnel.throughput)
+
+    python -m wdapy.usbmux forward 8100 9100:9100 --udid 00008101-...
+"""
+
+import collections
+import logging
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from wdapy.usbmux.exceptions import BadDevError, MuxError
+from wdapy.usbmux.pyusbmux import MuxDevice, select_device
+from wdapy.usbmux.registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 256 * 1024
+CONNECT_TIMEOUT = 10.0
+MAX_CLOSED_TUNNELS = 100
+
+
+@dataclass
+class TunnelStats:
+    id: int
+    client: Tuple[str, int]
+    local_port: int
+    device_port: int
+    serial: str = ""
+    bytes_sent: int = 0  # to device
+    bytes_received: int = 0  # from device
+    started: float = field(default_factory=time.monotonic)
+    ended: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.ended or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """ bytes per second, both directions """
+        return (self.bytes_sent + self.bytes_received) / max(self.duration, 1e-6)
+
+
+class _Pipe:
+    """ one direction of a tunnel """
+
+    def __init__(self, src: socket.socket, dst: socket.socket):
+        self.src = src
+        self.dst = dst
+        self.pending = b''  # read from src, not yet accepted by dst
+        self.eof = False
+        self.count = 0
+
+    @property
+    def readable(self) -> bool:
+        # stop reading while dst is full, the peer slows down instead of us buffering
+        return not self.eof and not self.pending
+
+
+class _Tunnel:
+    def __init__(self, stats: TunnelStats, client: socket.socket, device: socket.socket):
+        self.stats = stats
+        self.client = client
+        self.device = device
+        self.up = _Pipe(client, device)
+        self.down = _Pipe(device, client)
+        self.handler: Optional[Callable[[socket.socket, int], None]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.up.eof and self.down.eof and not self.up.pending and not self.down.pending
+
+
+class Forwarder:
+    """ relay local TCP connections to device ports """
+
+    def __init__(self, udid: Optional[str] = None, usbmux_address: Optional[str] = None,
+                 host: str = "127.0.0.1", buffer_size: int = BUFFER_SIZE, connect_workers: int = 4):
+        """
+        Args:
+            udid: device to forward to, the first device when None; resolved for every connection
+            host: local address to listen on
+            buffer_size: bytes read from a socket at a time
+            connect_workers: threads opening tunnels to the device
+        """
+        self.udid = udid
+        self.usbmux_address = usbmux_address
+        self.host = host
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._selector = selectors.DefaultSelector()
+        self._executor = ThreadPoolExecutor(connect_workers, thread_name_prefix="usbmux-forward-connect")
+        self._lock = threading.Lock()
+        self._calls: Deque[Callable[[], None]] = collections.deque()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._listeners: Dict[int, Tuple[socket.socket, int]] = {}  # local port -> (socket, device port)
+        self._tunnels: Dict[int, _Tunnel] = {}
+        self._closed_tunnels: Deque[TunnelStats] = collections.deque(maxlen=MAX_CLOSED_TUNNELS)
+        self._next_id = 0
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ports(self) -> Dict[int, int]:
+        """ local port -> device port """
+        with self._lock:
+            return {port: device_port for port, (_, device_port) in self._listeners.items()}
+
+    @property
+    def tunnels(self) -> List[TunnelStats]:
+        """ open tunnels """
+        with self._lock:
+            return [t.stats for t in self._tunnels.values()]
+
+    @property
+    def closed_tunnels(self) -> List[TunnelStats]:
+        """ the last MAX_CLOSED_TUNNELS closed tunnels """
+        with self._lock:
+            return list(self._closed_tunnels)
+
+    def add(self, local_port: int, device_port: Optional[int] = None) -> int:
+        """ forward local_port (0 for any free port) to device_port (default the same port)
+
+        Returns:
+            the local port
+        """
+        if device_port is None:
+            device_port = local_port
+        server = socket.create_server((self.host, local_port), backlog=128)
+        server.setblocking(False)
+        port = server.getsockname()[1]
+        with self._lock:
+            self._listeners[port] = (server, device_port)
+        self._call_soon(lambda: self._selector.register(server, selectors.EVENT_READ, self._accept))
+        return port
+
+    def remove(self, local_port: int):
+        """ stop listening on local_port, open tunnels are kept """
+        with self._lock:
+            server, _ = self._listeners.pop(local_port)
+
+        def unregister():
+            self._selector.unregister(server)
+            server.close()
+
+        self._call_soon(unregister)
+
+    def start(self) -> "Forwarder":
+        self._thread = threading.Thread(target=self.serve_forever, name="usbmux-forward", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        while not self._stop:
+            for key, mask in self._selector.select():
+                callback = key.data
+                if callback is None:
+                    self._run_calls()
+                else:
+                    callback(key.fileobj, mask)
+        self._shutdown()
+
+    def close(self):
+        self._stop = True
+        self._executor.shutdown(wait=False)
+        if self._thread is None:
+            self._shutdown()
+            return
+        self._wakeup()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __enter__(self) -> "Forwarder":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _call_soon(self, fn: Callable[[], None]):
+        """ run fn in the selector thread """
+        with self._lock:
+            self._calls.append(fn)
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # already pending, or closed
+
+    def _run_calls(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            with self._lock:
+                if not self._calls:
+                    return
+                fn = self._calls.popleft()
+            fn()
+
+    def _accept(self, server: socket.socket, mask: int):
+        try:
+            client, address = server.accept()
+        except BlockingIOError:
+            return
+        local_port = server.getsockname()[1]
+        with self._lock:
+            listener = self._listeners.get(local_port)
+        if listener is None:  # being removed
+            client.close()
+            return
+        device_port = listener[1]
+        self._next_id += 1
+        stats = TunnelStats(self._next_id, address, local_port, device_port)
+        self._executor.submit(self._open_tunnel, stats, client)
+
+    def _resolve_device(self) -> MuxDevice:
+        if self.udid:
+            return get_registry(self.usbmux_address).resolve(self.udid)
+        device = select_device(usbmux_address=self.usbmux_address)
+        if device is None:
+            raise BadDevError("no device connected")
+        return device
+
+    def _open_tunnel(self, stats: TunnelStats, client: socket.socket):
+        # runs in the executor
+        try:
+            device = self._resolve_device()
+            stats.serial = device.serial
+            sock = device.connect(stats.device_port, usbmux_address=self.usbmux_address, timeout=CONNECT_TIMEOUT)
+        except (MuxError, OSError) as e:
+            logger.warning("tunnel #%d %s:%d -> device:%d failed: %s", stats.id, *stats.client, stats.device_port, e)
+            client.close()
+            return
+        if self._stop:
+            client.close()
+            sock.close()
+            return
+        self._call_soon(lambda: self._start_tunnel(_Tunnel(stats, client, sock)))
+
+    def _start_tunnel(self, tunnel: _Tunnel):
+        if self._stop:
+            tunnel.client.close()
+            tunnel.device.close()
+            return
+        tunnel.client.setblocking(False)
+        tunnel.device.setblocking(False)
+        with self._lock:
+            self._tunnels[tunnel.stats.id] = tunnel
+        tunnel.handler = self._make_handler(tunnel)
+        for sock in (tunnel.client, tunnel.device):
+            self._selector.register(sock, selectors.EVENT_READ, tunnel.handler)
+        logger.debug("tunnel #%d %s:%d -> %s:%d opened", tunnel.stats.id, *tunnel.stats.client,
+                     tunnel.stats.serial, tunnel.stats.device_port)
+
+    def _make_handler(self, tunnel: _Tunnel) -> Callable[[socket.socket, int], None]:
+        def handle(sock: socket.socket, mask: int):
+            if tunnel.stats.ended is not None:
+                return  # closed by an earlier event of the same select() round
+            try:
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(tunnel.up if sock is tunnel.device else tunnel.down)
+                if mask & selectors.EVENT_READ:
+                    self._pump(tunnel.up if sock is tunnel.client else tunnel.down)
+            except OSError as e:
+                logger.debug("tunnel #%d broken: %s", tunnel.stats.id, e)
+                self._close_tunnel(tunnel)
+                return
+            tunnel.stats.bytes_sent = tunnel.up.count
+            tunnel.stats.bytes_received = tunnel.down.count
+            if tunnel.done:
+                self._close_tunnel(tunnel)
+            else:
+                self._update(tunnel)
+        return handle
+
+    def _pump(self, pipe: _Pipe):
+        if not pipe.readable:
+            return
+        n = pipe.src.recv_into(self._buf)
+        if n == 0:
+            pipe.eof = True
+            pipe.dst.shutdown(socket.SHUT_WR)
+            return
+        pipe.count += n
+        try:
+            sent = pipe.dst.send(self._view[:n])
+        except BlockingIOError:
+            sent = 0
+        if sent < n:
+            # the shared buffer is reused by the next read, keep the rest aside
+            pipe.pending = bytes(self._view[sent:n])
+
+    def _flush(self, pipe: _Pipe):
+        if not pipe.pending:
+            return
+        try:
+            sent = pipe.dst.send(pipe.pending)
+        except BlockingIOError:
+            return
+        pipe.pending = pipe.pending[sent:]
+
+    def _update(self, tunnel: _Tunnel):
+        # reads from src only while its data can be written to dst; writes wait for dst when data is pending
+        for sock, inbound, outbound in ((tunnel.client, tunnel.up, tunnel.down),
+                                        (tunnel.device, tunnel.down, tunnel.up)):
+            events = (selectors.EVENT_READ if inbound.readable else 0) | \
+                     (selectors.EVENT_WRITE if outbound.pending else 0)
+            try:
+                key = self._selector.get_key(sock)
+            except KeyError:
+                if events:
+                    self._selector.register(sock, events, tunnel.handler)
+                continue
+            if events == key.events:
+                continue
+            if events:
+                self._selector.modify(sock, events, key.data)
+            else:
+                # read side at EOF and nothing to write, wait for the other direction only
+                self._selector.unregister(sock)
+
+    def _close_tunnel(self, tunnel: _Tunnel):
+        stats = tunnel.stats
+        with self._lock:
+            if self._tunnels.pop(stats.id, None) is None:
+                return
+            stats.ended = time.monotonic()
+            self._closed_tunnels.append(stats)
+        for sock in (tunnel.client, tunnel.device):
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            sock.close()
+        logger.info("tunnel #%d %s:%d -> %s:%d closed, %d bytes sent, %d bytes received in %.2fs, %.1f KB/s",
+                    stats.id, *stats.client, stats.serial, stats.device_port, stats.bytes_sent,
+                    stats.bytes_received, stats.duration, stats.throughput / 1024)
+
+    def _shutdown(self):
+        with self._lock:
+            listeners = [server for server, _ in self._listeners.values()]
+            self._listeners.clear()
+            open_tunnels = list(self._tunnels.values())
+        for tunnel in open_tunnels:
+            self._close_tunnel(tunnel)
+        for server in listeners:
+            server.close()
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
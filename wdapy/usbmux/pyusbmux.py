@@ -7,82 +7,20 @@ import abc
 import plistlib
 import socket
 import sys
+import threading
 import time
 from dataclasses import dataclass
 from http.client import HTTPConnection
-from typing import List, Mapping, Optional
-
-from construct import Const, CString, Enum, FixedSized, GreedyBytes, Int16ul, Int32ul, Padding, Prefixed, StreamError, \
-    Struct, Switch, this
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Tuple, Union
 
+from wdapy.usbmux import _codec, tunnels
+from wdapy.usbmux._codec import VERSION_BINARY, VERSION_PLIST
 from wdapy.usbmux.exceptions import BadCommandError, BadDevError, MuxConnectError, \
     MuxConnectToUsbmuxdError, MuxError, MuxVersionError, NotPairedError
 
-usbmuxd_version = Enum(Int32ul,
-                       BINARY=0,
-                       PLIST=1,
-                       )
-
-usbmuxd_result = Enum(Int32ul,
-                      OK=0,
-                      BADCOMMAND=1,
-                      BADDEV=2,
-                      CONNREFUSED=3,
-                      BADVERSION=6,
-                      )
-
-usbmuxd_msgtype = Enum(Int32ul,
-                       RESULT=1,
-                       CONNECT=2,
-                       LISTEN=3,
-                       ADD=4,
-                       REMOVE=5,
-                       PAIRED=6,
-                       PLIST=8,
-                       )
-
-usbmuxd_header = Struct(
-    'version' / usbmuxd_version,  # protocol version
-    'message' / usbmuxd_msgtype,  # message type
-    'tag' / Int32ul,  # responses to this query will echo back this tag
-)
-
-usbmuxd_request = Prefixed(Int32ul, Struct(
-    'header' / usbmuxd_header,
-    'data' / Switch(this.header.message, {
-        usbmuxd_msgtype.CONNECT: Struct(
-            'device_id' / Int32ul,
-            'port' / Int16ul,  # TCP port number
-            'reserved' / Const(0, Int16ul),
-        ),
-        usbmuxd_msgtype.PLIST: GreedyBytes,
-    }),
-), includelength=True)
-
-usbmuxd_device_record = Struct(
-    'device_id' / Int32ul,
-    'product_id' / Int16ul,
-    'serial_number' / FixedSized(256, CString('ascii')),
-    Padding(2),
-    'location' / Int32ul
-)
-
-usbmuxd_response = Prefixed(Int32ul, Struct(
-    'header' / usbmuxd_header,
-    'data' / Switch(this.header.message, {
-        usbmuxd_msgtype.RESULT: Struct(
-            'result' / usbmuxd_result,
-        ),
-        usbmuxd_msgtype.ADD: usbmuxd_device_record,
-        usbmuxd_msgtype.REMOVE: Struct(
-            'device_id' / Int32ul,
-        ),
-        usbmuxd_msgtype.PLIST: GreedyBytes,
-    }),
-), includelength=True)
-
-
-        
+if TYPE_CHECKING:
+    from wdapy.usbmux.watcher import DeviceWatcher
+
 
 @dataclass
 class MuxDevice:
@@ -90,8 +28,12 @@ class MuxDevice:
     serial: str
     connection_type: str
 
-    def connect(self, port: int, usbmux_address: Optional[str] = None) -> socket.socket:
-        mux = create_mux(usbmux_address=usbmux_address)
+    def connect(self, port: int, usbmux_address: Optional[str] = None, timeout: Optional[float] = None) -> socket.socket:
+        """
+        Args:
+            timeout: socket timeout used while talking to usbmuxd, kept on the returned socket
+        """
+        mux = create_mux(usbmux_address=usbmux_address, timeout=timeout)
         try:
             return mux.connect(self, port)
         except:  # noqa: E722
@@ -109,32 +51,91 @@ class MuxDevice:
     def matches_udid(self, udid: str) -> bool:
         return self.serial.replace('-', '') == udid.replace('-', '')
 
-    def make_http_connection(self, port: int) -> HTTPConnection:
-        return USBMuxHTTPConnection(self, port)
+    def make_http_connection(self, port: int, usbmux_address: Optional[str] = None) -> HTTPConnection:
+        return USBMuxHTTPConnection(self, port, usbmux_address=usbmux_address)
 
 
 class SafeStreamSocket:
-    """ wrapper to native python socket object to be used with construct as a stream """
+    """ wrapper to native python socket object to be read as a stream of packets
 
-    def __init__(self, address, family):
+    Reads go through an internal buffer filled with recv_into, so a packet usually costs one syscall.
+    Set readahead to False before handing self.sock to someone else, then only requested bytes are read.
+    """
+    BUFFER_SIZE = 65536
+
+    def __init__(self, address, family, timeout: Optional[float] = None):
         self._offset = 0
+        self._buf = bytearray(self.BUFFER_SIZE)
+        self._view = memoryview(self._buf)
+        self._start = self._end = 0
+        self.readahead = True
         self.sock = socket.socket(family, socket.SOCK_STREAM)
-        self.sock.connect(address)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(address)
+        except:  # noqa: E722
+            self.sock.close()
+            raise
 
     def send(self, msg: bytes) -> int:
         self._offset += len(msg)
         self.sock.sendall(msg)
         return len(msg)
 
+    @property
+    def pending(self) -> int:
+        """ number of bytes received but not consumed """
+        return self._end - self._start
+
     def recv(self, size: int) -> bytes:
-        msg = b''
-        while len(msg) < size:
-            chunk = self.sock.recv(size - len(msg))
-            self._offset += len(chunk)
-            if not chunk:
-                raise MuxError('socket connection broken')
-            msg += chunk
-        return msg
+        """ read exactly size bytes """
+        if self._end - self._start >= size:
+            start = self._start
+            self._start += size
+            self._offset += size
+            return bytes(self._view[start:self._start])
+        msg = bytearray(size)
+        self.readinto(msg)
+        return bytes(msg)
+
+    def readinto(self, b) -> int:
+        """ fill b completely, on timeout the bytes already read are kept for the next call """
+        view = memoryview(b).cast('B')
+        size = len(view)
+        got = min(self._end - self._start, size)
+        view[:got] = self._view[self._start:self._start + got]
+        self._start += got
+        try:
+            while got < size:
+                remaining = size - got
+                if remaining >= len(self._buf) or not self.readahead:
+                    # large reads go straight into the destination
+                    n = self.sock.recv_into(view[got:], remaining)
+                    if not n:
+                        raise MuxError('socket connection broken')
+                    got += n
+                    continue
+                n = self.sock.recv_into(self._buf)
+                if not n:
+                    raise MuxError('socket connection broken')
+                take = min(n, remaining)
+                view[got:got + take] = self._view[:take]
+                self._start, self._end = take, n
+                got += take
+        except (BlockingIOError, socket.timeout):
+            self.unread(view[:got])
+            raise
+        self._offset += size
+        return size
+
+    def unread(self, data) -> None:
+        """ put data back in front of the buffer """
+        merged = bytes(data) + self._view[self._start:self._end].tobytes()
+        if len(merged) > len(self._buf):
+            self._buf = bytearray(len(merged))
+            self._view = memoryview(self._buf)
+        self._buf[:len(merged)] = merged
+        self._start, self._end = 0, len(merged)
 
     def close(self) -> None:
         self.sock.close()
@@ -160,7 +161,7 @@ class MuxConnection:
     USBMUXD_PIPE = '/var/run/usbmuxd'
 
     @staticmethod
-    def create_usbmux_socket(usbmux_address: Optional[str] = None) -> SafeStreamSocket:
+    def create_usbmux_socket(usbmux_address: Optional[str] = None, timeout: Optional[float] = None) -> SafeStreamSocket:
         try:
             if usbmux_address is not None:
                 if ':' in usbmux_address:
@@ -180,35 +181,48 @@ class MuxConnection:
                 else:
                     address = MuxConnection.USBMUXD_PIPE
                     family = socket.AF_UNIX
-            return SafeStreamSocket(address, family)
-        except ConnectionRefusedError:
+            return SafeStreamSocket(address, family, timeout)
+        except (ConnectionRefusedError, FileNotFoundError):
             raise MuxConnectToUsbmuxdError()
 
     @staticmethod
-    def create(usbmux_address: Optional[str] = None):
-        # first attempt to connect with possibly the wrong version header (plist protocol)
-        sock = MuxConnection.create_usbmux_socket(usbmux_address=usbmux_address)
-
-        message = usbmuxd_request.build({
-            'header': {'version': usbmuxd_version.PLIST, 'message': usbmuxd_msgtype.PLIST, 'tag': 1},
-            'data': plistlib.dumps({'MessageType': 'ReadBUID'})
-        })
-        sock.send(message)
-        response = usbmuxd_response.parse_stream(sock)
-
-        # if we sent a bad request, we should re-create the socket in the correct version this time
-        sock.close()
-        sock = MuxConnection.create_usbmux_socket(usbmux_address=usbmux_address)
-
-        if response.header.version == usbmuxd_version.BINARY:
-            return BinaryMuxConnection(sock)
-        elif response.header.version == usbmuxd_version.PLIST:
-            return PlistMuxConnection(sock)
+    def probe_version(usbmux_address: Optional[str] = None, timeout: Optional[float] = None) -> int:
+        """ ask usbmuxd which protocol it speaks, costs one extra socket """
+        # connect with possibly the wrong version header (plist protocol)
+        sock = MuxConnection.create_usbmux_socket(usbmux_address=usbmux_address, timeout=timeout)
+        try:
+            sock.send(_codec.build_plist(1, {'MessageType': 'ReadBUID'}))
+            response = _codec.read_packet(sock.recv)
+        finally:
+            # if we sent a bad request, the socket can not be used any more
+            sock.close()
+        if response.header.version not in (VERSION_BINARY, VERSION_PLIST):
+            raise MuxVersionError(f'usbmuxd returned unsupported version: {response.header.version}')
+        return response.header.version
 
-        raise MuxVersionError(f'usbmuxd returned unsupported version: {response.version}')
+    @staticmethod
+    def create(usbmux_address: Optional[str] = None, timeout: Optional[float] = None, version: Optional[int] = None):
+        """
+        Args:
+            version: VERSION_BINARY or VERSION_PLIST, default is the pinned, cached or probed one
+        """
+        if version is None:
+            version = get_protocol_version(usbmux_address)
+        if version is None:
+            version = MuxConnection.probe_version(usbmux_address, timeout)
+            _cache_protocol_version(usbmux_address, version)
+
+        sock = MuxConnection.create_usbmux_socket(usbmux_address=usbmux_address, timeout=timeout)
+        if version == VERSION_BINARY:
+            return BinaryMuxConnection(sock, usbmux_address)
+        elif version == VERSION_PLIST:
+            return PlistMuxConnection(sock, usbmux_address)
+        sock.close()
+        raise MuxVersionError(f'unsupported usbmuxd protocol version: {version}')
 
-    def __init__(self, sock: SafeStreamSocket):
+    def __init__(self, sock: SafeStreamSocket, usbmux_address: Optional[str] = None):
         self._sock = sock
+        self.usbmux_address = usbmux_address
 
         # after initiating the "Connect" packet, this same socket will be used to transfer data into the service
         # residing inside the target device. when this happens, we can no longer send/receive control commands to
@@ -226,20 +240,83 @@ class MuxConnection:
         pass
 
     @abc.abstractmethod
-    def get_device_list(self, timeout: float = None):
+    def get_device_list(self, timeout: float = None, quiet: Optional[float] = None):
         """
         request an update to current device list
         """
         pass
 
+    @staticmethod
+    def _first_window(quiet: Optional[float], listen_time: float) -> Optional[float]:
+        # a busy daemon is slow to answer Listen too, give its first event as long
+        return None if quiet is None else max(quiet, 3 * listen_time)
+
+    def _collect_device_events(self, timeout: float, quiet: Optional[float] = None):
+        """ apply Attached/Detached events for timeout seconds
+
+        Args:
+            quiet: stop early when usbmuxd sent nothing for quiet seconds, the window grows to
+                3 times the largest gap seen so that a slow daemon is not cut off
+        """
+        now = time.time()
+        end = now + timeout
+        last = now
+        window = quiet
+        while (remaining := end - now) > 0:
+            if quiet is not None:
+                idle = last + window - now
+                if idle <= 0:
+                    break
+                remaining = min(remaining, idle)
+            self._sock.settimeout(remaining)
+            try:
+                self._receive_device_state_update()
+            except (BlockingIOError, socket.timeout):
+                now = time.time()
+                continue
+            except IOError:
+                try:
+                    self._sock.setblocking(True)
+                    self.close()
+                except OSError:
+                    pass
+                raise MuxError('Exception in listener socket')
+            now = time.time()
+            if quiet is not None:
+                window = max(window, 3 * (now - last))
+            last = now
+
+    @abc.abstractmethod
+    def receive_event(self) -> Tuple[str, Union[MuxDevice, int]]:
+        """
+        wait for the next event after listen()
+
+        Returns:
+            ("Attached", MuxDevice) or ("Detached", device_id), other message types come with the device id
+        """
+        pass
+
     def connect(self, device: MuxDevice, port: int) -> socket.socket:
         """ connect to a relay port on target machine and get a raw python socket object for the connection """
+        if self._sock.pending:
+            raise MuxError('Mux has unread packets, cannot connect')
+        # bytes after the Connect result belong to the device service, leave them in the socket
+        self._sock.readahead = False
         self._connect(device.devid, socket.htons(port))
         self._connected = True
         return self._sock.sock
 
+    def settimeout(self, timeout: Optional[float]):
+        self._sock.settimeout(timeout)
+
     def close(self):
         """ close current socket """
+        if not self._connected:
+            # wake up a thread blocked in receive, close alone does not
+            try:
+                self._sock.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
         self._sock.close()
 
     def _assert_not_connected(self):
@@ -249,12 +326,15 @@ class MuxConnection:
 
     def _raise_mux_exception(self, result: int, message: str = None):
         exceptions = {
-            int(usbmuxd_result.BADCOMMAND): BadCommandError,
-            int(usbmuxd_result.BADDEV): BadDevError,
-            int(usbmuxd_result.CONNREFUSED): MuxConnectError,
-            int(usbmuxd_result.BADVERSION): MuxVersionError,
+            _codec.RESULT_BADCOMMAND: BadCommandError,
+            _codec.RESULT_BADDEV: BadDevError,
+            _codec.RESULT_CONNREFUSED: MuxConnectError,
+            _codec.RESULT_BADVERSION: MuxVersionError,
         }
         exception = exceptions.get(result, MuxError)
+        if exception is MuxVersionError:
+            # usbmuxd was restarted or replaced, negotiate again on the next connection
+            forget_protocol_version(self.usbmux_address)
         raise exception(message)
 
     def __enter__(self):
@@ -267,69 +347,60 @@ class MuxConnection:
 class BinaryMuxConnection(MuxConnection):
     """ old binary protocol """
 
-    def __init__(self, sock: SafeStreamSocket):
-        super().__init__(sock)
-        self._version = usbmuxd_version.BINARY
+    def __init__(self, sock: SafeStreamSocket, usbmux_address: Optional[str] = None):
+        super().__init__(sock, usbmux_address)
+        self._version = _codec.VERSION_BINARY
 
-    def get_device_list(self, timeout: float = None):
-        """ use timeout to wait for the device list to be fully populated """
+    def get_device_list(self, timeout: float = None, quiet: Optional[float] = None):
+        """ use timeout to wait for the device list to be fully populated, quiet to return early """
         self._assert_not_connected()
-        end = time.time() + timeout
+        start = time.time()
         self.listen()
-        while time.time() < end:
-            self._sock.settimeout(end - time.time())
-            try:
-                self._receive_device_state_update()
-            except (BlockingIOError, StreamError):
-                continue
-            except IOError:
-                try:
-                    self._sock.setblocking(True)
-                    self.close()
-                except OSError:
-                    pass
-                raise MuxError('Exception in listener socket')
+        self._collect_device_events(timeout, self._first_window(quiet, time.time() - start))
 
     def listen(self):
         """ start listening for events of attached and detached devices """
-        self._send_receive(usbmuxd_msgtype.LISTEN)
+        self._send_receive(_codec.MSG_LISTEN)
 
     def _connect(self, device_id: int, port: int):
-        self._send({'header': {'version': self._version,
-                               'message': usbmuxd_msgtype.CONNECT,
-                               'tag': self._tag},
-                    'data': {'device_id': device_id, 'port': port},
-                    })
+        self._send(_codec.build_connect(self._version, self._tag, device_id, port))
         response = self._receive()
-        if response.header.message != usbmuxd_msgtype.RESULT:
+        if response.header.message != _codec.MSG_RESULT:
             raise MuxError(f'unexpected message type received: {response}')
 
-        if response.data.result != usbmuxd_result.OK:
+        if response.data.result != _codec.RESULT_OK:
             raise self._raise_mux_exception(int(response.data.result),
                                             f'failed to connect to device: {device_id} at port: {port}. reason: '
                                             f'{response.data.result}')
 
-    def _send(self, data: Mapping):
+    def _send(self, packet: bytes):
         self._assert_not_connected()
-        self._sock.send(usbmuxd_request.build(data))
+        self._sock.send(packet)
         self._tag += 1
 
-    def _receive(self, expected_tag: Optional[int] = None):
+    def _receive(self, expected_tag: Optional[int] = None) -> _codec.Packet:
         self._assert_not_connected()
-        response = usbmuxd_response.parse_stream(self._sock)
+        header = self._sock.recv(_codec.HEADER.size)
+        length, parsed = _codec.parse_header(header)
+        try:
+            body = self._sock.recv(length) if length > 0 else b''
+        except (BlockingIOError, socket.timeout):
+            # keep the stream aligned, the whole packet is read again by the next call
+            self._sock.unread(header)
+            raise
+        response = _codec.parse_body(parsed, body)
         if expected_tag and response.header.tag != expected_tag:
             raise MuxError(f'Reply tag mismatch: expected {expected_tag}, got {response.header.tag}')
         return response
 
     def _send_receive(self, message_type: int):
-        self._send({'header': {'version': self._version, 'message': message_type, 'tag': self._tag},
-                    'data': b''})
+        self._send(_codec.build(self._version, message_type, self._tag))
         response = self._receive(self._tag - 1)
-        if response.header.message != usbmuxd_msgtype.RESULT:
+        if response.header.message != _codec.MSG_RESULT:
             raise MuxError(f'unexpected message type received: {response}')
 
         result = response.data.result
-        if result != usbmuxd_result.OK:
+        if result != _codec.RESULT_OK:
             raise self._raise_mux_exception(int(result), f'{message_type} failed: error {result}')
 
     def _add_device(self, device: MuxDevice):
@@ -338,21 +409,29 @@ class BinaryMuxConnection(MuxConnection):
     def _remove_device(self, device_id: int):
         self.devices = [device for device in self.devices if device.devid != device_id]
 
-    def _receive_device_state_update(self):
+    def receive_event(self) -> Tuple[str, Union[MuxDevice, int]]:
         response = self._receive()
-        if response.header.message == usbmuxd_msgtype.ADD:
+        if response.header.message == _codec.MSG_ADD:
             # old protocol only supported USB devices
-            self._add_device(MuxDevice(response.data.device_id, response.data.serial_number, 'USB'))
-        elif response.header.message == usbmuxd_msgtype.REMOVE:
-            self._remove_device(response.data.device_id)
+            return 'Attached', MuxDevice(response.data.device_id, response.data.serial_number, 'USB')
+        elif response.header.message == _codec.MSG_REMOVE:
+            return 'Detached', response.data.device_id
+        raise MuxError(f'Invalid packet type received: {response}')
+
+    def _receive_device_state_update(self):
+        kind, data = self.receive_event()
+        if kind == 'Attached':
+            self._add_device(data)
+        elif kind == 'Detached':
+            self._remove_device(data)
         else:
-            raise MuxError(f'Invalid packet type received: {response}')
+            raise MuxError(f'Invalid packet type received: {kind}')
 
 
 class PlistMuxConnection(BinaryMuxConnection):
-    def __init__(self, sock: SafeStreamSocket):
-        super().__init__(sock)
-        self._version = usbmuxd_version.PLIST
+    def __init__(self, sock: SafeStreamSocket, usbmux_address: Optional[str] = None):
+        super().__init__(sock, usbmux_address)
+        self._version = _codec.VERSION_PLIST
 
     def listen(self) -> None:
         self._send_receive({'MessageType': 'Listen'})
@@ -366,32 +445,37 @@ class PlistMuxConnection(BinaryMuxConnection):
             raise NotPairedError('device should be paired first')
         return plistlib.loads(pair_record)
 
-    def get_device_list(self, timeout: float = None) -> None:
-        """ get device list synchronously without waiting the timeout """
+    def get_device_list(self, timeout: float = None, quiet: Optional[float] = None) -> None:
+        """ collect Attached events after Listen for timeout seconds, or until quiet """
         self.devices = []
+        start = time.time()
         self._send_receive({'MessageType': 'Listen'})
-        end = time.time() + timeout
-        self._sock.settimeout(timeout)
-        while time.time() < end:
-            try:
-                response = self._receive()
-                if response['MessageType'] == 'Attached':
-                    super()._add_device(MuxDevice(response['DeviceID'], response['Properties']['SerialNumber'],
-                                                response['Properties']['ConnectionType']))
-                elif response['MessageType'] == 'Detached':
-                    super()._remove_device(response['DeviceID'])
-                else:
-                    raise MuxError(f'Invalid packet type received: {response}')
-            except (BlockingIOError, StreamError):
-                continue
-            except IOError:
-                try:
-                    self._sock.setblocking(True)
-                    self.close()
-                except OSError:
-                    pass
-                raise MuxError('Exception in listener socket')
-        
+        self._collect_device_events(timeout, self._first_window(quiet, time.time() - start))
+
+    def read_device_list(self) -> List[MuxDevice]:
+        """ get the whole device list in one reply
+
+        Raises:
+            BadCommandError: usbmuxd does not support ListDevices
+        """
+        self._send({'MessageType': 'ListDevices'})
+        response = self._receive(self._tag - 1)
+        if 'DeviceList' not in response:
+            if response.get('MessageType') == 'Result' and response.get('Number'):
+                self._raise_mux_exception(response['Number'], f'ListDevices failed: {response}')
+            raise MuxError(f'got an invalid message: {response}')
+        self.devices = [MuxDevice(item['DeviceID'], item['Properties']['SerialNumber'],
+                                  item['Properties']['ConnectionType']) for item in response['DeviceList']]
+        return self.devices
+
+    def receive_event(self) -> Tuple[str, Union[MuxDevice, int]]:
+        response = self._receive()
+        if response['MessageType'] == 'Attached':
+            return 'Attached', MuxDevice(response['DeviceID'], response['Properties']['SerialNumber'],
+                                         response['Properties']['ConnectionType'])
+        if 'DeviceID' in response:
+            return response['MessageType'], response['DeviceID']
+        raise MuxError(f'Invalid packet type received: {response}')
 
     def get_buid(self) -> str:
         """ get SystemBUID """
@@ -409,17 +493,14 @@ class PlistMuxConnection(BinaryMuxConnection):
         self._send_receive({'MessageType': 'Connect', 'DeviceID': device_id, 'PortNumber': port})
 
     def _send(self, data: Mapping):
-        request = {'ClientVersionString': 'qt4i-usbmuxd', 'ProgName': 'pymobiledevice3', 'kLibUSBMuxVersion': 3}
-        request.update(data)
-        super()._send({'header': {'version': self._version,
-                                  'message': usbmuxd_msgtype.PLIST,
-                                  'tag': self._tag},
-                       'data': plistlib.dumps(request),
-                       })
+        super()._send(_codec.build_plist(self._tag, data))
 
     def _receive(self, expected_tag: Optional[int] = None) -> Mapping:
         response = super()._receive(expected_tag=expected_tag)
-        if response.header.message != usbmuxd_msgtype.PLIST:
+        if response.header.message == _codec.MSG_RESULT and response.header.version == _codec.VERSION_BINARY:
+            # a binary only usbmuxd rejects plist packets
+            self._raise_mux_exception(response.data.result, f'usbmuxd does not speak plist: {response}')
+        if response.header.message != _codec.MSG_PLIST:
             raise MuxError(f'Received non-plist type {response}')
         return plistlib.loads(response.data)
 
@@ -432,26 +513,106 @@ class PlistMuxConnection(BinaryMuxConnection):
             raise self._raise_mux_exception(response['Number'], f'got an error message: {response}')
 
 
-def create_mux(usbmux_address: Optional[str] = None) -> MuxConnection:
-    return MuxConnection.create(usbmux_address=usbmux_address)
+# usbmux_address -> (protocol version, pinned), negotiated once per process
+_protocol_versions: Dict[Optional[str], Tuple[int, bool]] = {}
+_protocol_versions_lock = threading.Lock()
+
+
+def get_protocol_version(usbmux_address: Optional[str] = None) -> Optional[int]:
+    """ pinned or negotiated protocol version of usbmux_address, None when unknown """
+    entry = _protocol_versions.get(usbmux_address)
+    return entry[0] if entry else None
+
 
+def set_protocol_version(version: Optional[int], usbmux_address: Optional[str] = None):
+    """ pin the protocol version of usbmux_address so that connections skip the probe, None unpins
 
-def list_devices(usbmux_address: Optional[str] = None) -> List[MuxDevice]:
-    mux = create_mux(usbmux_address=usbmux_address)
-    mux.get_device_list(0.1)
-    devices = mux.devices
-    mux.close()
-    return devices
+    Args:
+        version: VERSION_BINARY or VERSION_PLIST
+    """
+    with _protocol_versions_lock:
+        if version is None:
+            _protocol_versions.pop(usbmux_address, None)
+        else:
+            _protocol_versions[usbmux_address] = (version, True)
+
+
+def forget_protocol_version(usbmux_address: Optional[str] = None):
+    """ drop the negotiated version of usbmux_address, a pinned version is kept """
+    with _protocol_versions_lock:
+        entry = _protocol_versions.get(usbmux_address)
+        if entry and not entry[1]:
+            del _protocol_versions[usbmux_address]
+
+
+def _cache_protocol_version(usbmux_address: Optional[str], version: int):
+    with _protocol_versions_lock:
+        _protocol_versions.setdefault(usbmux_address, (version, False))
+
+
+def create_mux(usbmux_address: Optional[str] = None, timeout: Optional[float] = None,
+               version: Optional[int] = None) -> MuxConnection:
+    return MuxConnection.create(usbmux_address=usbmux_address, timeout=timeout, version=version)
+
+
+# usbmux_address -> running DeviceWatcher, see wdapy.usbmux.watcher.get_watcher
+_watchers: Dict[Optional[str], "DeviceWatcher"] = {}
+
+
+FAST = 'fast'
+COMPLETE = 'complete'
+
+# first gap allowed after Listen before the fast enumeration gives up waiting for more devices
+LISTEN_QUIET = 0.02
+
+# usbmux_address of daemons which answered ListDevices with BADCOMMAND
+_list_devices_unsupported = set()
 
 
-def select_device(udid: Optional[str] = None, connection_type: Optional[str] = None, usbmux_address: Optional[str] = None) \
+def list_devices(usbmux_address: Optional[str] = None, mode: str = FAST, timeout: float = 1.0,
+                 mux_timeout: Optional[float] = None) -> List[MuxDevice]:
+    """
+    Args:
+        mode: FAST returns as soon as the list is known: one ListDevices request when usbmuxd supports it,
+            otherwise Listen until usbmuxd goes quiet. COMPLETE listens for the whole timeout, so devices
+            which are still being attached are included
+        timeout: longest time to listen for Attached events
+        mux_timeout: socket timeout while talking to usbmuxd, also caps timeout, None waits forever
+
+    Raises:
+        socket.timeout: usbmuxd did not answer within mux_timeout
+    """
+    if mode not in (FAST, COMPLETE):
+        raise ValueError(f'unknown mode: {mode}')
+    watcher = _watchers.get(usbmux_address)
+    if watcher is not None and watcher.ready:
+        return watcher.devices
+    if mux_timeout is not None:
+        timeout = min(timeout, mux_timeout)
+    mux = create_mux(usbmux_address=usbmux_address, timeout=mux_timeout)
+    try:
+        if mode == COMPLETE:
+            mux.get_device_list(timeout)
+            return mux.devices
+        if isinstance(mux, PlistMuxConnection) and usbmux_address not in _list_devices_unsupported:
+            try:
+                return mux.read_device_list()
+            except BadCommandError:
+                _list_devices_unsupported.add(usbmux_address)
+        mux.get_device_list(timeout, quiet=LISTEN_QUIET)
+        return mux.devices
+    finally:
+        mux.close()
+
+
+def pick_device(devices: List[MuxDevice], udid: Optional[str] = None, connection_type: Optional[str] = None) \
         -> Optional[MuxDevice]:
     """
-    select a UsbMux device according to given arguments.
+    pick a UsbMux device from devices according to given arguments.
     if more than one device could be selected, always prefer the usb one.
     """
     tmp = None
-    for device in list_devices(usbmux_address=usbmux_address):
+    for device in devices:
         if connection_type is not None and device.connection_type != connection_type:
             # if a specific connection_type was desired and not of this one then skip
             continue
@@ -470,6 +631,17 @@ def select_device(udid: Optional[str] = None, connection_type: Optional[str] = N
     return tmp
 
 
+def select_device(udid: Optional[str] = None, connection_type: Optional[str] = None, usbmux_address: Optional[str] = None,
+                  mode: str = FAST, mux_timeout: Optional[float] = None) -> Optional[MuxDevice]:
+    """
+    select a UsbMux device according to given arguments.
+    if more than one device could be selected, always prefer the usb one.
+    mux_timeout is passed to list_devices.
+    """
+    devices = list_devices(usbmux_address=usbmux_address, mode=mode, mux_timeout=mux_timeout)
+    return pick_device(devices, udid, connection_type)
+
+
 def select_devices_by_connection_type(connection_type: str, usbmux_address: Optional[str] = None) -> List[MuxDevice]:
     """
     select all UsbMux devices by connection type
@@ -484,13 +656,22 @@ def select_devices_by_connection_type(connection_type: str, usbmux_address: Opti
 
 
 class USBMuxHTTPConnection(HTTPConnection):
-    def __init__(self, device: MuxDevice, port=8100):
+    def __init__(self, device: MuxDevice, port=8100, usbmux_address: Optional[str] = None):
         super().__init__("localhost", port)
+        self.prefetched = False  # connected with a tunnel opened ahead of demand
         self.__device = device
         self.__port = port
+        self.__usbmux_address = usbmux_address
 
     def connect(self):
-        self.sock = self.__device.connect(self.__port)
+        timeout = None if self.timeout is socket._GLOBAL_DEFAULT_TIMEOUT else self.timeout
+        pool = tunnels.get_tunnel_pool(self.__device, self.__port, self.__usbmux_address)
+        if pool is None:
+            # bound usbmuxd handshake and Connect request too, not only the HTTP exchange
+            self.sock = self.__device.connect(self.__port, usbmux_address=self.__usbmux_address, timeout=timeout)
+            return
+        # a ready tunnel may still turn out dead on first use, like an idle keep-alive connection
+        self.sock, self.prefetched = pool.acquire(timeout)
 
     def __enter__(self) -> HTTPConnection:
         return self
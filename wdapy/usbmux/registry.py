@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cache udid -> MuxDevice resolution, so that steady-state requests skip device enumeration
+"""
+
+import threading
+from typing import Dict, Optional, Tuple
+
+from wdapy.usbmux import tunnels
+from wdapy.usbmux.exceptions import BadDevError
+from wdapy.usbmux.pyusbmux import MuxDevice, select_device
+
+
+def _normalize_udid(udid: str) -> str:
+    # serials are saved inside usbmuxd without '-'
+    return udid.replace('-', '')
+
+
+class DeviceRegistry:
+    """ resolve udid to MuxDevice once and keep it until the device is detached or broken """
+
+    def __init__(self, usbmux_address: Optional[str] = None):
+        self._usbmux_address = usbmux_address
+        self._lock = threading.Lock()
+        self._devices: Dict[Tuple[str, Optional[str]], MuxDevice] = {}
+
+    def resolve(self, udid: str, connection_type: Optional[str] = None, timeout: Optional[float] = None) -> MuxDevice:
+        """
+        Args:
+            timeout: bounds device enumeration when udid is not cached, None waits forever
+
+        Raises:
+            BadDevError: device not found
+            socket.timeout: usbmuxd did not answer in time
+        """
+        device = self.lookup(udid, connection_type)
+        if device is not None:
+            return device
+        device = select_device(udid, connection_type=connection_type, usbmux_address=self._usbmux_address,
+                               mux_timeout=timeout)
+        if device is None:
+            raise BadDevError(f"device {udid!r} not found")
+        self.register(udid, device, connection_type)
+        return device
+
+    def lookup(self, udid: str, connection_type: Optional[str] = None) -> Optional[MuxDevice]:
+        """ return cached device without enumeration """
+        with self._lock:
+            return self._devices.get((_normalize_udid(udid), connection_type))
+
+    def register(self, udid: str, device: MuxDevice, connection_type: Optional[str] = None):
+        with self._lock:
+            self._devices[(_normalize_udid(udid), connection_type)] = device
+
+    def invalidate(self, udid: Optional[str] = None):
+        """ drop cached device of udid, or all devices when udid is None """
+        with self._lock:
+            if udid is None:
+                self._devices.clear()
+                return
+            serial = _normalize_udid(udid)
+            for key in [key for key in self._devices if key[0] == serial]:
+                del self._devices[key]
+
+    def on_detached(self, devid: int):
+        """ drop cached device and its ready tunnels when usbmuxd reports it detached """
+        with self._lock:
+            for key in [key for key, device in self._devices.items() if device.devid == devid]:
+                del self._devices[key]
+        tunnels.close_tunnel_pools(devid, self._usbmux_address)
+
+    def __contains__(self, udid: str) -> bool:
+        serial = _normalize_udid(udid)
+        with self._lock:
+            return any(key[0] == serial for key in self._devices)
+
+
+_registries: Dict[Optional[str], DeviceRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(usbmux_address: Optional[str] = None) -> DeviceRegistry:
+    """ get the process wide registry of usbmux_address """
+    with _registries_lock:
+        registry = _registries.get(usbmux_address)
+        if registry is None:
+            registry = _registries[usbmux_address] = DeviceRegistry(usbmux_address)
+        return registry
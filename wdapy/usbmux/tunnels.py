@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tunneled sockets to a device port, opened ahead of demand
+
+A tunnel costs a usbmuxd connection, a protocol handshake and a Connect request. Prefetching
+is off by default: it keeps device connections open and a thread running per (device, port).
+Once enabled, the pool of a (device, port) is created by the first USBMuxHTTPConnection.connect()
+to it; from then on a background thread keeps `size` tunnels open, so later connects take a ready one.
+
+Usage:
+    tunnels.set_pool_size(2)  # tunnels kept ready per (device, port), 0 (the default) disables prefetching
+    pool = tunnels.get_tunnel_pool(device, 8100)
+    sock, reused = pool.acquire(timeout=10)
+"""
+
+import collections
+import logging
+import socket
+import threading
+import time
+from typing import TYPE_CHECKING, Counter, Deque, Dict, List, Optional, Tuple
+
+from wdapy._pool import is_readable
+from wdapy.usbmux.exceptions import MuxError
+
+if TYPE_CHECKING:
+    from wdapy.usbmux.pyusbmux import MuxDevice
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_MAX_IDLE = 60.0
+CONNECT_TIMEOUT = 5.0
+
+
+def is_tunnel_alive(sock: socket.socket) -> bool:
+    """ nothing is sent to an unused tunnel; readable means EOF (device or service gone) or unexpected data """
+    try:
+        return not is_readable(sock)
+    except (OSError, ValueError):
+        return False
+
+
+class TunnelPool:
+    """ ready tunnels to one port of one device, topped up by a background thread
+
+    The thread stops, and the pool closes itself, when opening a tunnel fails: the device
+    is gone or the port is not listening. get_tunnel_pool() creates a new pool on next use.
+    """
+
+    def __init__(self, device: "MuxDevice", port: int, size: int = DEFAULT_POOL_SIZE,
+                 usbmux_address: Optional[str] = None, max_idle: float = DEFAULT_MAX_IDLE):
+        """
+        Args:
+            size: tunnels kept open
+            max_idle: tunnels open longer than this (seconds) are closed instead of used
+        """
+        self.device = device
+        self.port = port
+        self.size = size
+        self.usbmux_address = usbmux_address
+        self.max_idle = max_idle
+        self.last_error: Optional[Exception] = None
+        self._idle: Deque[Tuple[socket.socket, float]] = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Counter[str] = collections.Counter()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def idle(self) -> int:
+        """ number of ready tunnels """
+        with self._cond:
+            return len(self._idle)
+
+    def stats(self) -> Dict[str, int]:
+        """ hits, misses (opened on demand), opened (in background) and stale (discarded) """
+        with self._cond:
+            return {key: self._stats[key] for key in ("hits", "misses", "opened", "stale")}
+
+    def acquire(self, timeout: Optional[float] = None) -> Tuple[socket.socket, bool]:
+        """ take a ready tunnel, or open one now when none is ready
+
+        Args:
+            timeout: socket timeout set on the returned socket, also bounds opening a new tunnel
+
+        Returns:
+            (socket, whether it was taken from the pool)
+
+        Raises:
+            MuxError, OSError: from opening a new tunnel
+        """
+        stale: List[socket.socket] = []
+        sock = None
+        with self._cond:
+            now = time.monotonic()
+            while self._idle:
+                candidate, opened_at = self._idle.popleft()
+                if now - opened_at > self.max_idle or not is_tunnel_alive(candidate):
+                    stale.append(candidate)
+                    continue
+                sock = candidate
+                break
+            self._stats["stale"] += len(stale)
+            self._stats["hits" if sock is not None else "misses"] += 1
+            if not self._closed:
+                self._ensure_thread()
+                self._cond.notify()
+        for s in stale:
+            s.close()
+        if sock is None:
+            return self.device.connect(self.port, usbmux_address=self.usbmux_address, timeout=timeout), False
+        sock.settimeout(timeout)
+        return sock, True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [sock for sock, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for sock in idle:
+            sock.close()
+        _forget_pool(self)
+
+    def _ensure_thread(self):
+        # called with the condition held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"usbmux-tunnels-{self.device.devid}:{self.port}",
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and len(self._idle) >= self.size:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            try:
+                sock = self.device.connect(self.port, usbmux_address=self.usbmux_address, timeout=CONNECT_TIMEOUT)
+            except (MuxError, OSError) as e:
+                logger.debug("stop prefetching tunnels to %s:%d: %s", self.device.serial, self.port, e)
+                self.last_error = e
+                self.close()
+                return
+            with self._cond:
+                if not self._closed:
+                    self._idle.append((sock, time.monotonic()))
+                    self._stats["opened"] += 1
+                    sock = None
+            if sock is not None:
+                sock.close()
+                return
+
+
+_PoolKey = Tuple[Optional[str], int, str, int]
+
+_pools: Dict[_PoolKey, TunnelPool] = {}
+_pools_lock = threading.Lock()
+_pool_size = 0
+
+
+def _pool_key(device: "MuxDevice", port: int, usbmux_address: Optional[str]) -> _PoolKey:
+    return usbmux_address, device.devid, device.serial, port
+
+
+def _forget_pool(pool: TunnelPool):
+    key = _pool_key(pool.device, pool.port, pool.usbmux_address)
+    with _pools_lock:
+        if _pools.get(key) is pool:
+            del _pools[key]
+
+
+def get_tunnel_pool(device: "MuxDevice", port: int, usbmux_address: Optional[str] = None) \
+        -> Optional[TunnelPool]:
+    """ get the process wide pool of (device, port), None when prefetching is disabled """
+    if _pool_size <= 0:
+        return None
+    key = _pool_key(device, port, usbmux_address)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            pool = _pools[key] = TunnelPool(device, port, _pool_size, usbmux_address)
+        return pool
+
+
+def set_pool_size(size: int):
+    """ tunnels kept ready per (device, port) for pools created from now on, 0 (the default) disables prefetching
+
+    Args:
+        size: e.g. DEFAULT_POOL_SIZE
+    """
+    global _pool_size
+    _pool_size = size
+    if size <= 0:
+        close_tunnel_pools()
+
+
+def close_tunnel_pools(devid: Optional[int] = None, usbmux_address: Optional[str] = None):
+    """ close the pools of devid on usbmux_address, or every pool when devid is None """
+    with _pools_lock:
+        pools = [pool for pool in _pools.values()
+                 if devid is None or (pool.device.devid == devid and pool.usbmux_address == usbmux_address)]
+    for pool in pools:
+        pool.close()
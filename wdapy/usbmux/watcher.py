@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Keep one Listen connection to usbmuxd open and an always-current device table
+
+Usage:
+    watcher = get_watcher()  # process wide, list_devices() and select_device() answer from it from now on
+    watcher.add_listener(lambda event: print(event.kind, event.device.serial))
+
+    for event in watcher.events():  # current devices first, then attach/detach as they happen
+        print(event.kind, event.device)
+
+    with DeviceWatcher(usbmux_address="/tmp/usbmuxd") as watcher:  # a private one
+        watcher.wait_ready(1)
+        print(watcher.devices)
+"""
+
+import logging
+import queue
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+
+from wdapy.usbmux import pyusbmux
+from wdapy.usbmux.exceptions import MuxError
+from wdapy.usbmux.pyusbmux import MuxConnection, MuxDevice, create_mux, pick_device
+from wdapy.usbmux.registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+ATTACHED = "attached"
+DETACHED = "detached"
+
+
+@dataclass(frozen=True)
+class DeviceEvent:
+    kind: str  # ATTACHED or DETACHED
+    device: MuxDevice
+
+
+Listener = Callable[[DeviceEvent], None]
+
+
+class DeviceWatcher:
+    """ watch usbmuxd in a background thread, reconnect when usbmuxd restarts """
+
+    def __init__(self, usbmux_address: Optional[str] = None, reconnect_delay: float = 1.0, settle: float = 0.05):
+        """
+        Args:
+            reconnect_delay: seconds between connection attempts while usbmuxd is down
+            settle: the device table is ready once usbmuxd is quiet for settle seconds after Listen
+        """
+        self.usbmux_address = usbmux_address
+        self.reconnect_delay = reconnect_delay
+        self.settle = settle
+        self.connections = 0
+        self._devices: Dict[int, MuxDevice] = {}
+        self._listeners: List[Listener] = []
+        self._queues: List[queue.Queue] = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._mux: Optional[MuxConnection] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "DeviceWatcher":
+        self._thread = threading.Thread(target=self._run, name="usbmux-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        mux = self._mux
+        if mux is not None:
+            mux.close()
+        if self._thread is not None:
+            self._thread.join()
+        self._ready.clear()
+        with self._lock:
+            for q in self._queues:
+                q.put(None)
+        if pyusbmux._watchers.get(self.usbmux_address) is self:
+            del pyusbmux._watchers[self.usbmux_address]
+
+    def __enter__(self) -> "DeviceWatcher":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def ready(self) -> bool:
+        """ connected to usbmuxd and the device table is complete """
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    @property
+    def devices(self) -> List[MuxDevice]:
+        with self._lock:
+            return list(self._devices.values())
+
+    def select_device(self, udid: Optional[str] = None, connection_type: Optional[str] = None) \
+            -> Optional[MuxDevice]:
+        return pick_device(self.devices, udid, connection_type)
+
+    def add_listener(self, listener: Listener):
+        """ listener is called in the watcher thread, it should return quickly """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def events(self, initial: bool = True, timeout: Optional[float] = None) -> Iterator[DeviceEvent]:
+        """ yield events until the watcher is closed, or no event came in timeout seconds
+
+        Events are collected from this call on, close() the iterator when it is not exhausted
+
+        Args:
+            initial: yield an ATTACHED event for every current device first
+        """
+        q: queue.Queue = queue.Queue()
+        with self._lock:
+            if initial:
+                for device in self._devices.values():
+                    q.put(DeviceEvent(ATTACHED, device))
+            self._queues.append(q)
+        return _EventIterator(self, q, timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._watch()
+            except (MuxError, OSError) as e:
+                if self._stop.is_set():
+                    break
+                logger.info("usbmuxd listener lost: %s, reconnect in %.1f seconds", e, self.reconnect_delay)
+            finally:
+                self._ready.clear()
+                self._mux = None
+            self._stop.wait(self.reconnect_delay)
+
+    def _watch(self):
+        mux = create_mux(self.usbmux_address)
+        self._mux = mux
+        try:
+            if self._stop.is_set():
+                return
+            mux.listen()
+            self.connections += 1
+            # usbmuxd replays the attached devices after Listen, there is no end marker
+            mux.settimeout(self.settle)
+            seen = set()
+            while not self._stop.is_set():
+                try:
+                    kind, data = mux.receive_event()
+                except socket.timeout:
+                    if not self._ready.is_set():
+                        # devices gone while usbmuxd was down (or restarting) are not replayed
+                        for device in self.devices:
+                            if device.devid not in seen:
+                                self._detach(device.devid)
+                        self._ready.set()
+                        mux.settimeout(None)
+                    continue
+                if kind == "Attached":
+                    seen.add(data.devid)
+                    self._attach(data)
+                elif kind == "Detached":
+                    seen.discard(data)
+                    self._detach(data)
+        finally:
+            mux.close()
+
+    def _attach(self, device: MuxDevice):
+        event = DeviceEvent(ATTACHED, device)
+        with self._lock:
+            if self._devices.get(device.devid) == device:
+                return
+            self._devices[device.devid] = device
+            listeners = self._enqueue(event)
+        self._notify(listeners, event)
+
+    def _detach(self, devid: int):
+        get_registry(self.usbmux_address).on_detached(devid)
+        with self._lock:
+            device = self._devices.pop(devid, None)
+            if device is None:
+                return
+            event = DeviceEvent(DETACHED, device)
+            listeners = self._enqueue(event)
+        self._notify(listeners, event)
+
+    def _enqueue(self, event: DeviceEvent) -> List[Listener]:
+        # called with the table lock held, so events() never misses or repeats a change
+        for q in self._queues:
+            q.put(event)
+        return list(self._listeners)
+
+    @staticmethod
+    def _notify(listeners: List[Listener], event: DeviceEvent):
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("device listener %r failed", listener)
+
+
+class _EventIterator:
+    def __init__(self, watcher: DeviceWatcher, q: queue.Queue, timeout: Optional[float]):
+        self._watcher = watcher
+        self._queue = q
+        self._timeout = timeout
+        self._closed = False
+
+    def __iter__(self) -> "_EventIterator":
+        return self
+
+    def __next__(self) -> DeviceEvent:
+        if self._closed:
+            raise StopIteration
+        try:
+            event = self._queue.get(timeout=self._timeout)
+        except queue.Empty:
+            event = None
+        if event is None:
+            self.close()
+            raise StopIteration
+        return event
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        with self._watcher._lock:
+            self._watcher._queues.remove(self._queue)
+
+    def __del__(self):
+        # without the lock, the garbage collector may run while the watcher thread holds it
+        if not self._closed:
+            self._closed = True
+            try:
+                self._watcher._queues.remove(self._queue)
+            except ValueError:
+                pass
+
+
+_watchers_lock = threading.Lock()
+
+
+def get_watcher(usbmux_address: Optional[str] = None, wait: float = 1.0) -> DeviceWatcher:
+    """ get the process wide watcher of usbmux_address, started on first call
+
+    While it is connected, pyusbmux.list_devices and select_device answer from its table without enumeration.
+
+    Args:
+        wait: seconds to wait for the device table on first call
+    """
+    with _watchers_lock:
+        watcher = pyusbmux._watchers.get(usbmux_address)
+        if watcher is None:
+            watcher = pyusbmux._watchers[usbmux_address] = DeviceWatcher(usbmux_address).start()
+    watcher.wait_ready(wait)
+    return watcher